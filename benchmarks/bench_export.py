@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Throughput of the exporters.
+
+Exports synthetic transcriptions of increasing size to every format and
+reports segments per second and the peak memory of a process doing only
+that export, which should not grow with the size of the transcription.
+
+"""
+
+from __future__ import print_function
+
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from transcribe import export, timecode
+
+SIZES = (100000, 300000, 1000000)
+LINE = '%s Interviewee: well, it was a long time ago,\nI think. Or not.\n'
+
+
+def write_transcription(fname, segments):
+    with open(fname, 'w') as f:
+        for i in range(segments):
+            f.write(LINE % timecode.format_mark(i * 3.7))
+
+
+def run(args):
+    """Export in a new process, to measure its own peak memory."""
+    fname, output, format = args
+    start = time.time()
+    export.export(fname, output, format, None)
+    elapsed = time.time() - start
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    context = multiprocessing.get_context('spawn')
+    print('%8s %6s %12s %14s %12s' % ('segments', 'format', 'seconds',
+                                      'segments/s', 'peak KiB'))
+    try:
+        for size in SIZES:
+            fname = os.path.join(tmpdir, 'transcription.txt')
+            write_transcription(fname, size)
+            for format in sorted(export.WRITERS):
+                output = os.path.join(tmpdir, 'export.' + format)
+                pool = context.Pool(1)
+                elapsed, peak = pool.apply(run, ((fname, output, format),))
+                pool.close()
+                pool.join()
+                print('%8d %6s %12.2f %14d %12d' % (size, format, elapsed,
+                                                    size / elapsed, peak))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
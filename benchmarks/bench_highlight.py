@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Keystroke latency on large transcriptions.
+
+Shows a text view set up as the application does, with a synthetic
+transcription of 1k to 500k lines, and types in the middle of it: a
+character, a new line, a deletion.  The latency of a keystroke is the
+time until the main loop is idle again, with the view redrawn and the
+highlighting done.  It is measured with the GtkSource language over the
+whole buffer and with the highlighting of the lines shown only.
+
+Needs a display.
+
+Usage: bench_highlight.py [lines ...]
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gi
+gi.require_version('Gtk', '3.0')
+gi.require_version('GtkSource', '4')
+from gi.repository import Gtk, GtkSource
+
+from transcribe import highlight, timecode
+from transcribe.transcribe import Transcribe
+
+SIZES = (1000, 10000, 100000, 500000)
+KEYSTROKES = 100
+LINE = '%s Interviewee: well, it was a long time ago, I think.'
+
+
+def make_document(lines):
+    return '\n'.join(LINE % timecode.format_mark(i * 3.7)
+                     for i in range(lines))
+
+
+def settle():
+    """Run the main loop until there is nothing left to do."""
+    while Gtk.events_pending():
+        Gtk.main_iteration_do(False)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def measure(text, large):
+    """Return the latencies of KEYSTROKES keystrokes, in seconds."""
+    window = Gtk.Window()
+    window.set_default_size(800, 600)
+    sw = Gtk.ScrolledWindow()
+    buffer = GtkSource.Buffer()
+    view = GtkSource.View.new_with_buffer(buffer)
+    view.set_wrap_mode(Gtk.WrapMode.WORD_CHAR)
+    view.set_pixels_below_lines(Transcribe.SPACE_BELOW_LINES)
+    sw.add(view)
+    window.add(sw)
+
+    lm = GtkSource.LanguageManager()
+    path = lm.get_search_path()
+    path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'transcribe'))
+    lm.set_search_path(path)
+    buffer.set_highlight_syntax(False)
+    buffer.set_language(lm.get_language('transcribe'))
+    buffer.set_text(text)
+    window.show_all()
+
+    middle = buffer.get_iter_at_line(buffer.get_line_count() // 2)
+    buffer.place_cursor(middle)
+    view.scroll_to_iter(middle, 0.0, True, 0.0, 0.5)
+
+    highlighter = None
+    if large:
+        highlighter = highlight.ViewportHighlighter(
+            view, buffer.get_style_scheme())
+    else:
+        buffer.set_highlight_syntax(True)
+    settle()
+
+    times = []
+    for i in range(KEYSTROKES):
+        start = time.time()
+        if i % 10 == 9:
+            buffer.insert_at_cursor('\n')
+        elif i % 10 == 4:
+            end = buffer.get_iter_at_mark(buffer.get_insert())
+            begin = end.copy()
+            begin.backward_char()
+            buffer.delete(begin, end)
+        else:
+            buffer.insert_at_cursor('a')
+        settle()
+        times.append(time.time() - start)
+
+    if highlighter is not None:
+        highlighter.close()
+    window.destroy()
+    settle()
+    return times
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    print('%8s %-10s %10s %10s %10s' % ('lines', 'highlight', 'p50 ms',
+                                        'p90 ms', 'max ms'))
+    for lines in sizes:
+        text = make_document(lines)
+        for large in (False, True):
+            times = measure(text, large)
+            print('%8d %-10s %10.1f %10.1f %10.1f' %
+                  (lines, 'shown' if large else 'language',
+                   percentile(times, 50) * 1000,
+                   percentile(times, 90) * 1000, max(times) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Playing audio from an HTTP server, with a cold and a warm cache.
+
+Serves a fixture from a local HTTP/1.1 server that does Range requests
+and keep-alive, and waits LATENCY before every response, as a server
+across the network would.  Then plays it into a fakesink and reports:
+
+  first audio   from creating the player to the first buffer rendered
+  seek          from a seek to the first buffer rendered after it
+
+first with an empty block cache and then with the blocks of the first
+run in it, and how many requests and connections the server got.  The
+cache directory is a temporary one.
+
+Usage: bench_http.py [latency in ms, default 50]
+
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Before GLib reads it
+CACHE_HOME = tempfile.mkdtemp()
+os.environ['XDG_CACHE_HOME'] = CACHE_HOME
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from transcribe import pipeline, remote
+
+DURATION = 600      # Seconds of audio in the fixture
+SEEKS = 10
+TIMEOUT = 30
+RANGE = re.compile(r'bytes=(\d+)-(\d*)')
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, directory, latency):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), RangeHandler)
+        self.directory = directory
+        self.latency = latency
+        self.requests = 0
+        self.connections = 0
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serve the files of the directory, with Range and keep-alive."""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        path = os.path.join(self.server.directory,
+                            os.path.basename(self.path))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            self.send_error(404)
+            return
+
+        match = RANGE.match(self.headers.get('Range', ''))
+        if match is None:
+            self.send_response(200)
+            start, end = 0, len(data) - 1
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%d' % (start, end, len(data)))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.wfile.write(data[start:end + 1])
+
+
+def make_fixture(fname):
+    buffers = DURATION * 44100 // 1024
+    launch = Gst.parse_launch(
+        'audiotestsrc num-buffers=%d samplesperbuffer=1024 wave=pink-noise ! '
+        'audioconvert ! vorbisenc ! oggmux ! filesink location="%s"' %
+        (buffers, fname))
+    launch.set_state(Gst.State.PLAYING)
+    launch.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    launch.set_state(Gst.State.NULL)
+
+
+class Player(object):
+    """An Audio into a fakesink that tells when a buffer is rendered."""
+
+    def __init__(self, uri):
+        self.loop = GLib.MainLoop()
+        self.waiting = False
+        self.audio = pipeline.Audio(uri, 'fakesink')
+        self.audio.playbin.create_sink()
+        sink = self.audio.playbin.playbin.get_property('audio-sink')
+        if isinstance(sink, Gst.Bin):
+            sink = next(element for element in sink.iterate_sinks())
+        sink.set_property('signal-handoffs', True)
+        sink.connect('handoff', self.on_handoff)
+
+    def on_handoff(self, sink, buffer, pad):
+        if self.waiting:
+            self.waiting = False
+            GLib.idle_add(self.loop.quit)
+
+    def wait(self):
+        """Run the main loop until the next buffer is rendered."""
+        self.waiting = True
+        timeout = GLib.timeout_add_seconds(TIMEOUT, self.loop.quit)
+        self.loop.run()
+        GLib.source_remove(timeout)
+        if self.waiting:
+            raise RuntimeError('timed out')
+
+
+def run(uri, rand):
+    """Return the time to the first audio and the seek latencies."""
+    start = time.time()
+    player = Player(uri)
+    player.audio.play(1.0, 0)
+    player.wait()
+    first = time.time() - start
+
+    seeks = []
+    for i in range(SEEKS):
+        start = time.time()
+        player.audio.seek(rand.uniform(0, DURATION - 10))
+        player.wait()
+        seeks.append(time.time() - start)
+    player.audio.close()
+    return first, seeks
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.05
+    Gst.init(None)
+    directory = tempfile.mkdtemp()
+    server = Server(directory, latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        make_fixture(os.path.join(directory, 'fixture.ogg'))
+        uri = 'http://127.0.0.1:%d/fixture.ogg' % server.server_address[1]
+        print('server latency %.0f ms, blocks of %d KiB' %
+              (latency * 1000, remote.BLOCK_SIZE // 1024))
+        print('%-6s %14s %10s %10s %10s %12s' % ('', 'first audio ms',
+                                                 'seek p50', 'seek max',
+                                                 'requests', 'connections'))
+        for kind in ('cold', 'warm'):
+            # The same seeks both times
+            requests, connections = server.requests, server.connections
+            first, seeks = run(uri, random.Random(1))
+            print('%-6s %14.0f %10.0f %10.0f %10d %12d' %
+                  (kind, first * 1000, median(seeks) * 1000,
+                   max(seeks) * 1000, server.requests - requests,
+                   server.connections - connections))
+    finally:
+        server.shutdown()
+        remote.POOL.clear()
+        shutil.rmtree(directory)
+        shutil.rmtree(CACHE_HOME)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Autosave cost: edit journal against a full rewrite.
+
+On a 10 MB transcription, compares saving the whole file after each
+edit with appending the edit to the journal, fsync'd per edit and in
+batches (as the flush timer does while typing).
+
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gi.repository import GLib
+
+from transcribe.journal import Journal
+
+SIZE = 10 * 1024 * 1024
+EDITS = 200
+BATCH = 20
+LINE = 'Interviewee: well, it was a long time ago, I think. #0:12:34.5#\n'
+
+
+def main():
+    random.seed(0)
+    directory = tempfile.mkdtemp()
+    fname = os.path.join(directory, 'transcription.txt')
+    content = (LINE * (SIZE // len(LINE))).encode('utf-8')
+
+    try:
+        start = time.time()
+        for i in range(EDITS // 10):
+            GLib.file_set_contents(fname, content)
+        rewrite = (time.time() - start) / (EDITS // 10)
+
+        journal = Journal(fname)
+        start = time.time()
+        for i in range(EDITS):
+            journal.record_insert(random.randrange(len(content)), 'word ')
+            journal.flush()
+        single = (time.time() - start) / EDITS
+
+        start = time.time()
+        for i in range(EDITS):
+            journal.record_delete(random.randrange(len(content)), 1)
+            if i % BATCH == BATCH - 1:
+                journal.flush()
+        batched = (time.time() - start) / EDITS
+        journal.file.close()
+
+        print('full rewrite:        %10.3f ms/save' % (rewrite * 1000))
+        print('journal, per edit:   %10.3f ms/edit' % (single * 1000))
+        print('journal, batch of %d: %9.3f ms/edit' % (BATCH, batched * 1000))
+        print('speed-up per edit:   %10.0fx' % (rewrite / single))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Throughput and time-to-first-paint of the transcription loader.
+
+For synthetic transcriptions of increasing size, reports the lines per
+second of the mark scanner alone, of a full load into a text buffer,
+and the time until the first chunk is in the buffer (which is when the
+window can paint text).
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GLib
+
+from transcribe.loader import TranscriptionLoader
+from transcribe.timecode import scan
+from transcribe.marks import MarkIndex
+
+SIZES = (1000, 10000, 100000, 500000)
+LINE = 'Interviewee: well, it was a long time ago, I think. #%d:%02d:%02d.%d#\n'
+
+
+def write_transcription(fname, lines):
+    with open(fname, 'w') as f:
+        for i in range(lines):
+            tm = i * 3.7
+            f.write(LINE % (tm // 3600, tm % 3600 // 60, tm % 60, tm * 10 % 10))
+
+
+def load(fname):
+    buffer = Gtk.TextBuffer()
+    marks = MarkIndex(buffer)
+    loop = GLib.MainLoop()
+    first = []
+
+    def on_progress(loader, fraction):
+        if not first:
+            first.append(time.time())
+
+    loader = TranscriptionLoader(buffer, marks, fname)
+    loader.connect('progress', on_progress)
+    loader.connect('finished', lambda loader: loop.quit())
+
+    start = time.time()
+    loader.start()
+    loop.run()
+    end = time.time()
+
+    return first[0] - start, end - start, len(marks)
+
+
+def main():
+    print('%8s %14s %14s %12s %10s' % ('lines', 'scan (l/s)', 'load (l/s)',
+                                       'first (ms)', 'marks'))
+
+    fd, fname = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    try:
+        for lines in SIZES:
+            write_transcription(fname, lines)
+
+            with open(fname) as f:
+                text = f.read()
+            start = time.time()
+            scan(text)
+            scan_rate = lines / (time.time() - start)
+
+            first, total, count = load(fname)
+            print('%8d %14d %14d %12.1f %10d' % (lines, scan_rate,
+                                                 lines / total, first * 1000,
+                                                 count))
+    finally:
+        os.unlink(fname)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""A-B loop restart gaps, against Audio.LOOP_RESTART_BUDGET.
+
+Plays a short loop in real time into a synchronized fakesink and
+takes the gaps Audio records: how late the first buffer of every
+restart reaches the sink, that is, the silence between the end of the
+loop and its start.  Exits with 1 when the 95th percentile is over the
+budget.
+
+"""
+
+from __future__ import print_function
+
+import collections
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from transcribe import pipeline
+from bench_open import make_fixture
+
+LOOP_START = 10.0
+LOOP_LENGTH = 0.25  # Short, to restart often
+RUN = 30            # Seconds to play
+
+
+def sync_sink(audio):
+    sink = audio.playbin.playbin.get_property('audio-sink')
+    if isinstance(sink, Gst.Bin):
+        sink.iterate_sinks().foreach(lambda e: e.set_property('sync', True))
+    else:
+        sink.set_property('sync', True)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    fname = os.path.join(tmpdir, 'fixture.ogg')
+    try:
+        make_fixture(fname)
+
+        loop = GLib.MainLoop()
+        audio = pipeline.Audio(fname, 'fakesink')
+        audio.loop_gaps = collections.deque()  # All of them
+        restarts = [0]
+
+        def on_segment_done(bus, message):
+            restarts[0] += 1
+
+        audio.bus.connect('message::segment-done', on_segment_done)
+
+        audio.set_loop(LOOP_START, LOOP_START + LOOP_LENGTH)
+        audio.play(1.0, LOOP_START)
+        sync_sink(audio)
+        GLib.timeout_add_seconds(RUN, loop.quit)
+        loop.run()
+        audio.stop()
+        gaps = list(audio.loop_gaps)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if not gaps:
+        print('The loop never restarted')
+        return 1
+
+    budget = pipeline.Audio.LOOP_RESTART_BUDGET
+    p95 = percentile(gaps, 0.95)
+    print('%d restarts in %d s (expected about %d), %d measured' %
+          (restarts[0], RUN, RUN / LOOP_LENGTH, len(gaps)))
+    print('restart gap: median %.2f ms, p95 %.2f ms, max %.2f ms, '
+          'budget %.2f ms' % (percentile(gaps, 0.5) * 1000, p95 * 1000,
+                              max(gaps) * 1000, budget * 1000))
+    if p95 > budget:
+        print('OVER BUDGET')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Click-to-seek latency of the audio mark index.
+
+Builds buffers with 100 to 50k audio marks and measures the time to
+resolve a click (an offset in the buffer) to an audio position, plus
+the cost of typing in the middle of the document.  The latency should
+stay flat as the number of marks grows.
+
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk
+
+from transcribe.marks import MarkIndex
+
+SIZES = (100, 1000, 5000, 10000, 20000, 50000)
+CLICKS = 2000
+PARAGRAPH = 'Interviewer: and then what happened after that? '
+
+
+def build(count):
+    buffer = Gtk.TextBuffer()
+    index = MarkIndex(buffer)
+
+    chunks, marks, offset = [], [], 0
+    for i in range(count):
+        position = i * 2.5
+        mark = '#%d:%02d:%02d.%d#' % (position // 3600, position % 3600 // 60,
+                                      position % 60, position * 10 % 10)
+        chunks.append(mark)
+        chunks.append(PARAGRAPH)
+        marks.append((offset, position, len(mark)))
+        offset += len(mark) + len(PARAGRAPH)
+
+    buffer.set_text(''.join(chunks))
+    for offset, position, length in marks:
+        index.append(offset, position, length)
+
+    return buffer, index, offset
+
+
+def main():
+    random.seed(0)
+    print('%8s %14s %14s %14s' % ('marks', 'click (us)', 'before (us)',
+                                  'insert (us)'))
+
+    for count in SIZES:
+        buffer, index, length = build(count)
+        offsets = [random.randrange(length) for i in range(CLICKS)]
+        times = [random.uniform(0, count * 2.5) for i in range(CLICKS)]
+
+        def click():
+            for offset in offsets:
+                iter = buffer.get_iter_at_offset(offset)
+                index.mark_at_iter(iter)
+
+        def before():
+            for position in times:
+                index.before(position)
+
+        def insert():
+            for offset in offsets[:200]:
+                iter = buffer.get_iter_at_offset(offset)
+                buffer.insert(iter, 'x')
+
+        click_us = min(timeit.repeat(click, number=1, repeat=3)) / CLICKS
+        before_us = min(timeit.repeat(before, number=1, repeat=3)) / CLICKS
+        insert_us = timeit.timeit(insert, number=1) / 200
+
+        print('%8d %14.2f %14.2f %14.2f' % (count, click_us * 1e6,
+                                            before_us * 1e6, insert_us * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Open-to-ready time: from opening an audio file to knowing its duration.
+
+Compares the former PLAYING/PAUSED preroll with duration polling every
+200 ms against the discoverer probe, with a cold and a warm cache.
+
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from transcribe import pipeline, probe
+
+DURATION = 600  # Seconds of audio in the fixture
+RUNS = 5
+
+
+def make_fixture(fname):
+    buffers = DURATION * 44100 // 1024
+    launch = Gst.parse_launch(
+        'audiotestsrc num-buffers=%d samplesperbuffer=1024 wave=pink-noise ! '
+        'audioconvert ! vorbisenc ! oggmux ! filesink location="%s"' %
+        (buffers, fname))
+    launch.set_state(Gst.State.PLAYING)
+    launch.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    launch.set_state(Gst.State.NULL)
+
+
+def open_legacy(fname):
+    """What Audio.__init__ used to do."""
+    loop = GLib.MainLoop()
+    playbin = pipeline.Pipeline('fakesink')
+    playbin.set_file(Gst.filename_to_uri(fname))
+    start = time.time()
+    playbin.play()
+    playbin.pause()
+
+    def poll():
+        state, duration = playbin.query_duration()
+        if not state:
+            return True
+        loop.quit()
+        return False
+
+    GLib.timeout_add(200, poll)
+    loop.run()
+    elapsed = time.time() - start
+    playbin.disable()
+    return elapsed
+
+
+def open_probe(fname):
+    loop = GLib.MainLoop()
+    start = time.time()
+    audio = pipeline.Audio(fname, 'fakesink')
+    audio.connect('update-duration', lambda audio, duration: loop.quit())
+    loop.run()
+    elapsed = time.time() - start
+    audio.stop()
+    return elapsed
+
+
+def main():
+    Gst.init(None)
+    directory = tempfile.mkdtemp()
+    fname = os.path.join(directory, 'fixture.ogg')
+
+    try:
+        make_fixture(fname)
+
+        legacy = min(open_legacy(fname) for i in range(RUNS))
+
+        cold = []
+        for i in range(RUNS):
+            if os.path.exists(probe.get_cache_path(fname)):
+                os.unlink(probe.get_cache_path(fname))
+            cold.append(open_probe(fname))
+
+        warm = min(open_probe(fname) for i in range(RUNS))
+
+        print('preroll + polling:  %8.1f ms' % (legacy * 1000))
+        print('discoverer, cold:   %8.1f ms' % (min(cold) * 1000))
+        print('discoverer, warm:   %8.1f ms' % (warm * 1000))
+    finally:
+        if os.path.exists(probe.get_cache_path(fname)):
+            os.unlink(probe.get_cache_path(fname))
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
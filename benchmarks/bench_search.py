@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Latency of the full-text search.
+
+Writes a corpus of synthetic transcriptions, indexes it, and reports how
+long a full and an incremental update take and the latency of common,
+rare, prefix and multi-word queries.  The query latency depends on the
+postings of the words asked for, not on the size of the corpus.
+
+Usage: bench_search.py [megabytes of transcriptions, default 100]
+
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from transcribe import search, timecode
+
+FILE_SIZE = 1024 * 1024
+VOCABULARY = 20000
+QUERIES = ('w1', 'w19999', 'w123*', 'w5 w7', 'w19990 w19991')
+
+
+def make_word(rand):
+    # Zipf-like: a few words are everywhere, most of them are rare
+    return 'w%d' % int(VOCABULARY ** rand.random() - 1)
+
+
+def write_corpus(directory, megabytes, rand):
+    for number in range(megabytes):
+        base = os.path.join(directory, 'recording%04d' % number)
+        open(base + '.wav', 'w').close()
+        with open(base + '.txt', 'w') as f:
+            size = 0
+            position = 0.0
+            while size < FILE_SIZE:
+                position += rand.uniform(2, 10)
+                line = '%s %s\n' % (timecode.format_mark(position),
+                                    ' '.join(make_word(rand)
+                                             for i in range(12)))
+                f.write(line)
+                size += len(line)
+
+
+def best(function, repeat=5):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    rand = random.Random(1)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        write_corpus(tmpdir, megabytes, rand)
+        index = search.SearchIndex(os.path.join(tmpdir, 'index.sqlite'))
+
+        start = time.time()
+        count = index.update([tmpdir])
+        print('full update, %d MB in %d files: %.1f s' %
+              (megabytes, count, time.time() - start))
+
+        os.utime(os.path.join(tmpdir, 'recording0000.txt'), None)
+        start = time.time()
+        count = index.update([tmpdir])
+        print('incremental update, %d file: %.1f ms' %
+              (count, (time.time() - start) * 1000))
+
+        for query in QUERIES:
+            for limit in (20, 200):
+                elapsed, hits = best(lambda: index.search(query, limit))
+                print('%-16s limit %4d: %8.2f ms, %4d hits' %
+                      (query, limit, elapsed * 1000, len(hits)))
+        index.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Seek latency and landing error, key unit against precise seeks.
+
+Every fixture is pink noise, decoded once from the start as reference.
+After each random seek the first prerolled audio is located in the
+reference by cross-correlation: the landing error is the distance
+between where it really is and the position asked for, which is what
+the user hears when jumping to a mark.
+
+Needs NumPy.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from transcribe import pipeline
+
+RATE = 8000
+DURATION = 600      # Seconds of audio in the fixtures
+SNIPPET = 2048      # Samples located in the reference after a seek
+SKIP = 256          # Samples skipped after a seek (resampler warm-up)
+SEARCH = 2.0        # Seconds around the target to look for the snippet
+
+# name -> (suffix, encoder); the encoder gets 44.1 kHz stereo
+FORMATS = [
+    ('wav', '.wav', 'wavenc'),
+    ('mp3-cbr', '.mp3', 'lamemp3enc target=bitrate bitrate=128 cbr=true'),
+    ('mp3-vbr', '.mp3', 'lamemp3enc target=quality quality=2'),
+    ('vorbis', '.ogg', 'vorbisenc ! oggmux'),
+    ('opus', '.opus', 'audioresample ! opusenc ! oggmux'),
+]
+
+
+def make_fixture(fname, encoder, duration=DURATION):
+    buffers = duration * 44100 // 1024
+    launch = Gst.parse_launch(
+        'audiotestsrc num-buffers=%d samplesperbuffer=1024 wave=pink-noise ! '
+        'audio/x-raw,rate=44100,channels=2 ! audioconvert ! %s ! '
+        'filesink location="%s"' % (buffers, encoder, fname))
+    launch.set_state(Gst.State.PLAYING)
+    launch.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    launch.set_state(Gst.State.NULL)
+
+
+def has_elements(encoder):
+    for part in encoder.split('!'):
+        if Gst.ElementFactory.find(part.split()[0]) is None:
+            return False
+    return True
+
+
+class Seeker(object):
+    """A playbin that prerolls into an appsink, to look at what it would
+    play after a seek.
+
+    """
+    def __init__(self, fname):
+        self.playbin = Gst.ElementFactory.make('playbin', None)
+        self.playbin.set_property('uri', Gst.filename_to_uri(fname))
+        sink = Gst.parse_bin_from_description(
+            'audioconvert ! audioresample ! '
+            'appsink name=sink sync=false '
+            'caps=audio/x-raw,format=F32LE,rate=%d,channels=1' % RATE, True)
+        self.sink = sink.get_by_name('sink')
+        self.playbin.set_property('audio-sink', sink)
+        self.playbin.set_state(Gst.State.PAUSED)
+        self.playbin.get_state(Gst.CLOCK_TIME_NONE)
+
+    def seek(self, position, flags):
+        """Seek and return the seconds it took and the preroll samples
+        from the position the sink would start playing at.
+
+        """
+        start = time.time()
+        self.playbin.seek_simple(Gst.Format.TIME, flags,
+                                 int(position * Gst.SECOND))
+        self.playbin.get_state(Gst.CLOCK_TIME_NONE)
+        elapsed = time.time() - start
+
+        sample = self.sink.emit('pull-preroll')
+        buf = sample.get_buffer()
+        segment = sample.get_segment()
+        data = numpy.frombuffer(buf.extract_dup(0, buf.get_size()),
+                                dtype=numpy.float32)
+        # The sink would drop what is before the segment start
+        skip = 0
+        if buf.pts != Gst.CLOCK_TIME_NONE and segment.start > buf.pts:
+            skip = int(round(float(segment.start - buf.pts) *
+                             RATE / Gst.SECOND))
+        return elapsed, data[skip:]
+
+    def close(self):
+        self.playbin.set_state(Gst.State.NULL)
+
+
+def locate(reference, snippet, around):
+    """Return the time, in seconds, where snippet is in reference,
+    looking SEARCH seconds around a given time.
+
+    """
+    first = max(0, int((around - SEARCH) * RATE))
+    last = min(len(reference), int((around + SEARCH) * RATE) + len(snippet))
+    window = reference[first:last]
+    if len(window) < len(snippet):
+        return None
+
+    n = len(window) + len(snippet)
+    size = 1 << (n - 1).bit_length()
+    correlation = numpy.fft.irfft(numpy.fft.rfft(window, size) *
+                                  numpy.conj(numpy.fft.rfft(snippet, size)),
+                                  size)[:len(window) - len(snippet) + 1]
+    return float(first + numpy.argmax(correlation)) / RATE
+
+
+def run_format(fname, seeks, precise):
+    decoder = pipeline.Decoder(fname, RATE)
+    reference = numpy.frombuffer(b''.join(decoder.blocks()),
+                                 dtype=numpy.float32)
+    duration = float(len(reference)) / RATE
+
+    flags = (pipeline.Pipeline.PRECISE_SEEK_FLAGS if precise
+             else pipeline.Pipeline.SEEK_FLAGS)
+    rand = random.Random(42)
+    seeker = Seeker(fname)
+    latencies, errors = [], []
+    try:
+        for i in range(seeks):
+            target = rand.uniform(SEARCH, duration - SEARCH - 1)
+            elapsed, samples = seeker.seek(target, flags)
+            latencies.append(elapsed)
+            snippet = samples[SKIP:SKIP + SNIPPET]
+            if len(snippet) < SNIPPET:
+                continue
+            found = locate(reference, snippet, target)
+            if found is not None:
+                errors.append(abs(found - float(SKIP) / RATE - target))
+    finally:
+        seeker.close()
+
+    return numpy.array(latencies), numpy.array(errors)
+
+
+def report(name, mode, latencies, errors):
+    print('%-8s %-8s latency median %6.1f ms  p95 %6.1f ms   '
+          'error median %6.1f ms  p95 %6.1f ms  max %7.1f ms' %
+          (name, mode,
+           numpy.median(latencies) * 1000,
+           numpy.percentile(latencies, 95) * 1000,
+           numpy.median(errors) * 1000 if len(errors) else -1,
+           numpy.percentile(errors, 95) * 1000 if len(errors) else -1,
+           errors.max() * 1000 if len(errors) else -1))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--seeks', type=int, default=2000,
+                        help='random seeks per format and mode '
+                             '(default: %(default)s)')
+    parser.add_argument('--duration', type=int, default=DURATION,
+                        help='seconds of audio in the fixtures '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    Gst.init(None)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, suffix, encoder in FORMATS:
+            if not has_elements(encoder):
+                print('%-8s skipped, no %s' % (name, encoder))
+                continue
+            fname = os.path.join(tmpdir, name + suffix)
+            make_fixture(fname, encoder, args.duration)
+            for mode, precise in (('key-unit', False), ('precise', True)):
+                latencies, errors = run_format(fname, args.seeks, precise)
+                report(name, mode, latencies, errors)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Start up time, from launching the application to using it.
+
+Every run is a new process that opens the window with a transcription
+and an audio file, and reports when it got to each of:
+
+  import        the modules of the application are imported
+  first-frame   the window is drawn
+  loaded        the transcription is in the text view
+  audio-ready   the player knows the duration of the audio
+
+Time to interactive is when the transcription can be edited, the later
+of first-frame and loaded; the audio comes after it.  Cold runs have an
+empty GStreamer registry and cache directory each, as after installing;
+warm runs share them, as every other time.
+
+Exits with 1 if the median warm time to interactive is over TARGET.
+Needs a display.
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+RUNS = 5
+TARGET = 0.5        # Seconds to interactive, warm
+DURATION = 60       # Seconds of audio in the fixture
+MARKS = 1000
+TIMEOUT = 60
+EVENTS = ('import', 'first-frame', 'loaded', 'audio-ready')
+
+
+def make_fixtures(directory):
+    fname = os.path.join(directory, 'audio.wav')
+    out = wave.open(fname, 'wb')
+    out.setnchannels(1)
+    out.setsampwidth(2)
+    out.setframerate(8000)
+    out.writeframes(struct.pack('<h', 0) * (DURATION * 8000))
+    out.close()
+
+    from transcribe import timecode
+    with open(os.path.join(directory, 'transcription.txt'), 'w') as f:
+        for i in range(MARKS):
+            f.write('%s Interviewer: and then what happened?\n' %
+                    timecode.format_mark(i * 3.7))
+    return fname
+
+
+def child(fname, started):
+    """Run in the process being measured.  Print the time of every event
+    since started, as JSON.
+
+    """
+    times = {}
+
+    def event(name):
+        if name not in times:
+            times[name] = time.time() - started
+
+    from transcribe import transcribe
+    event('import')
+    from gi.repository import Gst, GLib, Gtk
+    if Gst.is_initialized():
+        print('GStreamer was initialized on import', file=sys.stderr)
+        return 1
+
+    ui = transcribe.Transcribe(fname)
+
+    def on_draw(window, cr):
+        event('first-frame')
+        window.disconnect_by_func(on_draw)
+
+    def on_load_finished(loader):
+        on_load_finished.original(loader)
+        event('loaded')
+    on_load_finished.original = ui.on_load_finished
+
+    def start_audio():
+        start_audio.original()
+        GLib.timeout_add(5, poll_audio)
+    start_audio.original = ui.start_audio
+
+    def poll_audio():
+        if ui.audio.get_duration() <= 0:
+            return True
+        event('audio-ready')
+        Gtk.main_quit()
+        return False
+
+    # Before main() connects or calls them
+    ui.on_load_finished = on_load_finished
+    ui.start_audio = start_audio
+    ui.window.connect_after('draw', on_draw)
+    GLib.timeout_add_seconds(TIMEOUT, Gtk.main_quit)
+    ui.main()
+
+    print(json.dumps(times))
+    return 0
+
+
+def run(fname, env):
+    """Return the times of the events in a new process."""
+    started = time.time()
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child', fname,
+         repr(started)],
+        cwd=os.path.dirname(fname), env=env)
+    times = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    times['interactive'] = max(times.get('first-frame', TIMEOUT),
+                               times.get('loaded', TIMEOUT))
+    return times
+
+
+def fresh_env(directory):
+    env = dict(os.environ)
+    env['GST_REGISTRY'] = os.path.join(directory, 'registry.bin')
+    env['XDG_CACHE_HOME'] = os.path.join(directory, 'cache')
+    return env
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        return child(sys.argv[2], float(sys.argv[3]))
+
+    directory = tempfile.mkdtemp()
+    try:
+        fname = make_fixtures(directory)
+        results = {'cold': [], 'warm': []}
+        for i in range(RUNS):
+            cold = tempfile.mkdtemp(dir=directory)
+            results['cold'].append(run(fname, fresh_env(cold)))
+
+        warm = fresh_env(tempfile.mkdtemp(dir=directory))
+        run(fname, warm)  # Fill the registry and the caches
+        for i in range(RUNS):
+            results['warm'].append(run(fname, warm))
+    finally:
+        shutil.rmtree(directory)
+
+    columns = EVENTS + ('interactive',)
+    print('%-6s' % '' + ''.join('%14s' % name for name in columns))
+    for kind in ('cold', 'warm'):
+        print('%-6s' % kind + ''.join(
+            '%11.0f ms' % (median([times.get(name, TIMEOUT)
+                                   for times in results[kind]]) * 1000)
+            for name in columns))
+
+    interactive = median([times['interactive']
+                          for times in results['warm']])
+    if interactive > TARGET:
+        print('Warm time to interactive over %.0f ms' % (TARGET * 1000),
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Latency of the project database as the project grows.
+
+Imports projects of 10 to 1000 recordings of PARAGRAPHS paragraphs
+each, and measures opening a transcription, saving an edit (typing in
+a paragraph, and splitting one in two) and looking up the first LIMIT
+marks of a minute across the whole project.  None of them should depend
+on the number of recordings.
+
+Usage: bench_store.py [recordings ...]
+
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk
+
+from transcribe import store, timecode
+
+SIZES = (10, 100, 1000)
+PARAGRAPHS = 1000
+RUNS = 20
+LIMIT = 100         # Marks looked up, as a list in the window would
+LINE = '%s Interviewee: well, it was a long time ago, I think.'
+
+
+def make_project(directory, recordings):
+    path = os.path.join(directory, 'project-%d.sqlite' % recordings)
+    project = store.ProjectStore(path)
+    with project.db:
+        for number in range(recordings):
+            audio = os.path.join(directory, 'recording%04d.wav' % number)
+            text = '\n'.join(LINE % timecode.format_mark(i * 3.7)
+                             for i in range(PARAGRAPHS))
+            project.set_text(project.get_recording(audio), text)
+    return project
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def bench(project, directory, recordings, rand):
+    audio = os.path.join(directory, 'recording%04d.wav' %
+                         rand.randrange(recordings))
+
+    opens = []
+    for i in range(RUNS):
+        start = time.time()
+        text = project.get_text(project.get_recording(audio))
+        opens.append(time.time() - start)
+
+    buffer = Gtk.TextBuffer()
+    buffer.set_text(text)
+    journal = store.StoreJournal(project, audio)
+    journal.attach(buffer)
+
+    types, splits = [], []
+    for i in range(RUNS):
+        line = rand.randrange(buffer.get_line_count())
+        iter = buffer.get_iter_at_line(line)
+        iter.forward_to_line_end()
+        buffer.insert(iter, ' and so on')
+        start = time.time()
+        journal.write_pending()
+        types.append(time.time() - start)
+
+        iter = buffer.get_iter_at_line(line)
+        iter.forward_chars(20)
+        buffer.insert(iter, '\n')
+        start = time.time()
+        journal.write_pending()
+        splits.append(time.time() - start)
+    journal.close()
+
+    lookups = []
+    for i in range(RUNS):
+        position = rand.uniform(0, PARAGRAPHS * 3.7)
+        start = time.time()
+        marks = project.marks_between(position, position + 60, LIMIT)
+        lookups.append(time.time() - start)
+
+    return median(opens), median(types), median(splits), median(lookups)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    rand = random.Random(1)
+    directory = tempfile.mkdtemp()
+    try:
+        print('%10s %10s %10s %10s %10s %10s' % ('recordings', 'import s',
+                                                 'open ms', 'type ms',
+                                                 'split ms', 'marks ms'))
+        for recordings in sizes:
+            start = time.time()
+            project = make_project(directory, recordings)
+            imported = time.time() - start
+            results = bench(project, directory, recordings, rand)
+            project.close()
+            print('%10d %10.1f %10.2f %10.2f %10.2f %10.2f' %
+                  ((recordings, imported) +
+                   tuple(result * 1000 for result in results)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Seeks and audio gaps while sweeping the speed from 0.5x to 2x.
+
+Plays a fixture into a fakesink and changes the speed every STEP_TIME,
+as dragging the speed slider does, once with Audio.set_speed and once
+with what it used to do (change the tempo, then seek back to where the
+audio was).  Counts the seeks and the flushes that reached the sink,
+and measures the gaps: how much later than its predecessor ended each
+buffer was rendered, and how far back the position went.
+
+Exits with 1 if Audio.set_speed seeks, flushes or leaves a gap longer
+than MAX_GAP.
+
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from transcribe import pipeline, profile
+
+DURATION = 60       # Seconds of audio in the fixture
+STEP = 0.05         # Speed increments of the sweep
+STEP_TIME = 50      # ms between speed changes
+MAX_GAP = 0.02      # Seconds of silence that are audible
+
+
+def make_fixture(fname):
+    buffers = DURATION * 44100 // 1024
+    launch = Gst.parse_launch(
+        'audiotestsrc num-buffers=%d samplesperbuffer=1024 wave=sine ! '
+        'audioconvert ! vorbisenc ! oggmux ! filesink location="%s"' %
+        (buffers, fname))
+    launch.set_state(Gst.State.PLAYING)
+    launch.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    launch.set_state(Gst.State.NULL)
+
+
+class Monitor(object):
+    """What reaches the fakesink: flushes, and when buffers render."""
+
+    def __init__(self, audio):
+        sink = audio.playbin.playbin.get_property('audio-sink')
+        if isinstance(sink, Gst.Bin):
+            sink = next(element for element in sink.iterate_sinks())
+        sink.set_property('sync', True)  # Render in real time
+        sink.set_property('signal-handoffs', True)
+        sink.connect('handoff', self.on_handoff)
+        sink.get_static_pad('sink').add_probe(
+            Gst.PadProbeType.EVENT_FLUSH, self.on_flush)
+
+        self.flushes = 0
+        self.gaps = []
+        self.end = None     # Wall clock time the last buffer ends
+
+    def on_flush(self, pad, info):
+        if info.get_event().type == Gst.EventType.FLUSH_START:
+            self.flushes += 1
+        return Gst.PadProbeReturn.OK
+
+    def on_handoff(self, sink, buffer, pad):
+        now = time.time()
+        if self.end is not None and now > self.end:
+            self.gaps.append(now - self.end)
+        start = max(now, self.end or now)
+        self.end = start + float(buffer.duration) / Gst.SECOND
+
+
+def legacy_set_speed(audio, speed):
+    """What Audio.set_speed used to do."""
+    position = audio.get_position()
+    audio.playbin.set_speed(speed)
+    audio.anchor = None
+    if position >= 0:
+        audio.seek(position)
+
+
+def sweep(fname, set_speed):
+    audio = pipeline.Audio(fname, 'fakesink')
+    loop = GLib.MainLoop()
+    audio.play(0.5, 0)
+    audio.playbin.get_state(Gst.CLOCK_TIME_NONE)
+    monitor = Monitor(audio)
+
+    speeds = [0.5 + STEP * i for i in range(int(1.5 / STEP) + 1)]
+    positions = []
+
+    def step():
+        if not positions:
+            # Count from the sweep on, not the seek to start playing
+            profile.histograms.clear()
+            monitor.flushes = 0
+        positions.append(audio.get_position())
+        if not speeds:
+            loop.quit()
+            return False
+        set_speed(audio, speeds.pop(0))
+        return True
+
+    GLib.timeout_add(STEP_TIME, step)
+    loop.run()
+    audio.close()
+
+    seeks = profile.histograms.get('seek')
+    back = max([0] + [a - b for a, b in zip(positions, positions[1:])])
+    return (seeks.count if seeks else 0, monitor.flushes,
+            max(monitor.gaps or [0]), sum(monitor.gaps), back)
+
+
+def main():
+    profile.enabled = True  # To count the seeks, without a report
+    Gst.init(None)
+    directory = tempfile.mkdtemp()
+    fname = os.path.join(directory, 'fixture.ogg')
+    try:
+        make_fixture(fname)
+        engine = pipeline.Pipeline('fakesink')
+        engine.create_sink()
+        print('tempo engine: %s' % engine.tempo)
+
+        print('%-16s %6s %8s %12s %14s %12s' % ('', 'seeks', 'flushes',
+                                               'max gap ms', 'total gap ms',
+                                               'back ms'))
+        results = {}
+        for name, function in (('re-seek', legacy_set_speed),
+                               ('set_speed', pipeline.Audio.set_speed)):
+            results[name] = sweep(fname, function)
+            seeks, flushes, gap, total, back = results[name]
+            print('%-16s %6d %8d %12.1f %14.1f %12.1f' %
+                  (name, seeks, flushes, gap * 1000, total * 1000,
+                   back * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+    seeks, flushes, gap, total, back = results['set_speed']
+    if engine.tempo != 'rate' and (seeks or flushes or gap > MAX_GAP):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
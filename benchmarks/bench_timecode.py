@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Microbenchmarks of the time codec.
+
+Formats and parses the same times with what the window used to do
+(time_to_string and string_to_time, with a divmod chain and a re.split
+per call) and with the timecode module, one by one and in batch, and
+scans a document for marks.
+
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from transcribe import timecode
+
+COUNT = 100000
+
+
+def legacy_time_to_string(tm=0):
+    hours, rm = divmod(tm, 3600)
+    minutes, rm = divmod(rm, 60)
+    seconds, ms = divmod(rm, 1)
+    ms = ms * 10
+    return '%0d:%02d:%02d.%01d' % (hours, minutes, seconds, ms)
+
+
+def legacy_string_to_time(time_string):
+    try:
+        (h, m, s, ms) = re.split(r'#(\d{1,2}):(\d{2}):(\d{2}).(\d)#',
+                                 time_string)[1:-1]
+    except:
+        return 0.0
+    return int(h)*3600 + int(m)*60 + int(s) + float(ms)/10
+
+
+def best(function, repeat=5):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def report(name, seconds, count=COUNT):
+    print('%-34s %8.1f ms %10.0f /s' % (name, seconds * 1000,
+                                        count / seconds))
+
+
+def main():
+    rand = random.Random(1)
+    times = [rand.uniform(0, 4 * 3600) for i in range(COUNT)]
+    marks = ['#%s#' % legacy_time_to_string(tm) for tm in times]
+    document = ''.join('Some words said in the interview %s\n' % mark
+                       for mark in marks)
+
+    report('format, legacy', best(
+        lambda: [legacy_time_to_string(tm) for tm in times]))
+    report('format, tenths', best(
+        lambda: [timecode.format(tm) for tm in times]))
+    report('format, milliseconds', best(
+        lambda: [timecode.format(tm, timecode.MILLISECONDS)
+                 for tm in times]))
+    report('format_many, tenths', best(
+        lambda: timecode.format_many(times)))
+    report('format_many, milliseconds', best(
+        lambda: timecode.format_many(times, timecode.MILLISECONDS)))
+
+    report('parse, legacy', best(
+        lambda: [legacy_string_to_time(mark) for mark in marks]))
+    report('parse', best(
+        lambda: [timecode.parse(mark) for mark in marks]))
+    report('parse_many', best(
+        lambda: timecode.parse_many(marks)))
+
+    report('scan document', best(lambda: timecode.scan(document)))
+
+    # Tenths lose up to 50 ms when rounding, the legacy format up to 100
+    error = max(abs(legacy_string_to_time('#%s#' % legacy_time_to_string(tm))
+                    - tm) for tm in times)
+    print('max error, legacy: %.1f ms' % (error * 1000))
+    for name, digits in (('tenths', timecode.TENTHS),
+                         ('milliseconds', timecode.MILLISECONDS)):
+        parsed = timecode.parse_many(timecode.format_many(times, digits))
+        error = max(abs(a - b) for a, b in zip(parsed, times))
+        print('max error, %s: %.1f ms' % (name, error * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Main loop wakeups per second while playing.
+
+Plays a fixture into a fakesink and counts, for the main thread, the
+position callbacks and the context switches (from /proc) per second:
+
+- poll: a 100 ms timeout querying the pipeline, as the slider used to
+- pixel: the player tells when the position moves a slider pixel
+- paused: nothing playing
+
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gi.repository import GLib
+
+from transcribe import pipeline
+from bench_open import make_fixture
+
+SECONDS = 10
+SLIDER_WIDTH = 800  # Pixels
+
+
+def context_switches():
+    """Return the context switches of the calling thread so far."""
+    total = 0
+    with open('/proc/thread-self/status') as f:
+        for line in f:
+            if 'ctxt_switches:' in line:
+                total += int(line.split()[-1])
+    return total
+
+
+def measure(fname, mode):
+    loop = GLib.MainLoop()
+    audio = pipeline.Audio(fname, 'fakesink')
+    callbacks = [0]
+    duration = [0.0]
+
+    def on_duration(audio, value):
+        duration[0] = value
+
+    def poll():
+        callbacks[0] += 1
+        audio.get_position()
+        return True
+
+    def on_position(audio, position):
+        callbacks[0] += 1
+
+    audio.connect('update-duration', on_duration)
+    audio.connect('update-position', on_position)
+    if mode != 'paused':
+        audio.play(1.0, 0)
+    GLib.timeout_add(500, lambda: loop.quit())
+    loop.run()  # Let it preroll
+
+    if mode == 'poll':
+        GLib.timeout_add(100, poll)
+    elif mode == 'pixel':
+        audio.set_position_updates(duration[0] / SLIDER_WIDTH or 0.1,
+                                   1 / 60.0)
+
+    before = context_switches()
+    callbacks[0] = 0
+    GLib.timeout_add(SECONDS * 1000, lambda: loop.quit())
+    loop.run()
+    switches = context_switches() - before
+
+    audio.stop()
+    return float(callbacks[0]) / SECONDS, float(switches) / SECONDS
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    fname = os.path.join(directory, 'fixture.ogg')
+
+    try:
+        make_fixture(fname)
+        print('%8s %14s %18s' % ('mode', 'callbacks/s', 'ctx switches/s'))
+        for mode in ('poll', 'pixel', 'paused'):
+            callbacks, switches = measure(fname, mode)
+            print('%8s %14.1f %18.1f' % (mode, callbacks, switches))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
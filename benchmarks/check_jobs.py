@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Main loop stalls while background jobs run.
+
+A timeout every INTERVAL at the default priority, the priority of input
+events, stands for the user typing; how late it is dispatched is the
+stall.  It is measured with the main loop alone and under load:
+
+  load       loading a transcription of LINES lines into a text buffer
+  save       compacting the journal of that buffer, over and over
+  analysis   computing waveform peaks of noise in the worker processes,
+             with their progress
+  flood      thread jobs reporting progress and sending output as fast
+             as they can, submitted twice and some cancelled
+  all        everything at once
+
+Exits with 1 if any stall is longer than a frame.  Needs NumPy.
+
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GLib
+
+from transcribe import jobs, timecode, waveform
+from transcribe.journal import Journal
+from transcribe.loader import TranscriptionLoader
+from transcribe.marks import MarkIndex
+
+INTERVAL = 0.005    # Seconds between the timeouts standing for input
+FRAME = 1 / 60.0
+LINES = 100000
+ANALYSES = 8
+SECONDS = 600       # Of noise per analysis
+FLOODS = 4
+MESSAGES = 100000   # Progress reports and outputs per flood
+LINE = '%s Interviewee: well, it was a long time ago, I think.\n'
+
+
+def analyze_noise(job, seed):
+    """Compute the peaks of SECONDS of noise (worker process)."""
+    state = numpy.random.RandomState(seed)
+
+    def generate():
+        for i in range(SECONDS):
+            job.report(float(i) / SECONDS)
+            yield state.uniform(-1, 1, waveform.RATE).astype(
+                numpy.float32).tobytes()
+
+    peaks = waveform.compute(generate())
+    return len(peaks.levels[0])
+
+
+def flood(job, count):
+    for i in range(count):
+        if job.cancelled:
+            return i
+        job.report(float(i) / count)
+        job.output(i)
+    return count
+
+
+def start_idle(fname, work):
+    work.append('idle')
+    GLib.timeout_add(2000, lambda: work.remove('idle'))
+
+
+def start_load(fname, work):
+    buffer = Gtk.TextBuffer()
+    loader = TranscriptionLoader(buffer, MarkIndex(buffer), fname)
+    loader.connect('finished', lambda loader: work.remove(loader))
+    work.append(loader)
+    loader.start()
+    return buffer
+
+
+def start_save(fname, work):
+    """Compact the journal of a copy of fname five times."""
+    copy = os.path.join(os.path.dirname(fname), 'save.txt')
+    shutil.copyfile(fname, copy)
+    fname = copy
+    buffer = Gtk.TextBuffer()
+    with open(fname) as f:
+        buffer.set_text(f.read())
+    journal = Journal(fname)
+    journal.attach(buffer)
+    runs = [5]
+    work.append(journal)
+
+    def compact():
+        if journal.job is not None:
+            return True
+        if not runs[0]:
+            journal.close()
+            work.remove(journal)
+            return False
+        runs[0] -= 1
+        buffer.insert(buffer.get_end_iter(), LINE % '#0:00:00.0#')
+        journal.compact()
+        return True
+
+    GLib.timeout_add(50, compact)
+
+
+def start_analysis(work):
+    for seed in range(ANALYSES):
+        job = jobs.SCHEDULER.submit(jobs.PROCESS, analyze_noise, (seed,),
+                                    key=('noise', seed),
+                                    priority=jobs.PRIORITY_LOW)
+        job.connect('progress', lambda job, fraction: None)
+        job.connect('finished', lambda job, result: work.remove(job))
+        job.connect('failed', lambda job, error: work.remove(job))
+        work.append(job)
+
+
+def start_flood(work):
+    for i in range(FLOODS):
+        job = jobs.SCHEDULER.submit(jobs.THREAD, flood, (MESSAGES,),
+                                    key=('flood', i))
+        # The same job
+        jobs.SCHEDULER.submit(jobs.THREAD, flood, (MESSAGES,),
+                              key=('flood', i))
+        job.connect('progress', lambda job, fraction: None)
+        job.connect('output', lambda job, value: None)
+        job.connect('finished', lambda job, result: work.remove(job))
+        work.append(job)
+
+    # Cancelled right away, and a bit later
+    jobs.SCHEDULER.submit(jobs.THREAD, flood, (MESSAGES,)).cancel()
+    job = jobs.SCHEDULER.submit(jobs.THREAD, flood, (MESSAGES,))
+    GLib.timeout_add(100, job.cancel)
+
+
+def measure(start, fname):
+    """Return the stalls of the main loop until the work started by
+    start is done, in seconds.
+
+    """
+    work = []
+    stalls = []
+    last = [None]
+    loop = GLib.MainLoop()
+
+    def tick():
+        now = time.time()
+        if last[0] is not None:
+            stalls.append(max(0.0, now - last[0] - INTERVAL))
+        last[0] = now
+        if not work and stalls:
+            loop.quit()
+            return False
+        return True
+
+    start(fname, work)
+    GLib.timeout_add(int(INTERVAL * 1000), tick)
+    loop.run()
+    return stalls
+
+
+def start_all(fname, work):
+    start_load(fname, work)
+    start_save(fname, work)
+    start_analysis(work)
+    start_flood(work)
+
+
+SCENARIOS = [
+    ('idle', start_idle),
+    ('load', start_load),
+    ('save', start_save),
+    ('analysis', lambda fname, work: start_analysis(work)),
+    ('flood', lambda fname, work: start_flood(work)),
+    ('all', start_all),
+]
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    fname = os.path.join(directory, 'transcription.txt')
+    with open(fname, 'w') as f:
+        for i in range(LINES):
+            f.write(LINE % timecode.format_mark(i * 3.7))
+
+    failed = False
+    print('%-10s %8s %8s %10s %10s %10s' % ('', 'seconds', 'ticks',
+                                            'p50 ms', 'p99 ms', 'max ms'))
+    try:
+        for name, start in SCENARIOS:
+            begin = time.time()
+            stalls = measure(start, fname)
+            print('%-10s %8.1f %8d %10.2f %10.2f %10.2f' %
+                  (name, time.time() - begin, len(stalls),
+                   percentile(stalls, 50) * 1000,
+                   percentile(stalls, 99) * 1000, max(stalls) * 1000))
+            failed = failed or max(stalls) > FRAME
+    finally:
+        jobs.SCHEDULER.close()
+        shutil.rmtree(directory)
+
+    print('stalls over a frame (%.1f ms): %s' %
+          (FRAME * 1000, 'yes' if failed else 'none'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
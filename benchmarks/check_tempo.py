@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Accuracy of audio marks after many random speed changes.
+
+First the accounting alone: a TempoMap is given a random history of
+tempo changes and must return the media time of every output time to
+the millisecond, computed exactly with fractions; the former position,
+the output time multiplied by the tempo of the moment, is shown for
+comparison.
+
+Then the player: white noise is played with 'pitch' into a fakesink
+while the speed changes at random, and marks are taken as the user
+would.  The media time really being played is found by locating the
+last rendered buffer in the noise by cross-correlation.  The time
+stretching keeps chunks of some milliseconds of the original audio, so
+this is only accurate to about TOLERANCE.
+
+Exits with 1 if any mark is off by more than the tolerance.  Needs
+NumPy.
+
+"""
+
+from __future__ import print_function
+
+import fractions
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy
+
+from gi.repository import GLib
+
+from transcribe import pipeline
+
+CHANGES = 10000     # Tempo changes of the accounting check
+RATE = 8000
+DURATION = 120      # Seconds of noise
+MARKS = 40
+SNIPPET = 256       # Samples located in the noise
+SEARCH = 3.0        # Seconds around the mark to look for the snippet
+TOLERANCE = 0.03
+MIN_SPEED, MAX_SPEED = 0.5, 2.0
+
+
+def check_accounting(rand):
+    """Return the largest error of TempoMap and of the former position
+    over a random history of tempo changes.
+
+    """
+    tempo_map = pipeline.TempoMap(1.0)
+    output = media = fractions.Fraction(0)
+    tempo = fractions.Fraction(1)
+    worst = former = 0.0
+    for i in range(CHANGES):
+        # Some time at this tempo, then a change
+        step = fractions.Fraction(rand.randint(1, 5000), 1000)
+        for part in (step / 3, step - step / 3):
+            output += part
+            media += part * tempo
+            worst = max(worst, abs(tempo_map.to_media(float(output)) -
+                                   float(media)))
+            former = max(former, abs(float(output * tempo - media)))
+        tempo = fractions.Fraction(rand.randint(int(MIN_SPEED * 100),
+                                                int(MAX_SPEED * 100)), 100)
+        tempo_map.change(float(output), float(tempo))
+    return worst, former
+
+
+def make_noise(fname, rand):
+    state = numpy.random.RandomState(rand.randint(0, 2 ** 31))
+    samples = (state.uniform(-0.5, 0.5, DURATION * RATE) *
+               32767).astype('<i2')
+    out = wave.open(fname, 'wb')
+    out.setnchannels(1)
+    out.setsampwidth(2)
+    out.setframerate(RATE)
+    out.writeframes(samples.tobytes())
+    out.close()
+    return samples.astype(numpy.float32) / 32767
+
+
+def locate(reference, snippet, around):
+    """Return the time in reference where snippet is, near around."""
+    start = max(0, int((around - SEARCH) * RATE))
+    end = min(len(reference), int((around + SEARCH) * RATE) + len(snippet))
+    window = reference[start:end]
+    scores = numpy.correlate(window, snippet, 'valid')
+    return float(start + numpy.argmax(scores)) / RATE
+
+
+class Recorder(object):
+    """Keep the last buffer rendered by the fakesink, and when."""
+
+    def __init__(self, audio):
+        sink = audio.playbin.playbin.get_property('audio-sink')
+        sink = next(element for element in sink.iterate_sinks())
+        sink.set_property('sync', True)
+        sink.set_property('signal-handoffs', True)
+        sink.connect('handoff', self.on_handoff)
+        self.last = None
+
+    def on_handoff(self, sink, buffer, pad):
+        caps = pad.get_current_caps().get_structure(0)
+        if caps.get_value('format') != 'F32LE' or \
+                caps.get_value('channels') != 1:
+            raise RuntimeError('unexpected caps %s' % caps.to_string())
+        data = numpy.frombuffer(buffer.extract_dup(0, SNIPPET * 4),
+                                dtype=numpy.float32)
+        self.last = (time.time(), data)
+
+
+def check_player(fname, reference, rand):
+    """Return the errors of the marks, and of the former positions."""
+    audio = pipeline.Audio(fname, 'fakesink')
+    audio.playbin.create_sink()
+    if audio.playbin.tempo != 'pitch':
+        print('No pitch element, skipping the player check')
+        return [], []
+
+    recorder = Recorder(audio)
+    loop = GLib.MainLoop()
+    errors, former = [], []
+    speeds = []
+
+    def change():
+        speeds.append(rand.uniform(MIN_SPEED, MAX_SPEED))
+        audio.set_speed(speeds[-1])
+        # Wait for the new tempo to be rendered before the next mark
+        GLib.timeout_add(400 + rand.randint(0, 200), mark)
+        return False
+
+    def mark():
+        now = time.time()
+        position = audio.get_position()
+        state, stream_time = audio.playbin.query_stream_time()
+        rendered, snippet = recorder.last
+        if len(snippet) == SNIPPET:
+            played = (locate(reference, snippet, position) +
+                      (now - rendered) * speeds[-1])
+            errors.append(position - played)
+            former.append(stream_time * speeds[-1] - played)
+
+        if len(errors) >= MARKS or position > DURATION - 2 * SEARCH:
+            loop.quit()
+        else:
+            GLib.timeout_add(200 + rand.randint(0, 200), change)
+        return False
+
+    audio.play(1.0, 0)
+    GLib.timeout_add(500, change)
+    loop.run()
+    audio.close()
+    return errors, former
+
+
+def main():
+    rand = random.Random(1)
+
+    worst, former = check_accounting(rand)
+    print('accounting, %d changes: max error %.6f ms (former: %.1f s)' %
+          (CHANGES, worst * 1000, former))
+    failed = worst >= 0.001
+
+    directory = tempfile.mkdtemp()
+    fname = os.path.join(directory, 'noise.wav')
+    try:
+        reference = make_noise(fname, rand)
+        errors, former = check_player(fname, reference, rand)
+    finally:
+        shutil.rmtree(directory)
+
+    if errors:
+        errors = numpy.abs(errors)
+        former = numpy.abs(former)
+        print('player, %d marks: median error %.1f ms, max %.1f ms '
+              '(former: median %.1f ms, max %.1f ms)' %
+              (len(errors), numpy.median(errors) * 1000,
+               errors.max() * 1000, numpy.median(former) * 1000,
+               former.max() * 1000))
+        failed = failed or errors.max() > TOLERANCE
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Headless benchmark suite, compared against a baseline.
+
+Generates its fixtures (pink noise encoded with audiotestsrc and the
+usual encoders, and transcriptions of 1k to 1M marks), then measures
+with the audio going to a fakesink:
+
+  open       Audio() until the duration is known, cold and warm probe
+  seek       flushing seeks until the pipeline prerolled again
+  speed      speed changes while playing, until the pipeline settles
+  load       loading a transcription into a text buffer
+  save       journaling an edit, and compacting into the file
+  export     exporting to every format
+
+Every result is the median of its runs, in seconds.  With --save the
+results are written as JSON; with --baseline they are compared with a
+saved run, and the exit status is 1 if anything is slower than the
+baseline by more than the threshold.  The timings depend on the machine
+and on its GStreamer, so no baseline comes with the sources: save one
+on the machine that runs the check, from the revision to compare with.
+Without a file name, both use benchmarks/baseline.json.
+
+    git stash && suite.py --save && git stash pop
+    suite.py --baseline
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gst, Gtk, GLib
+
+from transcribe import export, pipeline, probe, timecode
+from transcribe.journal import Journal
+from transcribe.loader import TranscriptionLoader
+from transcribe.marks import MarkIndex
+
+# name -> (suffix, encoder); the encoder gets 44.1 kHz stereo
+FORMATS = [
+    ('wav', '.wav', 'wavenc'),
+    ('mp3', '.mp3', 'lamemp3enc target=quality quality=2'),
+    ('vorbis', '.ogg', 'vorbisenc ! oggmux'),
+]
+MARKS = (1000, 10000, 100000, 1000000)
+QUICK_MARKS = (1000, 10000)
+DURATION = 600          # Seconds of audio in the fixtures
+QUICK_DURATION = 60
+RUNS = 5
+SEEKS = 20
+SPEEDS = (0.5, 0.75, 1.25, 1.5, 1.0)
+THRESHOLD = 0.2         # Slower by more than this fraction is a regression
+MIN_DELTA = 0.001       # Differences under a millisecond are noise
+TIMEOUT = 60
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+LINE = '%s Interviewee: well, it was a long time ago, I think.\n'
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def wait(condition, timeout=TIMEOUT):
+    """Run the main loop until condition() is true."""
+    context = GLib.MainContext.default()
+    wakeup = GLib.timeout_add(10, lambda: True)
+    deadline = time.time() + timeout
+    try:
+        while not condition():
+            if time.time() > deadline:
+                raise RuntimeError('timed out')
+            context.iteration(True)
+    finally:
+        GLib.source_remove(wakeup)
+
+
+def settle(audio):
+    """Wait for the pipeline of audio to finish a state change or seek."""
+    audio.playbin.get_state(TIMEOUT * Gst.SECOND)
+
+
+class Fixtures(object):
+    """Fixtures made on first use, in a temporary directory."""
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.directory = tempfile.mkdtemp()
+        self.made = {}
+
+    def close(self):
+        for name, suffix, encoder in FORMATS:
+            if name in self.made:
+                cache_path = probe.get_cache_path(self.made[name])
+                if os.path.exists(cache_path):
+                    os.unlink(cache_path)
+        shutil.rmtree(self.directory)
+
+    def audio(self, name):
+        if name not in self.made:
+            suffix, encoder = dict((n, (s, e)) for n, s, e in FORMATS)[name]
+            fname = os.path.join(self.directory, name + suffix)
+            buffers = self.duration * 44100 // 1024
+            launch = Gst.parse_launch(
+                'audiotestsrc num-buffers=%d samplesperbuffer=1024 '
+                'wave=pink-noise ! audio/x-raw,rate=44100,channels=2 ! '
+                'audioconvert ! %s ! filesink location="%s"' %
+                (buffers, encoder, fname))
+            launch.set_state(Gst.State.PLAYING)
+            launch.get_bus().timed_pop_filtered(
+                Gst.CLOCK_TIME_NONE,
+                Gst.MessageType.EOS | Gst.MessageType.ERROR)
+            launch.set_state(Gst.State.NULL)
+            self.made[name] = fname
+        return self.made[name]
+
+    def transcription(self, marks):
+        name = 'transcription-%d.txt' % marks
+        if name not in self.made:
+            fname = os.path.join(self.directory, name)
+            with open(fname, 'w') as f:
+                for i in range(marks):
+                    f.write(LINE % timecode.format_mark(i * 3.7))
+            self.made[name] = fname
+        return self.made[name]
+
+
+def open_audio(fname):
+    """Return an Audio for fname once its duration is known, and the
+    time it took.
+
+    """
+    start = time.time()
+    audio = pipeline.Audio(fname, 'fakesink')
+    wait(lambda: audio.get_duration() > 0)
+    return audio, time.time() - start
+
+
+def prerolled_audio(fname):
+    audio, elapsed = open_audio(fname)
+    audio.preroll()
+    wait(lambda: audio.prerolled)
+    return audio
+
+
+def bench_open(fixtures, sizes, results):
+    for name, suffix, encoder in FORMATS:
+        fname = fixtures.audio(name)
+        cache_path = probe.get_cache_path(fname)
+        cold, warm = [], []
+        for i in range(RUNS):
+            if os.path.exists(cache_path):
+                os.unlink(cache_path)
+            audio, elapsed = open_audio(fname)
+            audio.close()
+            cold.append(elapsed)
+
+            audio, elapsed = open_audio(fname)
+            audio.close()
+            warm.append(elapsed)
+        results['open/%s/cold' % name] = median(cold)
+        results['open/%s/warm' % name] = median(warm)
+
+
+def bench_seek(fixtures, sizes, results):
+    rand = random.Random(1)
+    for name, suffix, encoder in FORMATS:
+        for precise in (False, True):
+            audio = prerolled_audio(fixtures.audio(name))
+            audio.set_precise(precise)
+            times = []
+            for i in range(SEEKS):
+                position = rand.uniform(0, fixtures.duration - 1)
+                start = time.time()
+                audio.seek(position)
+                settle(audio)
+                times.append(time.time() - start)
+            audio.close()
+            key = 'seek/%s/%s' % (name, 'precise' if precise else 'key-unit')
+            results[key] = median(times)
+
+
+def bench_speed(fixtures, sizes, results):
+    for name, suffix, encoder in FORMATS:
+        audio = prerolled_audio(fixtures.audio(name))
+        audio.play(1.0, 0)
+        settle(audio)
+        times = []
+        for speed in SPEEDS * RUNS:
+            start = time.time()
+            audio.set_speed(speed)
+            settle(audio)
+            times.append(time.time() - start)
+        audio.close()
+        results['speed/%s' % name] = median(times)
+
+
+def load(fname):
+    """Return a text buffer with the transcription in fname, and the
+    time it took to load it.
+
+    """
+    buffer = Gtk.TextBuffer()
+    marks = MarkIndex(buffer)
+    loader = TranscriptionLoader(buffer, marks, fname)
+    done = []
+    loader.connect('finished', lambda loader: done.append(time.time()))
+
+    start = time.time()
+    loader.start()
+    wait(lambda: done)
+    return buffer, done[0] - start
+
+
+def bench_load(fixtures, sizes, results):
+    for marks in sizes:
+        fname = fixtures.transcription(marks)
+        times = [load(fname)[1] for i in range(RUNS)]
+        results['load/%d' % marks] = median(times)
+
+
+def bench_save(fixtures, sizes, results):
+    for marks in sizes:
+        # A copy, as saving changes it
+        fname = os.path.join(fixtures.directory, 'save.txt')
+        shutil.copyfile(fixtures.transcription(marks), fname)
+        buffer, elapsed = load(fname)
+        journal = Journal(fname)
+        journal.attach(buffer)
+
+        edits, compacts, writes = [], [], []
+        for i in range(RUNS):
+            buffer.insert(buffer.get_end_iter(), LINE % '#0:00:00.0#')
+            start = time.time()
+            journal.write_pending()
+            edits.append(time.time() - start)
+
+            start = time.time()
+            journal.compact()
+            compacts.append(time.time() - start)
+            wait(lambda: journal.job is None)
+            writes.append(time.time() - start)
+        journal.close()
+
+        results['save/edit/%d' % marks] = median(edits)
+        results['save/compact/%d' % marks] = median(compacts)
+        results['save/file/%d' % marks] = median(writes)
+
+
+def bench_export(fixtures, sizes, results):
+    for marks in sizes:
+        fname = fixtures.transcription(marks)
+        for format in sorted(export.WRITERS):
+            output = os.path.join(fixtures.directory, 'export.' + format)
+            times = []
+            for i in range(RUNS):
+                start = time.time()
+                export.export(fname, output, format, None)
+                times.append(time.time() - start)
+            results['export/%s/%d' % (format, marks)] = median(times)
+
+
+BENCHMARKS = [
+    ('open', bench_open),
+    ('seek', bench_seek),
+    ('speed', bench_speed),
+    ('load', bench_load),
+    ('save', bench_save),
+    ('export', bench_export),
+]
+
+
+def compare(results, baseline, threshold):
+    """Print the results against the baseline.  Return the names of the
+    regressions.
+
+    """
+    regressions = []
+    print('%-28s %12s %12s %8s' % ('benchmark', 'baseline ms', 'ms',
+                                   'change'))
+    for name in sorted(results):
+        current = results[name]
+        if name not in baseline:
+            print('%-28s %12s %12.2f %8s' % (name, '-', current * 1000, 'new'))
+            continue
+        before = baseline[name]
+        change = (current - before) / before if before > 0 else 0.0
+        flag = ''
+        if change > threshold and current - before > MIN_DELTA:
+            flag = ' REGRESSION'
+            regressions.append(name)
+        print('%-28s %12.2f %12.2f %+7.0f%%%s' % (name, before * 1000,
+                                                  current * 1000,
+                                                  change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--only', action='append',
+                        choices=[name for name, function in BENCHMARKS],
+                        help='run only these benchmarks')
+    parser.add_argument('--quick', action='store_true',
+                        help='shorter audio and transcriptions')
+    parser.add_argument('--save', metavar='FILE', nargs='?',
+                        const=BASELINE,
+                        help='write the results as JSON (default FILE: '
+                             '%(const)s)')
+    parser.add_argument('--baseline', metavar='FILE', nargs='?',
+                        const=BASELINE,
+                        help='compare with the results in FILE (default: '
+                             '%(const)s)')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='slowdown that is a regression (default: '
+                             '%(default)s)')
+    args = parser.parse_args()
+
+    # Before spending minutes on the benchmarks
+    if args.baseline and not os.path.exists(args.baseline):
+        print('There is no baseline in %s; save one with --save, on this '
+              'machine, from the revision to compare with' % args.baseline,
+              file=sys.stderr)
+        return 2
+
+    Gst.init(None)
+    fixtures = Fixtures(QUICK_DURATION if args.quick else DURATION)
+    sizes = QUICK_MARKS if args.quick else MARKS
+
+    results = {}
+    try:
+        for name, function in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            print('Running %s...' % name, file=sys.stderr)
+            function(fixtures, sizes, results)
+    finally:
+        fixtures.close()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'platform': platform.platform(),
+                       'python': platform.python_version(),
+                       'gstreamer': Gst.version_string(),
+                       'quick': args.quick,
+                       'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('quick') != args.quick:
+            print('The baseline was run %s --quick' %
+                  ('with' if baseline.get('quick') else 'without'),
+                  file=sys.stderr)
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print('%d regressions over %d%%' %
+                  (len(regressions), args.threshold * 100), file=sys.stderr)
+            return 1
+    else:
+        for name in sorted(results):
+            print('%-28s %12.2f ms' % (name, results[name] * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Prepare many recordings at once, without a display.
+
+Every file goes through a list of tasks in a job, run by a scheduler
+with a pool of worker processes; a file given twice is processed once.
+The outcome of every file is appended to a state file as it finishes,
+so an interrupted batch can be run again and it resumes where it was.
+
+The GUI is never imported here, and the GStreamer based modules are
+only imported by the workers.
+
+"""
+
+from __future__ import print_function
+
+import json
+import multiprocessing
+import os
+import sys
+import traceback
+
+from . import cache
+from . import timecode
+from .jobs import PROCESS, Scheduler
+from .loader import transcription_for, decode
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.ogg', '.oga', '.opus', '.flac',
+                    '.m4a', '.aac', '.wma', '.webm', '.spx')
+
+
+def task_probe(filename, options, results):
+    from . import probe
+    return probe.probe(filename)
+
+
+def task_peaks(filename, options, results):
+    from . import waveform
+    if waveform.numpy is None:
+        raise RuntimeError('NumPy is required to compute the waveform')
+    peaks = waveform.get_peaks(filename)
+    return {'levels': len(peaks.levels), 'peaks': len(peaks.levels[0])}
+
+
+def task_marks(filename, options, results):
+    """Check the audio marks of the transcription of filename.
+
+    Marks that are almost right (missing zeros, a comma as decimal
+    separator, more decimals, spaces) are reported and, with the
+    'normalize' option, rewritten in the #h:mm:ss.f# format.
+
+    """
+    fname = transcription_for(filename)
+    if not os.path.exists(fname):
+        return {'transcription': None}
+    if os.path.exists(fname + '.journal'):
+        raise RuntimeError('%s has a journal: it is open or was not '
+                           'recovered' % fname)
+
+    with open(fname, 'rb') as f:
+        text = decode(f.read())
+
+    duration = results.get('probe', {}).get('duration')
+    malformed, unordered, beyond, count = [], 0, 0, 0
+    last = -1.0
+
+    for offset, length, position in timecode.finditer(text):
+        count += 1
+        if position is None:
+            mark = text[offset:offset + length]
+            line = text.count('\n', 0, offset) + 1
+            canonical = timecode.normalize_mark(mark)
+            malformed.append({'line': line, 'mark': mark,
+                              'normalized': canonical})
+            if canonical is None:
+                continue
+            position = timecode.parse(canonical)
+
+        if position < last:
+            unordered += 1
+        if duration is not None and position > duration:
+            beyond += 1
+        last = position
+
+    normalized = False
+    if malformed and options.get('normalize'):
+        content = timecode.normalize(text).encode('utf-8')
+        cache.replace(fname, lambda f: f.write(content))
+        normalized = True
+
+    result = {'transcription': fname, 'marks': count, 'malformed': malformed,
+              'unordered': unordered, 'beyond_duration': beyond,
+              'normalized': normalized}
+    if normalized:
+        malformed = [m for m in malformed if m['normalized'] is None]
+    if malformed:
+        raise ValueError('%d malformed audio marks in %s' %
+                         (len(malformed), fname))
+    return result
+
+
+def task_export(filename, options, results):
+    """Export the transcription of filename as timed segments, next to it,
+    in the formats of the 'export' option.
+
+    """
+    from . import export
+
+    fname = transcription_for(filename)
+    if not os.path.exists(fname):
+        return {'transcription': None}
+    duration = results.get('probe', {}).get('duration')
+    outputs = []
+    for format in options.get('export') or ['srt']:
+        output = os.path.splitext(fname)[0] + '.' + format
+        export.export(fname, output, format, duration)
+        outputs.append(output)
+    return {'transcription': fname, 'outputs': outputs}
+
+
+# Tasks in the order they run; later tasks see the results of earlier ones
+TASKS = [
+    ('probe', task_probe),
+    ('peaks', task_peaks),
+    ('marks', task_marks),
+    ('export', task_export),
+]
+
+# Tasks run when none are given; exporting writes files, so it is asked for
+DEFAULT_TASKS = ['probe', 'peaks', 'marks']
+
+
+def process_file(job, filename, tasks, options):
+    """Run the tasks on a file.  This runs in a worker process."""
+    results, errors = {}, {}
+
+    for name, task in TASKS:
+        if name not in tasks:
+            continue
+        try:
+            results[name] = task(filename, options, results)
+        except Exception as e:
+            errors[name] = '%s: %s' % (e.__class__.__name__, e)
+            if options.get('verbose'):
+                traceback.print_exc()
+
+    return filename, results, errors
+
+
+def find_files(paths):
+    """Return the audio files in paths, looking into directories."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if name.lower().endswith(AUDIO_EXTENSIONS):
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    return [os.path.realpath(filename) for filename in files]
+
+
+def read_state(path):
+    """Return the files already processed successfully, by file key."""
+    done = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Interrupted while writing
+                if not entry['errors']:
+                    done[entry['key']] = set(entry['tasks'])
+    except IOError:
+        pass
+    return done
+
+
+def run(paths, tasks, jobs=None, state='transcribe-batch.state',
+        options=None):
+    """Process the audio files in paths.  Return the failed files, as
+    a list of (filename, errors) tuples.
+
+    Keyword arguments:
+    paths -- audio files and directories to look for them
+    tasks -- names of the tasks to run, see TASKS
+    jobs -- number of worker processes (default: number of CPUs)
+    state -- file to record the progress in, to resume an interrupted run
+    options -- dictionary of options given to the tasks
+
+    """
+    options = options or {}
+    done = read_state(state)
+
+    pending, keys = [], {}
+    for filename in find_files(paths):
+        try:
+            key = cache.file_key(filename)
+        except OSError:
+            pending.append(filename)
+            continue
+        if key in done and set(tasks) <= done[key]:
+            continue
+        keys[filename] = key
+        pending.append(filename)
+
+    failures = []
+    if not pending:
+        return failures
+
+    scheduler = Scheduler(threads=0,
+                          processes=jobs or multiprocessing.cpu_count())
+    submitted, ids = [], set()
+    for filename in pending:
+        job = scheduler.submit(PROCESS, process_file,
+                               (filename, tasks, options), key=filename)
+        if job.id not in ids:
+            ids.add(job.id)
+            submitted.append(job)
+    total = len(submitted)
+    finished = []
+
+    def record(filename, results, errors):
+        if filename not in keys:
+            errors.setdefault('open', 'cannot read %s' % filename)
+        entry = {'file': filename, 'key': keys.get(filename),
+                 'tasks': sorted(tasks), 'results': results,
+                 'errors': errors}
+        log.write(json.dumps(entry) + '\n')
+        log.flush()
+
+        finished.append(filename)
+        status = 'FAILED' if errors else 'ok'
+        print('[%d/%d] %s %s' % (len(finished), total, status, filename),
+              file=sys.stderr)
+        if errors:
+            failures.append((filename, errors))
+
+    for job in submitted:
+        job.connect('finished', lambda job, result: record(*result))
+        # The job could not be sent to a worker process
+        job.connect('failed', lambda job, error:
+                    record(job.args[0], {}, {'process': error}))
+
+    try:
+        with open(state, 'a') as log:
+            scheduler.wait(submitted)
+    finally:
+        scheduler.close()
+
+    return failures
+
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='transcribe --batch',
+        description='Prepare audio files and their transcriptions, '
+                    'without a display.')
+    parser.add_argument('paths', nargs='*', metavar='PATH',
+                        help='audio file or directory with audio files')
+    parser.add_argument('--files-from', metavar='LIST',
+                        help='read the files to process from LIST, '
+                             'one per line (- for stdin)')
+    parser.add_argument('--tasks', default=','.join(DEFAULT_TASKS),
+                        help='comma separated tasks to run: %s '
+                             '(default: %%(default)s)' %
+                             ', '.join(n for n, t in TASKS))
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes '
+                             '(default: number of CPUs)')
+    parser.add_argument('--state', default='transcribe-batch.state',
+                        help='progress file used to resume '
+                             '(default: %(default)s)')
+    parser.add_argument('--report', metavar='FILE',
+                        help='write the failures as JSON to FILE')
+    parser.add_argument('--normalize', action='store_true',
+                        help='rewrite malformed audio marks')
+    parser.add_argument('--export-format', action='append',
+                        choices=['srt', 'vtt', 'jsonl'],
+                        help='format written by the export task, can be '
+                             'given more than once (default: srt)')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    paths = list(args.paths)
+    if args.files_from:
+        f = sys.stdin if args.files_from == '-' else open(args.files_from)
+        paths.extend(line.strip() for line in f if line.strip())
+
+    tasks = [name.strip() for name in args.tasks.split(',') if name.strip()]
+    unknown = set(tasks) - set(n for n, t in TASKS)
+    if unknown:
+        parser.error('unknown tasks: %s' % ', '.join(sorted(unknown)))
+    if not paths:
+        parser.error('no files to process')
+
+    options = {'normalize': args.normalize, 'verbose': args.verbose,
+               'export': args.export_format}
+    failures = run(paths, tasks, args.jobs, args.state, options)
+
+    for filename, errors in failures:
+        print('%s:' % filename, file=sys.stderr)
+        for task, error in sorted(errors.items()):
+            print('    %s: %s' % (task, error), file=sys.stderr)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump([{'file': filename, 'errors': errors}
+                       for filename, errors in failures], f, indent=2)
+
+    return 1 if failures else 0
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Sidecar files derived from audio files.
+
+Sidecars live in the user cache directory, one subdirectory per kind of
+data, and are named after the identity of the audio file (path, size
+and modification time), so a file that changes gets new sidecars.
+
+"""
+
+import binascii
+import hashlib
+import os
+
+from gi.repository import GLib
+
+
+def file_key(filename):
+    """Return a key that identifies the current contents of filename."""
+    if '://' in filename:
+        identity = filename  # On a server, and expected not to change
+    else:
+        filename = os.path.realpath(filename)
+        st = os.stat(filename)
+        identity = '%s\0%d\0%d' % (filename, st.st_size,
+                                   int(st.st_mtime * 1e9))
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+def cache_dir(kind):
+    path = os.path.join(GLib.get_user_cache_dir(), 'transcribe', kind)
+    # Worker processes may be creating it at the same time
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_path(kind, filename, suffix=''):
+    """Return the path of the sidecar of a given kind for filename."""
+    return os.path.join(cache_dir(kind), file_key(filename) + suffix)
+
+
+def create_temporary(directory):
+    """Create a new file in directory, with the permissions the umask
+    gives to a new file.  Return its descriptor and its path.
+
+    """
+    while True:
+        name = 'tmp%s.tmp' % binascii.hexlify(os.urandom(8)).decode('ascii')
+        path = os.path.join(directory, name)
+        try:
+            return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                           0o666), path
+        except FileExistsError:
+            continue
+
+
+def replace(path, write):
+    """Atomically (re)create path; write is called with the open file.
+
+    The file keeps the permissions it had, and a new one gets the usual
+    ones, rather than those of a temporary file.
+
+    """
+    fd, tmp = create_temporary(os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            try:
+                os.fchmod(f.fileno(), os.stat(path).st_mode & 0o7777)
+            except FileNotFoundError:
+                pass  # New, with the permissions it was created with
+            write(f)
+        os.rename(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def touch(path):
+    """Mark the sidecar in path as recently used."""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def evict(kind, limit, keep=()):
+    """Remove the least recently used sidecars of a given kind until they
+    take at most limit bytes.  The paths in keep are never removed.
+
+    """
+    directory = cache_dir(kind)
+    entries, total = [], 0
+    for name in os.listdir(directory):
+        if name.endswith('.tmp'):
+            continue  # Being written
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # Removed meanwhile
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= limit:
+            break
+        if path in keep:
+            continue
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
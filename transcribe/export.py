@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Export a transcription as timed segments: SRT, WebVTT or JSON Lines.
+
+A segment is the text from an audio mark up to the next one; it starts
+at the time of its mark and ends at the time of the next mark, or at
+the end of the audio for the last one.  Text before the first mark has
+no time and is not exported.
+
+The transcription is read line by line and every segment is written as
+soon as the next mark is found, so any length is exported in constant
+memory.
+
+"""
+
+from __future__ import print_function
+
+import codecs
+import io
+import json
+import os
+import sys
+
+from . import cache
+from . import timecode
+from .loader import transcription_for
+
+LAST_SEGMENT = 5.0  # Seconds of the last segment when the duration is unknown
+
+
+def segments(lines, duration=None):
+    """Yield the (start, end, text) segments of the lines of a
+    transcription.
+
+    Keyword arguments:
+    lines -- iterable of lines of text, with their newlines
+    duration -- duration of the audio, in seconds, if known
+
+    """
+    start = None
+    parts = []
+
+    for line in lines:
+        last = 0
+        for offset, length, position in timecode.finditer(line):
+            if position is None:
+                continue  # A malformed mark is just text
+            if start is not None:
+                parts.append(line[last:offset])
+                text = ''.join(parts).strip()
+                if text:
+                    yield start, max(start, position), text
+            start = position
+            parts = []
+            last = offset + length
+        if start is not None:
+            parts.append(line[last:])
+
+    if start is not None:
+        text = ''.join(parts).strip()
+        if text:
+            if duration is None or duration <= start:
+                end = start + LAST_SEGMENT
+            else:
+                end = duration
+            yield start, end, text
+
+
+def format_time(seconds, separator):
+    """Return seconds as hh:mm:ss<separator>mmm."""
+    ms = int(seconds * 1000 + 0.5)
+    s = ms // 1000
+    return '%02d:%02d:%02d%s%03d' % (s // 3600, s // 60 % 60, s % 60,
+                                     separator, ms % 1000)
+
+
+def single_paragraph(text):
+    """Return text without blank lines, which end a cue."""
+    if '\n\n' not in text:
+        return text
+    return '\n'.join(line for line in text.split('\n') if line.strip())
+
+
+def write_srt(segments, f):
+    for index, (start, end, text) in enumerate(segments, 1):
+        f.write('%d\n%s --> %s\n%s\n\n' % (index, format_time(start, ','),
+                                           format_time(end, ','),
+                                           single_paragraph(text)))
+
+
+def write_vtt(segments, f):
+    f.write('WEBVTT\n\n')
+    for start, end, text in segments:
+        text = single_paragraph(text).replace('-->', '->')
+        f.write('%s --> %s\n%s\n\n' % (format_time(start, '.'),
+                                       format_time(end, '.'), text))
+
+
+def write_jsonl(segments, f):
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    for start, end, text in segments:
+        f.write(dumps({'start': round(start, 3), 'end': round(end, 3),
+                       'text': text}))
+        f.write('\n')
+
+
+WRITERS = {
+    'srt': write_srt,
+    'vtt': write_vtt,
+    'jsonl': write_jsonl,
+}
+
+
+def format_for(fname):
+    """Return the export format for the extension of fname, or None."""
+    extension = os.path.splitext(fname)[1].lower().lstrip('.')
+    return extension if extension in WRITERS else None
+
+
+def export_lines(lines, output, format, duration=None):
+    """Export the lines of a transcription to the file output.  The
+    file is replaced once the export is complete.
+
+    """
+    writer = WRITERS[format]
+    cache.replace(output, lambda f: writer(segments(lines, duration),
+                                           codecs.getwriter('utf-8')(f)))
+
+
+def export_text_job(job, text, output, format, duration=None):
+    """Export text, a snapshot of a transcription (job thread)."""
+    export_lines(text.splitlines(True), output, format, duration)
+
+
+def export(fname, output, format=None, duration=None):
+    """Export the transcription in fname to output.
+
+    Keyword arguments:
+    fname -- transcription file
+    output -- file to write
+    format -- 'srt', 'vtt' or 'jsonl' (default: from the extension of
+              output)
+    duration -- duration of the audio, for the end of the last segment
+
+    """
+    format = format or format_for(output)
+    if format not in WRITERS:
+        raise ValueError('unknown export format for %s' % output)
+
+    with io.open(fname, encoding='utf-8', errors='replace') as f:
+        export_lines(f, output, format, duration)
+
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='transcribe --export',
+        description='Export the transcription of an audio file as timed '
+                    'segments.')
+    parser.add_argument('filename', help='audio file')
+    parser.add_argument('-f', '--format', choices=sorted(WRITERS),
+                        help='export format (default: from the output, '
+                             'or srt)')
+    parser.add_argument('-o', '--output',
+                        help='file to write (default: the transcription '
+                             'with the extension of the format)')
+    parser.add_argument('-t', '--transcription',
+                        help='transcription file (default: the audio file '
+                             'with a .txt extension)')
+    args = parser.parse_args(argv)
+
+    fname = args.transcription or transcription_for(args.filename)
+    format = args.format or (args.output and format_for(args.output)) or 'srt'
+    output = args.output or os.path.splitext(fname)[0] + '.' + format
+
+    from . import probe
+    try:
+        duration = probe.probe(args.filename)['duration']
+    except IOError as e:
+        print('Cannot probe %s: %s' % (args.filename, e), file=sys.stderr)
+        duration = None
+
+    try:
+        export(fname, output, format, duration)
+    except (IOError, OSError) as e:
+        print('Cannot export %s: %s' % (fname, e), file=sys.stderr)
+        return 1
+    return 0
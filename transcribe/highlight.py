@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Highlighting of large transcriptions around what is shown.
+
+The GtkSource language highlights the whole buffer, and re-analyses it
+after edits.  Past some tens of thousands of lines that makes typing
+lag, so large transcriptions are highlighted with text tags instead,
+only on the lines shown plus a margin: when the view scrolls, the lines
+that come into the margin are highlighted, and an edit highlights again
+the lines it touched and nothing else.
+
+The lines already highlighted are kept as a few ranges, shifted as lines
+are inserted and deleted, so an edit costs the same whatever the size of
+the transcription.
+
+"""
+
+import re
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import GLib
+
+from . import timecode
+
+# As in transcribe.lang
+INTERLOCUTOR = re.compile(r'^.*: ', re.MULTILINE)
+STYLES = (('timestamp', 'def:special-char'),
+          ('interlocutor', 'def:shebang'))
+
+
+class LineRanges(object):
+    """Sorted, disjoint ranges of lines, [first, last)."""
+
+    def __init__(self):
+        self.ranges = []
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def add(self, first, last):
+        merged = []
+        for start, end in self.ranges:
+            if end < first or start > last:
+                merged.append((start, end))
+            else:
+                first, last = min(first, start), max(last, end)
+        merged.append((first, last))
+        merged.sort()
+        self.ranges = merged
+
+    def missing(self, first, last):
+        """Return the ranges between first and last that are not in."""
+        result = []
+        for start, end in self.ranges:
+            if end <= first:
+                continue
+            if start >= last:
+                break
+            if start > first:
+                result.append((first, start))
+            first = max(first, end)
+        if first < last:
+            result.append((first, last))
+        return result
+
+    def insert(self, line, count):
+        """count lines were inserted after line."""
+        after = line + 1
+        ranges = []
+        for start, end in self.ranges:
+            if end <= after:
+                ranges.append((start, end))
+            elif start >= after:
+                ranges.append((start + count, end + count))
+            else:
+                ranges.append((start, after))
+                ranges.append((after + count, end + count))
+        self.ranges = ranges
+
+    def delete(self, line, count):
+        """The count lines after line were deleted."""
+        after = line + 1
+
+        def move(boundary):
+            if boundary <= after:
+                return boundary
+            return max(after, boundary - count)
+
+        ranges = []
+        for start, end in self.ranges:
+            start, end = move(start), move(end)
+            if start == end:
+                continue
+            if ranges and ranges[-1][1] >= start:
+                ranges[-1] = (ranges[-1][0], max(end, ranges[-1][1]))
+            else:
+                ranges.append((start, end))
+        self.ranges = ranges
+
+
+class ViewportHighlighter(object):
+    """Highlight the lines of a text view around the ones shown.
+
+    Keyword arguments:
+    view -- the GtkSource.View
+    scheme -- GtkSource.StyleScheme to take the styles from
+    malformed -- category of the source marks to flag what looks like an
+                 audio mark but is not one, or None
+
+    """
+    MARGIN = 200    # Lines highlighted above and below the ones shown
+
+    def __init__(self, view, scheme=None, malformed=None):
+        self.view = view
+        self.buffer = view.get_buffer()
+        self.malformed = malformed
+        self.ranges = LineRanges()
+        self.edited = None      # Lines to highlight after an edit
+        self.update_id = None
+
+        self.tags = {}
+        for name, style_id in STYLES:
+            tag = self.buffer.create_tag(None)
+            style = scheme.get_style(style_id) if scheme else None
+            if style is not None:
+                style.apply(tag)
+            else:
+                tag.set_property('weight', 700)  # Bold
+            self.tags[name] = tag
+
+        buffer = self.buffer
+        adjustment = view.get_vadjustment()
+        self.handlers = [
+            (buffer, buffer.connect('insert-text', self.on_insert_text)),
+            (buffer, buffer.connect_after('insert-text', self.on_edited)),
+            (buffer, buffer.connect('delete-range', self.on_delete_range)),
+            (buffer, buffer.connect_after('delete-range', self.on_edited)),
+            (adjustment, adjustment.connect('value-changed',
+                                            self.queue_update)),
+            (view, view.connect('size-allocate', self.queue_update)),
+        ]
+        self.queue_update()
+
+    def close(self):
+        """Remove the highlighting and stop following the view."""
+        for instance, handler in self.handlers:
+            instance.disconnect(handler)
+        self.handlers = []
+        if self.update_id is not None:
+            GLib.source_remove(self.update_id)
+            self.update_id = None
+
+        for first, last in self.ranges:
+            self.clear(*self.get_bounds(first, last))
+        table = self.buffer.get_tag_table()
+        for tag in self.tags.values():
+            table.remove(tag)
+        self.tags = {}
+
+    def get_bounds(self, first, last):
+        start = self.buffer.get_iter_at_line(first)
+        if last < self.buffer.get_line_count():
+            end = self.buffer.get_iter_at_line(last)
+        else:
+            end = self.buffer.get_end_iter()
+        return start, end
+
+    def get_shown_lines(self):
+        """Return the lines shown, plus the margin, as [first, last)."""
+        rect = self.view.get_visible_rect()
+        top = self.view.get_line_at_y(rect.y)[0].get_line()
+        bottom = self.view.get_line_at_y(rect.y + rect.height)[0].get_line()
+        return (max(0, top - self.MARGIN),
+                min(self.buffer.get_line_count(), bottom + 1 + self.MARGIN))
+
+    def queue_update(self, *args):
+        if self.update_id is None:
+            self.update_id = GLib.idle_add(self.update)
+
+    def update(self):
+        """Highlight the lines around the ones shown not done yet."""
+        self.update_id = None
+        for first, last in self.ranges.missing(*self.get_shown_lines()):
+            self.highlight(first, last)
+        return False
+
+    def clear(self, start, end):
+        for tag in self.tags.values():
+            self.buffer.remove_tag(tag, start, end)
+        if self.malformed is not None:
+            end = end.copy()
+            if not end.equal(start) and end.starts_line():
+                end.backward_char()  # Keep the marks of the next line
+            self.buffer.remove_source_marks(start, end, self.malformed)
+
+    def highlight(self, first, last):
+        """Highlight the lines [first, last) again."""
+        start, end = self.get_bounds(first, last)
+        self.clear(start, end)
+        text = self.buffer.get_slice(start, end, True)
+        base = start.get_offset()
+        get_iter = self.buffer.get_iter_at_offset
+
+        tag = self.tags['interlocutor']
+        for match in INTERLOCUTOR.finditer(text):
+            self.buffer.apply_tag(tag, get_iter(base + match.start()),
+                                  get_iter(base + match.end()))
+
+        tag = self.tags['timestamp']
+        for match in timecode.SCANNER.finditer(text):
+            if timecode.to_seconds(match) is not None:
+                self.buffer.apply_tag(tag, get_iter(base + match.start()),
+                                      get_iter(base + match.end()))
+            elif self.malformed is not None:
+                self.buffer.create_source_mark(None, self.malformed,
+                                               get_iter(base + match.start()))
+
+        self.ranges.add(first, last)
+
+    def on_insert_text(self, buffer, iter, text, length):
+        line = iter.get_line()
+        count = text.count('\n')
+        if count:
+            self.ranges.insert(line, count)
+        self.edited = (line, line + count + 1)
+
+    def on_delete_range(self, buffer, start, end):
+        first, last = sorted((start.get_line(), end.get_line()))
+        if last > first:
+            self.ranges.delete(first, last - first)
+        self.edited = (first, first + 1)
+
+    def on_edited(self, buffer, *args):
+        if self.edited is not None:
+            first, last = self.edited
+            self.edited = None
+            self.highlight(first, min(last, buffer.get_line_count()))
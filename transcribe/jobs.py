@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Background jobs, with their results delivered in the main loop.
+
+Reading and writing files and probing run in a pool of threads; decoding
+and analyzing audio, which would hold the interpreter lock, run in a
+pool of worker processes.  A job is a function called with the Job as
+its first argument, so it can report its progress and send partial
+output as it goes.
+
+What the jobs report is queued and delivered by a single idle callback,
+at a lower priority than input and drawing, which stops after BUDGET
+seconds and leaves the rest to its next run.  Progress is coalesced:
+only the last fraction reported is delivered.  Sending output blocks
+while QUEUED_OUTPUT deliveries are waiting, so a job producing faster
+than the main loop takes it sleeps instead of competing with the main
+loop for the interpreter lock, and otherwise gives the lock away: a
+thread holding it makes the main loop wait for it up to the switch
+interval of the interpreter, 5 ms, every time it calls into GTK.
+
+Queued jobs start by priority, and in the order they were submitted
+within a priority.  A job with a key (like the kind of job and the file
+it is about) is the same job as any other queued or running with that
+key: submitting it again returns the one there is.
+
+A cancelled job is not started, or if it is running its results are not
+delivered.  Jobs in threads can look at Job.cancelled to stop early.
+Processes cannot be interrupted; a cancelled one keeps running, and
+submitting it again before it finishes takes it back.
+
+"""
+
+from __future__ import print_function
+
+import collections
+import heapq
+import itertools
+import multiprocessing
+import threading
+import time
+
+from gi.repository import GObject, GLib
+
+THREAD = 'thread'       # For I/O, and what releases the interpreter lock
+PROCESS = 'process'     # For what takes the CPU in Python or NumPy
+
+PRIORITY_HIGH = 0       # The user is waiting for it
+PRIORITY_DEFAULT = 1
+PRIORITY_LOW = 2        # It might be needed later
+
+THREADS = 4
+BUDGET = 0.004          # Seconds of deliveries per idle callback
+QUEUED_OUTPUT = 100     # Deliveries queued before output() blocks
+
+QUEUED, RUNNING, DONE = range(3)
+
+# Signals that end a job
+FINAL = ('finished', 'failed')
+
+# In a worker process, the queue the jobs report on
+events = None
+
+
+def get_processes():
+    """Return the number of worker processes to use: a CPU is left to
+    the main loop.
+
+    """
+    return max(1, multiprocessing.cpu_count() - 1)
+
+
+def describe(error):
+    return '%s: %s' % (error.__class__.__name__, error)
+
+
+def init_worker(queue):
+    global events
+    events = queue
+
+
+class WorkerJob(object):
+    """What a job running in a worker process sees of its Job."""
+    cancelled = False
+
+    def __init__(self, id):
+        self.id = id
+
+    def report(self, fraction):
+        events.put((self.id, 'progress', fraction))
+
+    def output(self, value):
+        events.put((self.id, 'output', value))
+
+
+def run_in_worker(id, function, args):
+    """Run a job in a worker process.  The result goes through the same
+    queue as the progress, so it is delivered after it.
+
+    """
+    try:
+        result = function(WorkerJob(id), *args)
+    except Exception as e:
+        events.put((id, 'failed', describe(e)))
+    else:
+        events.put((id, 'finished', result))
+
+
+class Job(GObject.GObject):
+    """A function run in background by a Scheduler.
+
+    Its signals are emitted in the main loop: 'progress' with a fraction
+    from 0 to 1, 'output' with every partial result, and at the end
+    either 'finished' with the result or 'failed' with the error.
+
+    Keyword arguments:
+    scheduler -- the Scheduler running it
+    kind -- THREAD or PROCESS
+    function -- called with the job and args; for PROCESS it must be a
+                module level function, and args and the result must be
+                picklable
+    args -- tuple of arguments
+    key -- jobs with the same key are the same job, None for none
+    priority -- PRIORITY_HIGH, PRIORITY_DEFAULT or PRIORITY_LOW
+
+    """
+    __gsignals__ = {
+        'progress': (GObject.SIGNAL_RUN_FIRST, None, (float,)),
+        'output': (GObject.SIGNAL_RUN_FIRST, None, (object,)),
+        'finished': (GObject.SIGNAL_RUN_FIRST, None, (object,)),
+        'failed': (GObject.SIGNAL_RUN_FIRST, None, (str,)),
+    }
+
+    ids = itertools.count()
+
+    def __init__(self, scheduler, kind, function, args, key, priority):
+        GObject.GObject.__init__(self)
+        self.scheduler = scheduler
+        self.kind = kind
+        self.function = function
+        self.args = args
+        self.key = key
+        self.priority = priority
+        self.id = next(self.ids)
+        self.state = QUEUED
+        self.cancelled = False
+        self.returned = threading.Event()   # The function returned
+
+    def report(self, fraction):
+        """Report the progress, from the job."""
+        self.scheduler.post(self, 'progress', fraction)
+
+    def output(self, value):
+        """Send a partial result, from the job.  Blocks while the main
+        loop is behind.
+
+        """
+        self.scheduler.post(self, 'output', value)
+        time.sleep(0)   # Let the main loop have the interpreter lock
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+    def is_done(self):
+        """Return True once the job was delivered, or cancelled."""
+        return self.state == DONE
+
+    def join(self, timeout=None):
+        """Wait, without running the main loop, until the function of a
+        job returned.  Return False on timeout.  A job that sends output
+        can wait for the main loop, so it is not to be joined from it.
+
+        """
+        return self.returned.wait(timeout)
+
+
+class Scheduler(object):
+    """Run jobs in pools of threads and processes, started on demand.
+
+    Keyword arguments:
+    threads -- number of threads
+    processes -- number of worker processes (default: a CPU less than
+                 there are)
+    budget -- seconds spent delivering to the main loop at once
+
+    """
+    def __init__(self, threads=THREADS, processes=None, budget=BUDGET):
+        self.threads = threads
+        self.processes = processes or get_processes()
+        self.budget = budget
+
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)    # Job queued
+        self.drained = threading.Condition(self.lock)      # Output taken
+        self.closed = False
+        self.jobs = {}              # Key -> job queued or running
+
+        # Heaps of (priority, order, job) waiting for a thread or process
+        self.order = itertools.count()
+        self.thread_queue = []
+        self.process_queue = []
+        self.workers = []
+        self.idle_workers = 0
+
+        # The process pool is created in background on the first job
+        self.pool = None
+        self.pool_thread = None
+        self.events = None
+        self.running = {}           # Id -> job running in a process
+
+        # (job, signal, value) to deliver, and the last progress of the
+        # jobs with one queued
+        self.deliveries = collections.deque()
+        self.progress = {}
+        self.source_id = None
+
+    def submit(self, kind, function, args=(), key=None,
+               priority=PRIORITY_DEFAULT):
+        """Queue a job.  Return it, or the job with the same key that is
+        queued or running already.  See Job for the arguments.
+
+        """
+        with self.lock:
+            if key is not None and key in self.jobs:
+                job = self.jobs[key]
+                job.cancelled = False
+                if job.state == QUEUED and priority < job.priority:
+                    job.priority = priority
+                    self.enqueue(job)   # The old entry is skipped
+                return job
+
+            job = Job(self, kind, function, args, key, priority)
+            if key is not None:
+                self.jobs[key] = job
+            self.enqueue(job)
+            return job
+
+    def enqueue(self, job):
+        entry = (job.priority, next(self.order), job)
+        if job.kind == PROCESS:
+            heapq.heappush(self.process_queue, entry)
+            if self.pool_thread is None:
+                self.pool_thread = threading.Thread(target=self.run_pool)
+                self.pool_thread.daemon = True
+                self.pool_thread.start()
+            self.start_processes()
+        else:
+            heapq.heappush(self.thread_queue, entry)
+            if (self.idle_workers < len(self.thread_queue) and
+                    len(self.workers) < self.threads):
+                worker = threading.Thread(target=self.run_worker)
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+            self.condition.notify()
+
+    def cancel(self, job):
+        with self.lock:
+            if job.state == DONE:
+                return
+            job.cancelled = True
+            self.drained.notify_all()
+            if job.state == QUEUED:
+                job.state = DONE        # Its queue entry is skipped
+                job.returned.set()
+                self.forget(job)
+            elif job.kind == THREAD:
+                self.forget(job)        # It may have stopped half way
+
+    def forget(self, job):
+        if job.key is not None and self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+
+    def next_job(self, queue):
+        """Pop the next job to start from queue, or return None."""
+        while queue:
+            priority, order, job = heapq.heappop(queue)
+            if job.state == QUEUED and priority == job.priority:
+                job.state = RUNNING
+                return job
+        return None
+
+    def run_worker(self):
+        while True:
+            with self.condition:
+                job = self.next_job(self.thread_queue)
+                while job is None and not self.closed:
+                    self.idle_workers += 1
+                    self.condition.wait()
+                    self.idle_workers -= 1
+                    job = self.next_job(self.thread_queue)
+                if job is None:
+                    return
+
+            try:
+                result = job.function(job, *job.args)
+            except Exception as e:
+                signal, result = 'failed', describe(e)
+            else:
+                signal = 'finished'
+            job.returned.set()
+            self.post(job, signal, result)
+
+    def run_pool(self):
+        """Create the process pool, and deliver what the processes send
+        (pool thread).
+
+        """
+        # Workers start from scratch: they do not inherit GStreamer or
+        # GLib state from this process.
+        context = multiprocessing.get_context('spawn')
+        try:
+            events = context.Queue()
+            pool = context.Pool(self.processes, init_worker, (events,),
+                                maxtasksperchild=100)
+        except Exception as e:
+            self.fail_processes(describe(e))
+            return
+
+        with self.lock:
+            self.events = events
+            self.pool = pool
+            if self.closed:
+                pool.terminate()
+                return
+            self.start_processes()
+
+        while True:
+            try:
+                event = events.get()
+            except Exception:
+                if self.closed:
+                    return  # A worker was terminated while writing
+                raise
+            if event is None:
+                return
+            id, signal, value = event
+            with self.lock:
+                job = self.running.get(id)
+                if job is None:
+                    continue
+                if signal in FINAL:
+                    del self.running[id]
+                    job.returned.set()
+                    self.start_processes()
+            self.post(job, signal, value)
+
+    def fail_processes(self, error):
+        """Fail the queued process jobs, as there are no processes; the
+        next one submitted tries to start them again (pool thread).
+
+        """
+        with self.lock:
+            self.pool_thread = None
+            failed = []
+            job = self.next_job(self.process_queue)
+            while job is not None:
+                job.returned.set()
+                failed.append(job)
+                job = self.next_job(self.process_queue)
+        for job in failed:
+            self.post(job, 'failed', error)
+
+    def start_processes(self):
+        """Give the processes that are free the next jobs (locked)."""
+        if self.pool is None or self.closed:
+            return
+        while len(self.running) < self.processes:
+            job = self.next_job(self.process_queue)
+            if job is None:
+                return
+            self.running[job.id] = job
+            self.pool.apply_async(
+                run_in_worker, (job.id, job.function, job.args),
+                error_callback=lambda e, job=job: self.on_pool_error(job, e))
+
+    def on_pool_error(self, job, error):
+        """The job could not be sent to a process (pool thread)."""
+        with self.lock:
+            if self.running.pop(job.id, None) is None:
+                return
+            job.returned.set()
+            self.start_processes()
+        self.post(job, 'failed', describe(error))
+
+    def post(self, job, signal, value):
+        """Queue a signal of job to be emitted in the main loop."""
+        with self.lock:
+            if signal == 'progress':
+                queued = job in self.progress
+                self.progress[job] = value
+                if queued:
+                    return  # Delivered with the last value
+            elif signal == 'output':
+                while (len(self.deliveries) >= QUEUED_OUTPUT and
+                       not job.cancelled and not self.closed):
+                    self.drained.wait()
+                if job.cancelled:
+                    return
+            self.deliveries.append((job, signal, value))
+            if self.source_id is None:
+                self.source_id = GLib.idle_add(self.deliver)
+
+    def deliver(self):
+        """Emit the queued signals for up to budget seconds (main loop)."""
+        deadline = time.time() + self.budget
+        while True:
+            with self.lock:
+                if not self.deliveries:
+                    self.source_id = None
+                    return False
+                job, signal, value = self.deliveries.popleft()
+                if len(self.deliveries) <= QUEUED_OUTPUT // 2:
+                    self.drained.notify_all()
+                if signal == 'progress':
+                    value = self.progress.pop(job)
+                elif signal in FINAL:
+                    job.state = DONE
+                    self.forget(job)
+                cancelled = job.cancelled
+
+            if not cancelled:
+                job.emit(signal, value)
+            if time.time() >= deadline:
+                return True     # The rest in the next main loop iteration
+
+    def wait(self, jobs):
+        """Run the main loop until jobs are done.  For command line tools,
+        which have no main loop of their own.
+
+        """
+        context = GLib.MainContext.default()
+        # Wakes the loop up now and then, for KeyboardInterrupt
+        wakeup = GLib.timeout_add(100, lambda: True)
+        try:
+            while not all(job.is_done() for job in jobs):
+                context.iteration(True)
+        finally:
+            GLib.source_remove(wakeup)
+
+    def close(self):
+        """Cancel every job and stop the pools.  Processes are
+        terminated; threads finish the function they are running.
+
+        """
+        with self.lock:
+            self.closed = True
+            for entries in (self.thread_queue, self.process_queue):
+                for priority, order, job in entries:
+                    job.cancelled = True
+            for job in self.running.values():
+                job.cancelled = True
+            self.jobs.clear()
+            self.condition.notify_all()
+            self.drained.notify_all()
+            pool, events = self.pool, self.events
+
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+            events.put(None)
+            self.pool_thread.join()
+
+
+# Shared by the application, so jobs about the same file are shared too
+SCHEDULER = Scheduler()
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Append-only journal of the edits made to a transcription.
+
+Every insertion and deletion in the buffer is appended, as one JSON
+array per line, to '<transcription>.journal' and fsync'd on a short
+timer, so autosaving costs as much as the edit itself.  From time to
+time the journal is compacted: the buffer is written to the
+transcription file by a background job and the journal starts over.
+
+The records are:
+
+    ["i", offset, text]     text inserted at offset
+    ["d", offset, length]   length characters deleted at offset
+    ["b", crc]              CRC32 of the transcription file the journal
+                            applies to (written right before the journal
+                            is written into that file)
+
+A journal left behind means the last session did not exit cleanly;
+recover() replays it into the transcription file before it is loaded.
+RecoveringLoader does it in its job, so a long journal does not keep
+the main loop busy.
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+import zlib
+
+from gi.repository import GLib
+
+from . import jobs
+from .loader import TranscriptionLoader, decode
+
+JOURNAL_SUFFIX = '.journal'
+COMPACTING_SUFFIX = '.journal.old'
+
+
+def crc32(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+def read_records(path):
+    """Return the edit records of a journal and its base CRC, if any.
+
+    A truncated last line (the application died while writing it) ends
+    the journal.
+
+    """
+    records, base = [], None
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                break
+            if record[0] == 'b':
+                base = record[1]
+            else:
+                records.append(record)
+    return records, base
+
+
+class BlockText(object):
+    """Text edited at character offsets as a text buffer is, kept in
+    blocks of up to twice BLOCK characters, so an edit copies a block
+    instead of the whole text.  Unlike a text buffer, it can be used
+    outside the main thread.
+
+    """
+    BLOCK = 64 * 1024
+
+    def __init__(self, text=''):
+        self.blocks = self.split(text) or ['']
+        self.length = len(text)
+
+    def split(self, text):
+        return [text[i:i + self.BLOCK]
+                for i in range(0, len(text), self.BLOCK)]
+
+    def clamp(self, offset):
+        """Return offset, or the end if it is out of the text, as
+        gtk_text_buffer_get_iter_at_offset() does.
+
+        """
+        if offset < 0 or offset > self.length:
+            return self.length
+        return offset
+
+    def locate(self, offset):
+        """Return the number of the block with offset, and the offset in
+        the block.
+
+        """
+        for number, block in enumerate(self.blocks):
+            if offset <= len(block):
+                return number, offset
+            offset -= len(block)
+        return len(self.blocks) - 1, len(self.blocks[-1])
+
+    def insert(self, offset, text):
+        number, index = self.locate(self.clamp(offset))
+        block = self.blocks[number]
+        block = block[:index] + text + block[index:]
+        if len(block) > 2 * self.BLOCK:
+            self.blocks[number:number + 1] = self.split(block)
+        else:
+            self.blocks[number] = block
+        self.length += len(text)
+
+    def delete(self, offset, length):
+        start, end = sorted((self.clamp(offset), self.clamp(offset + length)))
+        count = end - start
+        self.length -= count
+        number, index = self.locate(start)
+        while count > 0:
+            block = self.blocks[number]
+            part = min(count, len(block) - index)
+            block = block[:index] + block[index + part:]
+            count -= part
+            if block or len(self.blocks) == 1:
+                self.blocks[number] = block
+                number += 1
+            else:
+                del self.blocks[number]
+            index = 0
+
+    def get_text(self):
+        return ''.join(self.blocks)
+
+
+def apply_records(text, records):
+    """Replay records on text, a BlockText."""
+    for record in records:
+        op, offset = record[0], record[1]
+        if op == 'i':
+            text.insert(offset, record[2])
+        elif op == 'd':
+            text.delete(offset, record[2])
+
+
+def needs_recovery(fname):
+    """Return True if the last session left journals of fname."""
+    return (os.path.exists(fname + JOURNAL_SUFFIX) or
+            os.path.exists(fname + COMPACTING_SUFFIX))
+
+
+def recover(fname):
+    """Replay the journals left by a session that did not exit cleanly.
+
+    The recovered text is written to fname and the journals removed.
+    Return True if there was something to recover.  It does not use the
+    main loop, so it can be run in a job.
+
+    """
+    journal = fname + JOURNAL_SUFFIX
+    compacting = fname + COMPACTING_SUFFIX
+    if not needs_recovery(fname):
+        return False
+
+    try:
+        with open(fname, 'rb') as f:
+            data = f.read()
+    except IOError:
+        data = b''
+
+    text = BlockText(decode(data))
+
+    # A journal might have been written into the file already; its base
+    # CRC tells if it was.
+    for path in (compacting, journal):
+        if os.path.exists(path):
+            records, base = read_records(path)
+            if base is None or base == crc32(data):
+                apply_records(text, records)
+
+    GLib.file_set_contents(fname, text.get_text().encode('utf-8'))
+
+    for path in (compacting, journal):
+        if os.path.exists(path):
+            os.unlink(path)
+
+    return True
+
+
+class RecoveringLoader(TranscriptionLoader):
+    """A TranscriptionLoader that first recovers the edits of the last
+    session, if it did not exit cleanly, in its job.
+
+    """
+    def open(self):
+        if needs_recovery(self.fname):
+            return None, 0  # Opened by the job, once recovered
+        return TranscriptionLoader.open(self)
+
+    def read_chunks(self, job, f):
+        if f is None:
+            recover(self.fname)
+            f, self.size = TranscriptionLoader.open(self)
+        TranscriptionLoader.read_chunks(self, job, f)
+
+
+class Journal(object):
+    """Journal of the edits made to a transcription buffer.
+
+    Keyword arguments:
+    fname -- transcription file the journal belongs to
+
+    """
+    FLUSH_INTERVAL = 500           # ms between fsync of pending edits
+    COMPACT_SIZE = 1024 * 1024     # Journal size that triggers compaction
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.path = fname + JOURNAL_SUFFIX
+        self.compacting_path = fname + COMPACTING_SUFFIX
+        self.buffer = None
+        self.handlers = []
+        self.pending = []
+        self.flush_id = None
+        self.job = None
+        self.compact_again = False
+        self.base_crc = None
+        self.file = open(self.path, 'ab')
+
+    def attach(self, buffer):
+        """Start journaling the edits made to buffer."""
+        self.buffer = buffer
+        self.handlers = [
+            buffer.connect('insert-text', self.on_insert_text),
+            buffer.connect('delete-range', self.on_delete_range),
+        ]
+
+    def on_insert_text(self, buffer, iter, text, length):
+        self.record_insert(iter.get_offset(), text)
+
+    def on_delete_range(self, buffer, start, end):
+        start, end = start.get_offset(), end.get_offset()
+        if start > end:
+            start, end = end, start
+        self.record_delete(start, end - start)
+
+    def record_insert(self, offset, text):
+        self.pending.append(['i', offset, text])
+        self.schedule_flush()
+
+    def record_delete(self, offset, length):
+        self.pending.append(['d', offset, length])
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.flush_id is None:
+            self.flush_id = GLib.timeout_add(self.FLUSH_INTERVAL, self.flush)
+
+    def flush(self):
+        """Write and fsync the pending edits.  Return False, so it can be
+        used as a GLib timeout callback.
+
+        """
+        self.write_pending()
+
+        if self.buffer is not None and self.file.tell() > self.COMPACT_SIZE:
+            self.compact()
+
+        return False
+
+    def write_pending(self):
+        if self.flush_id is not None:
+            GLib.source_remove(self.flush_id)
+            self.flush_id = None
+
+        if not self.pending:
+            return
+
+        lines = [json.dumps(record, separators=(',', ':'))
+                 for record in self.pending]
+        self.pending = []
+        self.file.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def compact(self):
+        """Write the buffer into the transcription file in background and
+        start a new journal.
+
+        """
+        if self.job is not None:
+            self.compact_again = True
+            return
+
+        self.write_pending()
+        start, end = self.buffer.get_bounds()
+        content = self.buffer.get_text(start, end, True)
+
+        self.file.close()
+        os.rename(self.path, self.compacting_path)
+        self.file = open(self.path, 'ab')
+
+        self.job = jobs.SCHEDULER.submit(jobs.THREAD, self.write, (content,),
+                                         priority=jobs.PRIORITY_HIGH)
+        self.job.connect('finished', self.on_compacted)
+        self.job.connect('failed', self.on_compact_failed)
+
+    def seal(self, f):
+        """Append to the journal f the CRC of the transcription file it
+        applies to, so recover() can tell if the journal made it into the
+        file already in case we die before removing it.
+
+        """
+        if self.base_crc is None:
+            try:
+                with open(self.fname, 'rb') as base:
+                    self.base_crc = crc32(base.read())
+            except IOError:
+                self.base_crc = crc32(b'')
+
+        f.write(('["b",%d]\n' % self.base_crc).encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+
+    def write(self, job, content):
+        """Write content into the transcription file (compaction job)."""
+        with open(self.compacting_path, 'ab') as f:
+            self.seal(f)
+
+        data = content.encode('utf-8')
+        GLib.file_set_contents(self.fname, data)
+        self.base_crc = crc32(data)
+        os.unlink(self.compacting_path)
+
+    def on_compacted(self, job, result):
+        if job is not self.job:
+            return  # close() already waited for it
+
+        self.job = None
+        if self.compact_again:
+            self.compact_again = False
+            self.compact()
+
+    def on_compact_failed(self, job, error):
+        # No more compactions, which would replace the journal being
+        # compacted: the edits stay in the journals for close() or
+        # recover().
+        print('Cannot save %s: %s' % (self.fname, error), file=sys.stderr)
+
+    def close(self):
+        """Save the buffer and remove the journal.  Called on clean exit."""
+        if self.job is not None:
+            self.job.join()
+            self.job = None
+        self.compact_again = False
+
+        for handler in self.handlers:
+            self.buffer.handler_disconnect(handler)
+        self.handlers = []
+
+        self.write_pending()
+        self.seal(self.file)
+
+        start, end = self.buffer.get_bounds()
+        content = self.buffer.get_text(start, end, True)
+        GLib.file_set_contents(self.fname, content.encode('utf-8'))
+
+        self.file.close()
+        os.unlink(self.path)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from __future__ import print_function
+
+import gc
+import os
+import sys
+
+from gi.repository import GObject
+
+from . import jobs
+from . import timecode
+
+# The third collection threshold while loading, and the loads going on
+# with the thresholds to restore
+LOADING_THRESHOLD = 1000
+loading = []
+
+
+def hold_full_collections():
+    """Make full garbage collections rare until release_full_collections()
+    is called as many times.
+
+    """
+    if not loading:
+        threshold = gc.get_threshold()
+        gc.set_threshold(threshold[0], threshold[1],
+                         max(threshold[2], LOADING_THRESHOLD))
+        loading.append(threshold)
+    else:
+        loading.append(loading[0])
+
+
+def release_full_collections():
+    threshold = loading.pop()
+    if not loading:
+        gc.set_threshold(*threshold)
+
+
+def transcription_for(filename):
+    """Return the name of the transcription of an audio file."""
+    return os.path.splitext(filename)[0] + '.txt'
+
+
+def decode(data):
+    """Decode the bytes of a transcription, with universal newlines."""
+    text = data.decode('utf-8', 'replace')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+class TranscriptionLoader(GObject.GObject):
+    """Load a transcription into a text buffer without blocking the UI.
+
+    The file is read in chunks of whole lines by a job, which decodes
+    every chunk and scans it once for audio marks.  The main loop only
+    appends the chunks to the buffer, in pieces of INSERT_SIZE with a
+    single insert each, so the window is drawn and stays responsive
+    while a long transcription is being loaded: every piece, with its
+    audio marks, takes well under a frame.
+
+    A full garbage collection goes through every object, the audio marks
+    included, and with a large transcription it takes longer than a
+    frame.  Loading allocates enough to start several of them, so while
+    loading the threshold of full collections is raised, and restored
+    once it is done; the younger generations are collected as usual.
+
+    What looks like an audio mark but is not one is kept in malformed,
+    as (offset, mark) tuples.
+
+    """
+    __gsignals__ = {
+        'progress': (GObject.SIGNAL_RUN_FIRST, None, (float,)),
+        'finished': (GObject.SIGNAL_RUN_FIRST, None, ())
+    }
+
+    CHUNK_SIZE = 256 * 1024  # Bytes read at once
+    INSERT_SIZE = 16 * 1024  # Bytes inserted at once, in whole lines
+
+    def __init__(self, buffer, marks, fname):
+        GObject.GObject.__init__(self)
+
+        self.buffer = buffer
+        self.marks = marks
+        self.fname = fname
+        self.size = 0
+        self.read = 0
+        self.job = None
+        self.holding = False    # Full collections held off, loading
+        self.malformed = []
+
+    def start(self):
+        """Clear the buffer and start loading.
+
+        Return False if the file cannot be opened; the buffer is left
+        untouched in that case.
+
+        """
+        try:
+            f, self.size = self.open()
+        except IOError:
+            return False
+
+        self.read = 0
+        if not self.holding:
+            hold_full_collections()
+            self.holding = True
+
+        if hasattr(self.buffer, 'begin_not_undoable_action'):
+            self.buffer.begin_not_undoable_action()
+        start, end = self.buffer.get_bounds()
+        self.buffer.delete(start, end)
+
+        self.job = jobs.SCHEDULER.submit(jobs.THREAD, self.read_chunks, (f,),
+                                         priority=jobs.PRIORITY_HIGH)
+        self.job.connect('output', self.on_chunk)
+        self.job.connect('finished', self.on_finished)
+        self.job.connect('failed', self.on_failed)
+        return True
+
+    def open(self):
+        """Return the file to read the transcription from, and its size.
+        Raise IOError if there is nothing to load.
+
+        """
+        f = open(self.fname, 'rb')
+        return f, os.fstat(f.fileno()).st_size
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.finish()
+
+    def is_loading(self):
+        return self.job is not None
+
+    def read_chunks(self, job, f):
+        """Read the chunks of f, and send them in pieces, decoded and
+        scanned (job thread).
+
+        """
+        with f:
+            while not job.cancelled:
+                lines = f.readlines(self.CHUNK_SIZE)
+                if not lines:
+                    break
+                start = size = 0
+                for end, line in enumerate(lines, 1):
+                    size += len(line)
+                    if size >= self.INSERT_SIZE or end == len(lines):
+                        data = b''.join(lines[start:end])
+                        text = decode(data)
+                        job.output((len(data), text, timecode.scan(text)))
+                        start, size = end, 0
+
+    def on_chunk(self, job, chunk):
+        size, text, (marks, malformed) = chunk
+        self.read += size
+
+        end = self.buffer.get_end_iter()
+        base = end.get_offset()
+        self.buffer.insert(end, text)
+
+        for offset, position, length in marks:
+            self.marks.append(base + offset, position, length)
+        for offset, mark in malformed:
+            self.malformed.append((base + offset, mark))
+
+        self.emit('progress', min(1.0, float(self.read) / (self.size or 1)))
+
+    def on_finished(self, job, result):
+        self.finish()
+        self.emit('finished')
+
+    def on_failed(self, job, error):
+        # What was read so far stays in the buffer
+        print('Cannot read %s: %s' % (self.fname, error), file=sys.stderr)
+        self.finish()
+        self.emit('finished')
+
+    def finish(self):
+        self.job = None
+        if self.holding:
+            release_full_collections()
+            self.holding = False
+        if hasattr(self.buffer, 'end_not_undoable_action'):
+            self.buffer.end_not_undoable_action()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import bisect
+
+
+class AudioMark(object):
+    """An audio mark (#h:mm:ss.m#) placed in a text buffer.
+
+    The mark is anchored to the buffer through a GtkTextMark with right
+    gravity, so text typed right before the mark pushes it along.
+
+    """
+    __slots__ = ('position', 'length', 'textmark')
+
+    def __init__(self, position, length, textmark):
+        self.position = position
+        self.length = length
+        self.textmark = textmark
+
+
+class MarkIndex(object):
+    """Index of the audio marks of a text buffer.
+
+    Marks are kept twice: in buffer order (the order never changes while
+    the text is edited, only the offsets do) and sorted by audio
+    position.  Both lists are searched with bisection, so looking up the
+    mark under the cursor or the marks around a given time is O(log n)
+    regardless of the number of marks in the transcription.
+
+    """
+    # Above this number of marks removed at once, rebuild the time
+    # index in one pass instead of removing the marks one by one.
+    BULK_REMOVE = 16
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.marks = []      # AudioMark in buffer order
+        self.times = []      # Sorted audio positions
+        self.by_time = []    # AudioMark parallel to self.times
+        self.doomed = []     # GtkTextMark to delete once it is safe
+
+        buffer.connect('insert-text', self.on_insert_text)
+        buffer.connect_after('insert-text', self.on_buffer_changed)
+        buffer.connect('delete-range', self.on_delete_range)
+        buffer.connect_after('delete-range', self.on_buffer_changed)
+
+    def __len__(self):
+        return len(self.marks)
+
+    def __iter__(self):
+        return iter(self.marks)
+
+    def get_offset(self, mark):
+        """Return the current offset of mark in the buffer."""
+        return self.buffer.get_iter_at_mark(mark.textmark).get_offset()
+
+    def add(self, offset, position, length):
+        """Register an audio mark already present in the buffer.
+
+        Keyword arguments:
+        offset -- character offset where the mark text starts
+        position -- float number to indicate the position in the audio
+        length -- length in characters of the mark text
+
+        """
+        iter = self.buffer.get_iter_at_offset(offset)
+        textmark = self.buffer.create_mark(None, iter, False)
+        mark = AudioMark(position, length, textmark)
+
+        index = self.bisect_offset(offset)
+        self.marks.insert(index, mark)
+
+        index = bisect.bisect_right(self.times, position)
+        self.times.insert(index, position)
+        self.by_time.insert(index, mark)
+
+        return mark
+
+    def append(self, offset, position, length):
+        """Like add(), but the mark is known to be the last in the buffer.
+
+        This is what loading a transcription does, and it avoids the
+        bisection over the buffer offsets.
+
+        """
+        iter = self.buffer.get_iter_at_offset(offset)
+        textmark = self.buffer.create_mark(None, iter, False)
+        mark = AudioMark(position, length, textmark)
+        self.marks.append(mark)
+
+        if not self.times or position >= self.times[-1]:
+            self.times.append(position)
+            self.by_time.append(mark)
+        else:
+            index = bisect.bisect_right(self.times, position)
+            self.times.insert(index, position)
+            self.by_time.insert(index, mark)
+
+        return mark
+
+    def clear(self):
+        for mark in self.marks:
+            self.buffer.delete_mark(mark.textmark)
+        self.marks = []
+        self.times = []
+        self.by_time = []
+
+    def bisect_offset(self, offset):
+        """Return the index of the first mark starting at or after offset."""
+        lo, hi = 0, len(self.marks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_offset(self.marks[mid]) < offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def mark_at_offset(self, offset):
+        """Return the mark whose text covers offset, or None."""
+        index = self.bisect_offset(offset + 1) - 1
+        if index < 0:
+            return None
+
+        mark = self.marks[index]
+        if offset < self.get_offset(mark) + mark.length:
+            return mark
+        return None
+
+    def mark_at_iter(self, iter):
+        return self.mark_at_offset(iter.get_offset())
+
+    def before(self, position):
+        """Return the last mark at or before position, or None."""
+        index = bisect.bisect_right(self.times, position)
+        return self.by_time[index - 1] if index > 0 else None
+
+    def after(self, position):
+        """Return the first mark at or after position, or None."""
+        index = bisect.bisect_left(self.times, position)
+        return self.by_time[index] if index < len(self.by_time) else None
+
+    def between(self, start, end):
+        """Return the marks with start <= position <= end, sorted by time."""
+        lo = bisect.bisect_left(self.times, start)
+        hi = bisect.bisect_right(self.times, end)
+        return self.by_time[lo:hi]
+
+    def remove(self, mark):
+        """Forget an audio mark."""
+        index = self.bisect_offset(self.get_offset(mark))
+        while self.marks[index] is not mark:
+            index += 1
+        self.remove_range(index, index + 1)
+
+    def remove_range(self, first, last):
+        """Forget the marks between first and last, in buffer order."""
+        marks = self.marks[first:last]
+        if not marks:
+            return
+
+        if len(marks) > self.BULK_REMOVE:
+            removed = set(id(mark) for mark in marks)
+            pairs = [(position, mark)
+                     for position, mark in zip(self.times, self.by_time)
+                     if id(mark) not in removed]
+            self.times = [position for position, mark in pairs]
+            self.by_time = [mark for position, mark in pairs]
+        else:
+            for mark in marks:
+                index = bisect.bisect_left(self.times, mark.position)
+                while self.by_time[index] is not mark:
+                    index += 1
+                del self.times[index]
+                del self.by_time[index]
+
+        del self.marks[first:last]
+
+        # GtkTextMarks are deleted after the buffer has been modified,
+        # so the iters given to the signal handlers stay valid.
+        self.doomed.extend(mark.textmark for mark in marks)
+
+    def on_insert_text(self, buffer, iter, text, length):
+        """Text typed inside an audio mark breaks it: drop the mark."""
+        offset = iter.get_offset()
+        mark = self.mark_at_offset(offset)
+        if mark is not None and offset > self.get_offset(mark):
+            self.remove(mark)
+
+    def on_delete_range(self, buffer, start, end):
+        """Drop every audio mark touched by the deleted text."""
+        start, end = start.get_offset(), end.get_offset()
+        if start > end:
+            start, end = end, start
+
+        first = self.bisect_offset(start)
+        if first > 0:
+            mark = self.marks[first - 1]
+            if self.get_offset(mark) + mark.length > start:
+                first -= 1
+
+        last = first
+        while (last < len(self.marks) and
+               self.get_offset(self.marks[last]) < end):
+            last += 1
+
+        self.remove_range(first, last)
+
+    def on_buffer_changed(self, buffer, *args):
+        for textmark in self.doomed:
+            buffer.delete_mark(textmark)
+        self.doomed = []
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Decoded audio, cached on disk and played from memory.
+
+The audio is decoded once into a sidecar of raw 16 bits samples, at the
+rate and channels of the file.  The sidecar is memory-mapped and fed to
+the playbin through an appsrc, so seeking or replaying the last seconds
+does not go through the demuxer and the decoder again: it only moves
+the read position.
+
+The sidecar is a little-endian header (magic, version, sample rate and
+channels), padded to 16 bytes, followed by the interleaved S16LE
+samples.  The sidecars of all the files are kept under CACHE_SIZE bytes
+by removing the least recently used ones.
+
+"""
+
+from __future__ import print_function
+
+import mmap
+import struct
+import sys
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstApp', '1.0')
+from gi.repository import Gst, GstApp, GObject
+
+from . import cache
+from . import jobs
+from . import pipeline
+from . import probe
+
+MAGIC = b'TRPC'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+HEADER_SIZE = 16
+SAMPLE_SIZE = 2                     # S16LE
+CHUNK = 4096                        # Frames pushed to the appsrc at once
+CACHE_SIZE = 4 * 1024 ** 3          # Bytes of sidecars kept on disk
+
+URI = 'appsrc://'
+
+
+def get_cache_path(filename):
+    return cache.cache_path('pcm', filename, '.pcm')
+
+
+class PcmFile(object):
+    """Memory-mapped raw audio.
+
+    Keyword arguments:
+    path -- sidecar file
+    rate -- sample rate, in Hz
+    channels -- number of interleaved channels
+    data -- mmap of the whole sidecar
+
+    """
+    def __init__(self, path, rate, channels, data):
+        self.path = path
+        self.rate = rate
+        self.channels = channels
+        self.data = data
+        self.frame_size = channels * SAMPLE_SIZE
+        self.frames = (len(data) - HEADER_SIZE) // self.frame_size
+
+    def get_caps(self):
+        return Gst.Caps.from_string(
+            'audio/x-raw,format=S16LE,layout=interleaved,rate=%d,channels=%d'
+            % (self.rate, self.channels))
+
+    def get_duration(self):
+        return float(self.frames) / self.rate
+
+    def read(self, frame, count):
+        """Return up to count frames from frame on, as bytes."""
+        start = HEADER_SIZE + frame * self.frame_size
+        end = min(start + count * self.frame_size, len(self.data))
+        return self.data[start:end]
+
+    def close(self):
+        self.data.close()
+
+
+def load(path):
+    """Memory-map the sidecar in path.  Return None if the file is missing
+    or it is not a sidecar we understand.
+
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if len(data) < HEADER_SIZE:
+        data.close()
+        return None
+
+    magic, version, rate, channels = HEADER.unpack(data[:HEADER.size])
+    if magic != MAGIC or version != VERSION or not rate or not channels:
+        data.close()
+        return None
+
+    cache.touch(path)
+    return PcmFile(path, rate, channels, data)
+
+
+def get_pcm(filename, limit=CACHE_SIZE):
+    """Return the decoded audio of filename, decoding and caching it if
+    needed.
+
+    This decodes the whole file when there is no cached copy, so it
+    should not be called from the main loop.
+
+    """
+    path = get_cache_path(filename)
+    pcm = load(path)
+    if pcm is not None:
+        return pcm
+
+    info = probe.probe(filename)
+    rate = info['rate'] or 44100
+    channels = min(info['channels'] or 2, 2)
+    decoder = pipeline.Decoder(filename, rate, channels, 'S16LE')
+
+    def write(f):
+        header = HEADER.pack(MAGIC, VERSION, rate, channels)
+        f.write(header + b'\0' * (HEADER_SIZE - len(header)))
+        for data in decoder.blocks():
+            f.write(data)
+
+    cache.replace(path, write)
+    cache.evict('pcm', limit, keep=(path,))
+    return load(path)
+
+
+class PcmSource(object):
+    """Feed a PcmFile to an appsrc, seekable in time.
+
+    Keyword arguments:
+    pcm -- the PcmFile to play
+    appsrc -- the source element created by the playbin for URI
+
+    """
+    def __init__(self, pcm, appsrc):
+        self.pcm = pcm
+        self.frame = 0
+
+        appsrc.set_caps(pcm.get_caps())
+        appsrc.set_property('format', Gst.Format.TIME)
+        appsrc.set_stream_type(GstApp.AppStreamType.SEEKABLE)
+        appsrc.set_duration(int(pcm.get_duration() * Gst.SECOND))
+        appsrc.connect('need-data', self.on_need_data)
+        appsrc.connect('seek-data', self.on_seek_data)
+
+    def on_need_data(self, appsrc, length):
+        if self.frame >= self.pcm.frames:
+            appsrc.end_of_stream()
+            return
+
+        data = self.pcm.read(self.frame, CHUNK)
+        count = len(data) // self.pcm.frame_size
+        buf = Gst.Buffer.new_wrapped(data)
+        buf.pts = self.frame * Gst.SECOND // self.pcm.rate
+        buf.duration = count * Gst.SECOND // self.pcm.rate
+        buf.offset = self.frame
+        self.frame += count
+        appsrc.push_buffer(buf)
+
+    def on_seek_data(self, appsrc, position):
+        self.frame = min(position * self.pcm.rate // Gst.SECOND,
+                         self.pcm.frames)
+        return True
+
+
+def cache_pcm(job, filename, limit):
+    """Decode filename into the cache (worker process)."""
+    get_pcm(filename, limit).close()
+
+
+class PcmDecoder(GObject.GObject):
+    """Get the decoded audio of a file in background.
+
+    It is decoded in a worker process, and memory-mapped from the cache
+    once it is there.  'finished' is emitted in the main loop with the
+    PcmFile, or None if the file could not be decoded.
+
+    """
+    __gsignals__ = {
+        'finished': (GObject.SIGNAL_RUN_FIRST, None, (object,))
+    }
+
+    def __init__(self, filename, limit=CACHE_SIZE):
+        GObject.GObject.__init__(self)
+        self.filename = filename
+        self.limit = limit
+        self.job = None
+
+    def start(self):
+        self.job = jobs.SCHEDULER.submit(
+            jobs.PROCESS, cache_pcm, (self.filename, self.limit),
+            key=('pcm', self.filename))
+        self.job.connect('finished', self.on_job_finished)
+        self.job.connect('failed', self.on_job_failed)
+
+    def on_job_finished(self, job, result):
+        pcm = load(get_cache_path(self.filename))
+        if pcm is None:
+            print('Cannot decode %s: the cache was removed' % self.filename,
+                  file=sys.stderr)
+        self.emit('finished', pcm)
+
+    def on_job_failed(self, job, error):
+        print('Cannot decode %s: %s' % (self.filename, error),
+              file=sys.stderr)
+        self.emit('finished', None)
@@ -18,43 +18,186 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import bisect
+import collections
+import math
+import threading
+
 import gi
 gi.require_version('Gst', '1.0')
-from gi.repository import Gst, GObject
-
-Gst.init(None)
+from gi.repository import Gst, GObject, GLib
+
+from . import probe
+from . import profile
+from . import remote
+
+# Seek flag to change the rate without flushing, GStreamer 1.18 or later
+INSTANT_RATE_CHANGE = getattr(Gst.SeekFlags, 'INSTANT_RATE_CHANGE', None)
+
+
+class TempoMap(object):
+    """Media time of the output of a tempo element, segment by segment.
+
+    The output of 'pitch' runs at the tempo of the moment: a second of
+    output is tempo seconds of the media.  Every tempo change starts a
+    segment (output time, media time, tempo), so the media time of any
+    output time is exact whatever the changes before it.  The segments
+    are added from the streaming thread and read from the main loop.
+
+    """
+    def __init__(self, tempo=1.0):
+        self.lock = threading.Lock()
+        self.reset(tempo)
+
+    def reset(self, tempo, output=0.0, media=0.0):
+        """Forget the segments, and start one at (output, media)."""
+        with self.lock:
+            self.outputs = [output]
+            self.segments = [(output, media, tempo)]
+
+    def change(self, output, tempo):
+        """From output time on, the media plays at tempo."""
+        with self.lock:
+            index = bisect.bisect_right(self.outputs, output)
+            start, media, previous = self.segments[max(index - 1, 0)]
+            media += (output - start) * previous
+            del self.outputs[index:], self.segments[index:]
+            self.outputs.append(output)
+            self.segments.append((output, media, tempo))
+
+    def to_media(self, output):
+        """Return the media time of an output time."""
+        with self.lock:
+            index = bisect.bisect_right(self.outputs, output)
+            start, media, tempo = self.segments[max(index - 1, 0)]
+        return media + (output - start) * tempo
 
 
 class Pipeline(Gst.Pipeline):
-    def __init__(self):
+    """A playbin that plays at variable speed.
+
+    The audio sink is not created until it is needed to play, so opening
+    a file does not open the audio device.  A silent pipeline outputs to
+    a fakesink instead, so it can be prerolled without the device, and
+    the device is swapped in when it has to be heard.
+
+    Seeks go to the nearest key unit by default, which is fast but, on
+    compressed and VBR audio, can land far from the requested position.
+    In precise mode they are ACCURATE: the demuxer or parser finds the
+    key unit before the position and the decoder drops the audio up to
+    it, so playback starts at the exact sample.
+
+    Keyword arguments:
+    audio_sink -- name of the element to output the audio to
+
+    """
+    SEEK_FLAGS = Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT
+    PRECISE_SEEK_FLAGS = Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE
+
+    def __init__(self, audio_sink='autoaudiosink'):
+        # GStreamer is initialized, and its registry loaded, by the first
+        # pipeline instead of on import
+        Gst.init(None)
         Gst.Pipeline.__init__(self)
         self.playbin = Gst.ElementFactory.make('playbin', None)
         self.add(self.playbin)
 
-        # Try the plug-ing 'pitch' to control the speed and pitch (tempo).
-        # If not present, then use speed without pitch as fallback.
-        try:
-            self.pitch = Gst.ElementFactory.make('pitch', None)
-            audio_sink = Gst.ElementFactory.make('autoaudiosink', None)
-            audio_convert = Gst.ElementFactory.make('audioconvert', None)
-
-            sbin = Gst.Bin()
-            sbin.add(self.pitch)
-            sbin.add(audio_sink)
-            sbin.add(audio_convert)
-            self.pitch.link(audio_convert)
-            audio_convert.link(audio_sink)
+        self.audio_sink = audio_sink
+        self.has_sink = False
+        self.silent = False
+        self.convert = None
+        self.output = None
+        self.tempo = None
+        self.pitch = None
+        self.speed = 1.0
+        self.precise = False
+
+        # Media time of the output of 'pitch', and the tempo that its
+        # next buffer starts
+        self.tempo_map = TempoMap()
+        self.pending_tempo = None
+
+    def create_sink(self):
+        """Create the audio sink of the playbin, if not done yet."""
+        if self.has_sink:
+            return
+        self.has_sink = True
+        self.output = self.make_output()
+
+        # Change the tempo keeping the pitch, with the plug-in 'pitch' or
+        # else with 'scaletempo' and rate seeks.  Without them, the rate
+        # seeks change the pitch too.
+        for name in ('pitch', 'scaletempo'):
+            sink = self.make_tempo_sink(name)
+            if sink is not None:
+                self.tempo = name
+                break
+        else:
+            sink = self.make_tempo_sink(None)
+            self.tempo = 'rate'
+        self.playbin.set_property('audio-sink', sink)
+
+        if self.tempo == 'pitch':
+            self.pitch = sink.get_by_name('tempo')
+            self.pitch.set_property('tempo', self.speed)
+            self.tempo_map.reset(self.speed)
+            self.pitch.get_static_pad('src').add_probe(
+                Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM,
+                self.on_tempo_probe)
+
+    def on_tempo_probe(self, pad, info):
+        """Keep the TempoMap of what 'pitch' outputs (streaming thread)."""
+        if info.type & Gst.PadProbeType.BUFFER:
+            tempo = self.pending_tempo
+            buffer = info.get_buffer()
+            if tempo is None or buffer.pts == Gst.CLOCK_TIME_NONE:
+                return Gst.PadProbeReturn.OK
+            self.pending_tempo = None
+
+            # The first buffer at the new tempo
+            event = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+            if event is not None:
+                segment = event.parse_segment()
+                output = segment.to_stream_time(Gst.Format.TIME, buffer.pts)
+                self.tempo_map.change(float(output) / Gst.SECOND, tempo)
+        elif info.get_event().type == Gst.EventType.SEGMENT:
+            # After a seek, 'pitch' starts its output at position / tempo
+            self.pending_tempo = None
+            self.tempo_map.reset(self.get_speed())
+        return Gst.PadProbeReturn.OK
+
+    def make_output(self):
+        """Return the element the audio ends in: the audio sink, or a
+        fakesink when silent.
 
-            sink_pad = Gst.GhostPad.new('sink',
-                                        self.pitch.get_static_pad('sink'))
-            sbin.add_pad(sink_pad)
+        """
+        if self.silent:
+            return Gst.ElementFactory.make('fakesink', None)
+        return Gst.ElementFactory.make(self.audio_sink, None)
 
-            self.playbin.set_property('audio-sink', sbin)
+    def make_tempo_sink(self, name):
+        """Return a bin with the tempo element name, if any, before the
+        output, or None if it is not available.
 
-            self.speed = float(self.pitch.get_property('tempo'))
-        except:
-            self.pitch = None
-            self.speed = 1.0
+        """
+        tempo = Gst.ElementFactory.make(name, 'tempo') if name else None
+        audio_convert = Gst.ElementFactory.make('audioconvert', None)
+        if (name and tempo is None) or audio_convert is None or \
+                self.output is None:
+            return None
+
+        sbin = Gst.Bin()
+        sbin.add(audio_convert)
+        sbin.add(self.output)
+        audio_convert.link(self.output)
+        first = audio_convert
+        if tempo is not None:
+            sbin.add(tempo)
+            tempo.link(audio_convert)
+            first = tempo
+        sbin.add_pad(Gst.GhostPad.new('sink', first.get_static_pad('sink')))
+        self.convert = audio_convert
+        return sbin
 
     def get_file(self):
         return self.playbin.get_property('uri')
@@ -65,21 +208,76 @@ class Pipeline(Gst.Pipeline):
         else:
             return self.speed
 
+    def get_seek_flags(self):
+        if self.precise:
+            return self.PRECISE_SEEK_FLAGS
+        return self.SEEK_FLAGS
+
     def get_volume(self):
         return float(self.playbin.get_property('volume'))
 
     def set_file(self, uri):
         self.playbin.set_property('uri', uri)
 
+    def set_precise(self, precise):
+        self.precise = precise
+
     def set_speed(self, speed):
-        if self.pitch:
+        """Change the speed from where the audio is.  Return False if
+        it was done with a flushing seek, which ends a segment seek.
+
+        With 'pitch' the tempo changes in place.  Otherwise it is a rate
+        seek: an instant rate change when GStreamer (1.18 or later) and
+        the elements of the file support it, or a flushing one.
+
+        """
+        in_place = True
+        if not self.has_sink:
+            pass  # Applied when the sink is created
+        elif self.pitch:
+            self.pending_tempo = speed
             self.pitch.set_property('tempo', speed)
-        else:
-            self.playbin.seek(speed, Gst.Format.TIME,
-                              Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
+        elif not (INSTANT_RATE_CHANGE is not None and self.playbin.seek(
+                speed, Gst.Format.TIME, INSTANT_RATE_CHANGE,
+                Gst.SeekType.NONE, -1, Gst.SeekType.NONE, -1)):
+            self.playbin.seek(speed, Gst.Format.TIME, self.get_seek_flags(),
                               Gst.SeekType.NONE, -1,
                               Gst.SeekType.NONE, -1)
+            in_place = False
         self.speed = speed
+        return in_place
+
+    def set_silent(self, silent):
+        """Output to a fakesink instead of the audio device, or back,
+        which closes or opens the device.
+
+        In PAUSED or PLAYING, the streaming thread stops if it was
+        waiting in the old output; a flushing seek starts it again.
+
+        """
+        if silent == self.silent:
+            return
+        self.silent = silent
+        if self.convert is None:
+            return  # Applied when the sink is created
+
+        output = self.make_output()
+        if output is None:
+            self.silent = not silent
+            return
+
+        # What comes meanwhile waits instead of finding no sink
+        pad = self.convert.get_static_pad('src')
+        block = pad.add_probe(Gst.PadProbeType.BLOCK_DOWNSTREAM,
+                              lambda pad, info: Gst.PadProbeReturn.OK)
+        sbin = self.output.get_parent()
+        self.output.set_state(Gst.State.NULL)
+        sbin.remove(self.output)
+        sbin.add(output)
+        self.convert.link(output)
+        output.sync_state_with_parent()
+        self.output = output
+        pad.remove_probe(block)
 
     def set_volume(self, volume):
         self.playbin.set_property('volume', volume)
@@ -87,27 +285,54 @@ class Pipeline(Gst.Pipeline):
     def disable(self):
         self.set_state(Gst.State.NULL)
 
+    def is_disabled(self):
+        """Return whether the pipeline is stopped, and not starting."""
+        ret, state, pending = self.get_state(0)
+        return (state == Gst.State.NULL and
+                pending == Gst.State.VOID_PENDING)
+
     def play(self):
+        self.create_sink()
         self.set_state(Gst.State.PLAYING)
 
     def pause(self):
+        self.create_sink()
         self.set_state(Gst.State.PAUSED)
 
-    def query_position(self, format_time=Gst.Format.TIME):
+    def get_stream_rate(self):
+        """Return how fast the stream time advances, per second."""
+        # The output of pitch is in real time; rate seeks scale it
+        return 1.0 if self.pitch else self.speed
+
+    def to_media_time(self, stream_time):
+        """Return the media time of a stream time of the sink."""
         # Only with pitch the position is sensible to tempo.
-        speed = self.get_speed() if self.pitch else 1.0
+        if self.pitch:
+            return self.tempo_map.to_media(stream_time)
+        return stream_time
+
+    def query_stream_time(self):
+        """Return the state of the query and the stream time of the sink,
+        in seconds.
+
+        """
         pipe_state, nanosecs = self.playbin.query_position(Gst.Format.TIME)
-        position = float(nanosecs) * speed / Gst.SECOND
-        return pipe_state, position
+        return pipe_state, float(nanosecs) / Gst.SECOND
+
+    def query_position(self, format_time=Gst.Format.TIME):
+        pipe_state, stream_time = self.query_stream_time()
+        return pipe_state, self.to_media_time(stream_time)
 
     def query_duration(self, format_time=Gst.Format.TIME):
         pipe_state, nanosecs = self.playbin.query_duration(format_time)
         duration = float(nanosecs) / Gst.SECOND
         return pipe_state, duration
 
-    def seek_simple(self, position,
-                    flags=Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT):
+    @profile.timed('seek')
+    def seek_simple(self, position, flags=None):
         """A wrapper for Playbin simple_seek"""
+        if flags is None:
+            flags = self.get_seek_flags()
         if self.pitch:
             pos = float(position) / self.get_speed() * Gst.SECOND
             self.playbin.seek_simple(Gst.Format.TIME, flags, pos)
@@ -116,43 +341,335 @@ class Pipeline(Gst.Pipeline):
             self.playbin.seek(self.speed, Gst.Format.TIME, flags,
                               Gst.SeekType.SET, pos, Gst.SeekType.NONE, -1)
 
+    def seek_segment(self, start, end, flush=True):
+        """Play from start to end, and post 'segment-done' instead of
+        'eos' when end is reached.  Without flush, the segment is queued
+        after the one playing, with no gap between them.
+
+        """
+        flags = Gst.SeekFlags.SEGMENT | Gst.SeekFlags.ACCURATE
+        if flush:
+            flags |= Gst.SeekFlags.FLUSH
+
+        if self.pitch:
+            rate, scale = 1.0, Gst.SECOND / self.get_speed()
+        else:
+            rate, scale = self.speed, Gst.SECOND
+        self.playbin.seek(rate, Gst.Format.TIME, flags,
+                          Gst.SeekType.SET, int(start * scale),
+                          Gst.SeekType.SET, int(end * scale))
+
 
 class Audio(GObject.GObject):
+    """Audio file player.
+
+    While playing, the position is interpolated from the pipeline clock
+    and the speed, instead of querying the pipeline every time.  It is
+    interpolated in the stream time of the sink and mapped to media time
+    by the Pipeline, so it stays exact across speed changes, and it is
+    corrected with a query every RESYNC_INTERVAL seconds.  Consumers
+    subscribe to 'update-position' and tell set_position_updates() how
+    far the position has to move for them to care, e.g. a pixel of a
+    slider: while playing, the signal is emitted when it gets there, from
+    a timeout set for that moment at the current speed.
+
+    An A-B loop plays a segment of the audio over and over.  It is done
+    with segment seeks: when the end of the loop is decoded the pipeline
+    posts 'segment-done', and the start of the loop is queued with a
+    non-flushing seek while the end of it is still being played, so
+    there is no gap and nothing is decoded twice, as long as the start
+    of the loop reaches the sink before the end of it has been played.
+    How late the first buffer of every restart reaches the sink, which
+    is the silence heard, is recorded; LOOP_RESTART_BUDGET is what we
+    allow.
+
+    """
     __gsignals__ = {
         'update-duration': (GObject.SIGNAL_RUN_FIRST, None, (float,)),
         'update-position': (GObject.SIGNAL_RUN_FIRST, None, (float,)),
+        'update-loop': (GObject.SIGNAL_RUN_FIRST, None, (object,)),
         'finished': (GObject.SIGNAL_RUN_FIRST, None, ())
     }
 
-    def __init__(self, filename):
+    RESYNC_INTERVAL = 1.0
+    LOOP_RESTART_BUDGET = 0.02  # Seconds of silence when the loop restarts
+
+    def __init__(self, filename, audio_sink='autoaudiosink'):
         GObject.GObject.__init__(self)
 
-        self.playbin = Pipeline()
-        self.playbin.set_file('file://%s' % filename)
+        self.filename = filename
+        self.playbin = Pipeline(audio_sink)
+
+        # A file on a server is read through the range cache, and fed to
+        # the playbin by on_source_setup()
+        self.remote = None
+        self.remote_source = None
+        if remote.is_remote(filename):
+            self.remote = remote.RemoteFile(filename)
+            self.remote.prefetch(0)
+            self.playbin.set_file(remote.URI)
+        else:
+            self.playbin.set_file('file://%s' % filename)
+        self.playbin.playbin.connect('source-setup', self.on_source_setup)
 
         self.bus = self.playbin.get_bus()
         self.bus.add_signal_watch()
 
         self.bus.connect('message::eos', self.on_bus_finished)
         self.bus.connect('message::duration', self.on_bus_duration_changed)
-
-        # We change quickly in order to let us query the pipeline before
-        # playing. The pipeline might take some time (ms) to load or
-        # process the audio file, so we use a timer event to query
-        # constantly until the information is available.
-        # This trick (PLAYING/PAUSED) is useful to set a different speed,
-        # otherwise it does not work.
-        self.playbin.play()
-        self.playbin.pause()
-        GObject.timeout_add(200, self.update_duration)
+        self.bus.connect('message::async-done', self.on_bus_async_done)
+        self.bus.connect('message::state-changed',
+                         self.on_bus_state_changed)
+        self.bus.connect('message::segment-done', self.on_bus_segment_done)
+
+        # The pipeline is prerolled the first time we play, until then
+        # the duration comes from the (cached) metadata of the file.
+        self.prerolled = False
+        self.pending_play = None
+        self.pending_seek = None
+        self.info = None
+
+        # Decoded copy of the file, played from memory when ready
+        self.pcm = None
+        self.pcm_source = None
+        self.pcm_decoder = None
+
+        # (position, clock time) to interpolate the position from
+        self.anchor = None
+        self.last_position = -1
+
+        # Step and shortest interval of the 'update-position' signals
+        # while playing, and the timeout of the next one
+        self.update_step = None
+        self.update_interval = 0.0
+        self.update_source = None
+
+        # (start, end) of the A-B loop, and the gaps of its last restarts.
+        # Once a restart is queued, the sink probe waits for its segment
+        # and then for its first buffer.
+        self.loop = None
+        self.loop_gaps = collections.deque(maxlen=100)
+        self.sink_probe = None
+        self.restarting = False
+        self.restart_segment = False
+
+        # Tokens of what is being timed, when profiling
+        self.probe_started = profile.start()
+        self.seek_started = None
+        self.play_started = None
+
+        self.prober = probe.Prober(filename)
+        self.prober.connect('finished', self.on_probe_finished)
+        self.prober.start()
 
         self.playing = False
 
+    def on_probe_finished(self, prober, info):
+        profile.stop('probe-duration', self.probe_started)
+        self.probe_started = None
+        self.info = info
+        if info is not None and info['duration'] > 0:
+            self.emit('update-duration', info['duration'])
+
+    def on_bus_async_done(self, bus, message):
+        """The pipeline has prerolled: it is ready to set the speed, to
+           seek and to play.
+
+        """
+        if self.prerolled:
+            # A seek finished, the position changed
+            profile.stop('seek-done', self.seek_started)
+            self.seek_started = None
+            if self.playing:
+                self.sync_position()
+                self.schedule_update()
+            return
+        self.prerolled = True
+
+        if self.info is None:
+            self.update_duration()
+
+        if self.pending_play is not None:
+            speed, position = self.pending_play
+            self.pending_play = None
+            self.play(speed, position)
+        elif self.pending_seek is not None:
+            self.seek(self.pending_seek)
+        self.pending_seek = None
+
+    def on_bus_state_changed(self, bus, message):
+        if message.src != self.playbin:
+            return
+
+        old, new, pending = message.parse_state_changed()
+        if new == Gst.State.PLAYING:
+            profile.stop('time-to-playing', self.play_started)
+            self.play_started = None
+            self.sync_position()
+            self.schedule_update()
+        else:
+            self.anchor = None
+            self.cancel_update()
+
     def stop(self):
+        self.cancel_update()
+        self.restarting = False
+        self.prober.stop()
         self.playbin.disable()
         self.playing = False
+        self.prerolled = False
+        self.pending_play = None
+        self.pending_seek = None
+        self.seek_started = None
+        self.play_started = None
+        self.anchor = None
+        if self.pcm is not None:
+            self.pcm_source = None
+            self.pcm.close()
+            self.pcm = None
+
+    def close(self):
+        """Stop and release the pipeline, for good."""
+        self.stop()
+        if self.pcm_decoder is not None:
+            self.pcm_decoder.disconnect_by_func(self.on_pcm_finished)
+            self.pcm_decoder = None
+        if self.remote is not None:
+            self.remote.close()
+        if self.sink_probe is not None:
+            sink = self.playbin.playbin.get_property('audio-sink')
+            sink.get_static_pad('sink').remove_probe(self.sink_probe)
+            self.sink_probe = None
+        self.bus.remove_signal_watch()
+
+    def preroll(self, silent=False):
+        """Get ready to play, without playing.  A silent preroll does not
+        open the audio device, and closes it if it is open, until the
+        next preroll or play.
+
+        """
+        if silent and self.playing:
+            self.pause()
+        self.set_silent(silent)
+        if not self.prerolled and not self.playing:
+            self.playbin.pause()
+
+    def set_silent(self, silent):
+        """Output to a fakesink instead of the audio device, or back,
+        staying where the audio is.
+
+        """
+        if silent == self.playbin.silent:
+            return
+        if self.playbin.is_disabled():
+            self.playbin.set_silent(silent)
+            return
+
+        if not self.prerolled:
+            # Halfway through the preroll: start it again
+            self.playbin.disable()
+            self.playbin.set_silent(silent)
+            self.playbin.pause()
+            return
+
+        # The new output prerolls from where the audio is.  Until then
+        # the pipeline is not ready, so what comes meanwhile waits.
+        position = self.get_position()
+        self.cancel_update()
+        self.prerolled = False
+        self.restarting = False
+        self.anchor = None
+        self.playbin.set_silent(silent)
+        if self.loop is not None and \
+                self.loop[0] <= position < self.loop[1]:
+            self.playbin.seek_segment(position, self.loop[1])
+        else:
+            self.playbin.seek_simple(max(position, 0))
+
+    def get_duration(self):
+        """Return the duration known so far, or -1."""
+        if self.info is not None and self.info['duration'] > 0:
+            return self.info['duration']
+        if self.prerolled:
+            state, duration = self.playbin.query_duration()
+            if state:
+                return duration
+        return -1
+
+    def use_pcm_cache(self, limit=None):
+        """Decode the file in background and play it from the decoded
+        copy once it is ready, so seeking does not decode again.
+
+        Keyword arguments:
+        limit -- bytes of decoded files to keep on disk (default:
+                 pcm.CACHE_SIZE)
+
+        """
+        if self.remote is not None:
+            return  # It would download the whole file first
+        from . import pcm
+        self.pcm_decoder = pcm.PcmDecoder(self.filename,
+                                          limit or pcm.CACHE_SIZE)
+        self.pcm_decoder.connect('finished', self.on_pcm_finished)
+        self.pcm_decoder.start()
+
+    def on_pcm_finished(self, decoder, pcm_file):
+        from . import pcm
+        self.pcm_decoder = None
+        if pcm_file is None:
+            return  # Keep playing the file itself
+
+        position = self.get_position() if self.prerolled else -1
+        speed = self.playbin.get_speed()
+        playing = self.playing and self.pending_play is None
+
+        self.playbin.set_state(Gst.State.NULL)
+        self.prerolled = False
+        self.anchor = None
+        self.pcm = pcm_file
+        self.playbin.set_file(pcm.URI)
+
+        if playing:
+            self.play(speed, max(position, 0))
+        elif self.pending_play is not None or position > 0:
+            # Preroll the new source, then play or go where we were
+            if position > 0:
+                self.pending_seek = position
+            self.playbin.pause()
+
+    def on_source_setup(self, playbin, source):
+        if self.pcm is not None:
+            from . import pcm
+            self.pcm_source = pcm.PcmSource(self.pcm, source)
+        elif self.remote is not None:
+            self.remote_source = remote.RemoteSource(self.remote, source)
+
+    def sync_position(self):
+        """Interpolate the position from what the pipeline reports now."""
+        clock = self.playbin.get_clock()
+        pipe_state, stream_time = self.playbin.query_stream_time()
+        if clock is None or not pipe_state:
+            self.anchor = None
+            return
+        self.anchor = (stream_time, clock.get_time())
 
     def get_position(self):
+        if self.anchor is not None:
+            clock = self.playbin.get_clock()
+            stream_time, base = self.anchor
+            elapsed = float(clock.get_time() - base) / Gst.SECOND
+            if elapsed < self.RESYNC_INTERVAL:
+                stream_time += elapsed * self.playbin.get_stream_rate()
+                position = self.playbin.to_media_time(stream_time)
+                if self.loop is not None and position >= self.loop[1]:
+                    start, end = self.loop
+                    position = start + (position - end) % (end - start)
+                return position
+
+            self.sync_position()
+            if self.anchor is not None:
+                return self.playbin.to_media_time(self.anchor[0])
+
         pipe_state, position = self.playbin.query_position()
 
         # pipeline is not ready and does not know position
@@ -161,6 +678,60 @@ class Audio(GObject.GObject):
 
         return position
 
+    def update_position(self):
+        """Emit 'update-position' if the position changed since the last
+        time.  Return the position.
+
+        """
+        position = self.get_position()
+        if position >= 0 and position != self.last_position:
+            self.last_position = position
+            self.emit('update-position', position)
+        return position
+
+    def set_position_updates(self, step, interval=0.0):
+        """While playing, emit 'update-position' whenever the position
+        moves by step seconds, but not more often than every interval
+        seconds.  A step of None stops the updates.
+
+        """
+        self.update_step = step
+        self.update_interval = interval
+        if self.prerolled and self.playing:
+            self.schedule_update()
+        else:
+            self.cancel_update()  # Started once it plays
+
+    def schedule_update(self):
+        self.cancel_update()
+        if self.update_step is None or not self.playing:
+            return
+        delay = max(self.get_next_update(self.update_step),
+                    self.update_interval)
+        self.update_source = GLib.timeout_add(int(math.ceil(delay * 1000)),
+                                              self.on_update_timeout)
+
+    def cancel_update(self):
+        if self.update_source is not None:
+            GLib.source_remove(self.update_source)
+            self.update_source = None
+
+    def on_update_timeout(self):
+        self.update_source = None
+        self.update_position()
+        self.schedule_update()
+        return False
+
+    def get_next_update(self, step):
+        """Return the seconds until the position reaches the next multiple
+        of step (e.g. the next pixel of a slider) at the current speed.
+
+        """
+        position = self.get_position()
+        if not self.playing or position < 0 or step <= 0:
+            return step
+        return (step - position % step) / self.playbin.get_speed()
+
     def on_bus_duration_changed(self, bus, message):
         """GStreamer notifies us the audio duration has changed,
            therefore we need to update the slider and label
@@ -169,6 +740,7 @@ class Audio(GObject.GObject):
         self.update_duration()
 
     def on_bus_finished(self, bus, message):
+        self.cancel_update()
         self.playbin.pause()
         self.playing = False
         # Go to beginning of the audio, but keep the slider at the end
@@ -193,26 +765,232 @@ class Audio(GObject.GObject):
         self.emit('update-duration', duration)
         return False
 
+    @profile.timed('play')
     def play(self, speed=1.0, position=0):
+        if not self.playing:
+            self.play_started = profile.start()
+        self.set_silent(False)
         self.playing = True
 
+        if not self.prerolled:
+            # Speed and position are set once the pipeline is ready
+            self.pending_play = (speed, position)
+            self.playbin.pause()
+            return
+
+        if self.loop is not None and not \
+                self.loop[0] <= position < self.loop[1]:
+            position = self.loop[0]
+
         self.playbin.play()
         self.playbin.set_speed(speed)
-        self.playbin.seek_simple(position)
+        self.seek(position)
 
     def pause(self):
-        self.playbin.pause()
+        self.cancel_update()
+        self.pending_play = None
+        self.anchor = None
+        if self.prerolled:
+            self.playbin.pause()
         self.playing = False
 
     def seek(self, position):
+        """Go to position.  Going out of the A-B loop ends it.
+
+        Before the preroll, the seek is done once it is complete.
+
+        """
+        if not self.prerolled:
+            if self.pending_play is not None:
+                self.pending_play = (self.pending_play[0], position)
+            else:
+                self.pending_seek = position
+            return
+
+        self.seek_started = profile.start()
+        self.restarting = False
+        if self.loop is not None:
+            start, end = self.loop
+            if start <= position < end:
+                self.playbin.seek_segment(position, end)
+                return
+            self.loop = None
+            self.emit('update-loop', None)
+
         self.playbin.seek_simple(position)
 
-    def set_speed(self, speed):
+    def set_loop(self, start, end):
+        """Play from start to end over and over, from where we are if it
+        is in between, or from start otherwise.
+
+        """
+        self.loop = (start, end)
+        self.emit('update-loop', self.loop)
+        if not self.prerolled:
+            return
+
         position = self.get_position()
-        self.playbin.set_speed(speed)
-        # Hack. GStreamer (or pitch) gets lost when the speed changes
-        if position >= 0:
+        if not start <= position < end:
+            position = start
+        self.anchor = None
+        self.playbin.seek_segment(position, end)
+
+    def clear_loop(self):
+        """Stop looping and keep playing from where we are."""
+        if self.loop is None:
+            return
+
+        self.loop = None
+        self.restarting = False
+        self.emit('update-loop', None)
+        position = self.get_position()
+        if self.prerolled and position >= 0:
+            self.anchor = None
             self.playbin.seek_simple(position)
 
+    def on_bus_segment_done(self, bus, message):
+        if self.loop is None:
+            return
+
+        if self.sink_probe is None:
+            sink = self.playbin.playbin.get_property('audio-sink')
+            self.sink_probe = sink.get_static_pad('sink').add_probe(
+                Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM,
+                self.on_sink_probe)
+        self.restart_segment = False
+        self.restarting = True
+
+        start, end = self.loop
+        self.playbin.seek_segment(start, end, flush=False)
+
+    def on_sink_probe(self, pad, info):
+        """Record how late the first buffer of a restart of the loop
+        reaches the sink (streaming thread).
+
+        """
+        if not self.restarting:
+            return Gst.PadProbeReturn.OK
+        if not info.type & Gst.PadProbeType.BUFFER:
+            if info.get_event().type == Gst.EventType.SEGMENT:
+                self.restart_segment = True
+            return Gst.PadProbeReturn.OK
+        if not self.restart_segment:
+            return Gst.PadProbeReturn.OK  # The end of the loop, still
+        self.restarting = False
+
+        buffer = info.get_buffer()
+        event = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+        clock = self.playbin.get_clock()
+        if event is None or clock is None or \
+                buffer.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+
+        # The sink renders it at its running time plus the latency
+        running = event.parse_segment().to_running_time(Gst.Format.TIME,
+                                                        buffer.pts)
+        if running == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK  # Clipped
+        now = clock.get_time() - self.playbin.get_base_time()
+        late = now - running - self.playbin.get_latency()
+        self.loop_gaps.append(max(0.0, float(late) / Gst.SECOND))
+        return Gst.PadProbeReturn.OK
+
+    def set_precise(self, precise):
+        """Seek to the exact position instead of the nearest key unit."""
+        self.playbin.set_precise(precise)
+
+    @profile.timed('set-speed')
+    def set_speed(self, speed):
+        """Play at speed from where the audio is, without seeking when
+        the pipeline can change it in place.
+
+        """
+        if not self.prerolled:
+            self.playbin.set_speed(speed)
+            return
+
+        position = self.get_position()
+        in_place = self.playbin.set_speed(speed)
+        self.anchor = None
+        if in_place:
+            # There is no async-done to anchor the position again
+            if self.playing:
+                self.sync_position()
+        elif self.loop is not None and position >= 0:
+            # The flushing rate seek ended the segment seek of the loop
+            self.seek(position)
+        if self.playing:
+            self.schedule_update()  # The next step comes at another time
+
     def is_playing(self):
         return self.playing
+
+
+class Decoder(object):
+    """Decode an audio file into blocks of raw samples, as fast as possible.
+
+    This is meant for analysis, not for playback: the audio goes to an
+    appsink without synchronization to the clock.  The appsink only
+    queues a few buffers, so a long file is decoded in constant memory.
+
+    Keyword arguments:
+    filename -- audio file to decode
+    rate -- sample rate of the blocks, in Hz
+    channels -- number of channels of the blocks (mixed down if needed)
+    sample_format -- GStreamer raw audio format of the samples
+
+    """
+    POLL = Gst.SECOND // 10     # Waiting for a sample, between bus checks
+
+    def __init__(self, filename, rate=8000, channels=1,
+                 sample_format='F32LE'):
+        Gst.init(None)
+        self.rate = rate
+        self.channels = channels
+        self.pipeline = Gst.parse_launch(
+            'uridecodebin name=source ! audioconvert ! audioresample ! '
+            'capsfilter caps=audio/x-raw,format=%s,rate=%d,channels=%d ! '
+            'appsink name=sink sync=false max-buffers=8 '
+            'enable-last-sample=false' % (sample_format, rate, channels))
+        self.pipeline.get_by_name('source').set_property(
+            'uri', probe.get_uri(filename))
+        self.sink = self.pipeline.get_by_name('sink')
+
+    def blocks(self):
+        """Yield the decoded audio as bytes, until the end of the file.
+
+        Raise IOError if the file cannot be decoded.
+
+        """
+        bus = self.pipeline.get_bus()
+        self.pipeline.set_state(Gst.State.PLAYING)
+        try:
+            while True:
+                sample = self.sink.emit('try-pull-sample', self.POLL)
+                if sample is not None:
+                    buf = sample.get_buffer()
+                    yield buf.extract_dup(0, buf.get_size())
+                    continue
+                self.check_error(bus)
+                if self.sink.get_property('eos'):
+                    break
+            # The error may have been posted after the end of stream
+            self.check_error(bus)
+        finally:
+            self.pipeline.set_state(Gst.State.NULL)
+
+    def check_error(self, bus):
+        """Raise IOError if the pipeline posted an error.
+
+        An error does not always bring the appsink to the end of stream,
+        so waiting for samples alone could wait forever.
+
+        """
+        message = bus.pop_filtered(Gst.MessageType.ERROR)
+        if message is not None:
+            error, debug = message.parse_error()
+            raise IOError(error.message)
+
+    def stop(self):
+        """Stop decoding; blocks() ends after the queued blocks."""
+        self.pipeline.send_event(Gst.Event.new_eos())
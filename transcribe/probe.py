@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Metadata of audio files, probed with the GStreamer discoverer.
+
+The metadata is a dictionary with the keys 'duration' (seconds),
+'codec', 'channels', 'rate' and 'seekable'.  It is cached on disk, so
+a file that was opened before does not need to be probed again.
+
+"""
+
+import json
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstPbutils', '1.0')
+from gi.repository import Gst, GstPbutils, GObject, GLib
+
+from . import cache
+from . import jobs
+from . import remote
+
+TIMEOUT = 10  # Seconds to wait for the discoverer
+
+
+def get_uri(filename):
+    """Return the URI of filename, a local file or one on a server."""
+    if remote.is_remote(filename):
+        return filename
+    return Gst.filename_to_uri(filename)
+
+
+def get_cache_path(filename):
+    return cache.cache_path('probe', filename, '.json')
+
+
+def load(filename):
+    """Return the cached metadata of filename, or None."""
+    try:
+        with open(get_cache_path(filename)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save(filename, info):
+    data = json.dumps(info).encode('utf-8')
+    cache.replace(get_cache_path(filename), lambda f: f.write(data))
+
+
+def info_to_dict(info):
+    """Return the metadata of a GstPbutils.DiscovererInfo."""
+    result = {
+        'duration': float(info.get_duration()) / Gst.SECOND,
+        'seekable': bool(info.get_seekable()),
+        'codec': None,
+        'channels': None,
+        'rate': None,
+    }
+
+    streams = info.get_audio_streams()
+    if streams:
+        stream = streams[0]
+        caps = stream.get_caps()
+        if caps is not None:
+            result['codec'] = GstPbutils.pb_utils_get_codec_description(caps)
+        result['channels'] = stream.get_channels()
+        result['rate'] = stream.get_sample_rate()
+
+    return result
+
+
+def probe(filename, timeout=TIMEOUT):
+    """Return the metadata of filename, probing it if it is not cached.
+
+    Raise IOError if the file cannot be probed.
+
+    """
+    info = load(filename)
+    if info is not None:
+        return info
+
+    Gst.init(None)
+    discoverer = GstPbutils.Discoverer.new(timeout * Gst.SECOND)
+    try:
+        result = discoverer.discover_uri(get_uri(filename))
+    except GLib.Error as e:
+        raise IOError(e.message)
+
+    info = info_to_dict(result)
+    try:
+        save(filename, info)
+    except (IOError, OSError):
+        pass  # Not cached, we will probe it again next time
+    return info
+
+
+def probe_job(job, filename, timeout):
+    return probe(filename, timeout)
+
+
+class Prober(GObject.GObject):
+    """Probe the metadata of an audio file without blocking.
+
+    'finished' is emitted in the main loop with the metadata, or None if
+    the file could not be probed.  Probers of the same file share the
+    job that probes it.
+
+    """
+    __gsignals__ = {
+        'finished': (GObject.SIGNAL_RUN_FIRST, None, (object,))
+    }
+
+    def __init__(self, filename, timeout=TIMEOUT):
+        GObject.GObject.__init__(self)
+        self.filename = filename
+        self.timeout = timeout
+        self.job = None
+        self.handlers = []
+
+    def start(self):
+        info = load(self.filename)
+        if info is not None:
+            GLib.idle_add(self.emit, 'finished', info)
+            return
+
+        self.job = jobs.SCHEDULER.submit(
+            jobs.THREAD, probe_job, (self.filename, self.timeout),
+            key=('probe', self.filename), priority=jobs.PRIORITY_HIGH)
+        self.handlers = [
+            self.job.connect('finished', self.on_job_finished),
+            self.job.connect('failed', self.on_job_failed),
+        ]
+
+    def stop(self):
+        # Not cancelled, as other probers may be waiting for it too
+        for handler in self.handlers:
+            self.job.disconnect(handler)
+        self.handlers = []
+        self.job = None
+
+    def on_job_finished(self, job, info):
+        self.job = None
+        self.emit('finished', info)
+
+    def on_job_failed(self, job, error):
+        self.job = None
+        self.emit('finished', None)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Latency of the operations the user waits for.
+
+Off by default.  Once enable() is called, the functions decorated with
+timed() and the intervals measured with start() and stop() are added to
+a histogram per name, and a report is written as JSON when the
+application exits or receives SIGUSR1.
+
+The histograms have a fixed number of logarithmic buckets (BUCKETS per
+octave, about 19% wide), so recording is a few arithmetic operations and
+a dictionary update whatever the number of samples, and the percentiles
+are within a bucket of the exact ones.
+
+When it is off, a timed() function costs one extra call and test, and
+start() returns None, which makes stop() return at once.
+
+"""
+
+from __future__ import print_function
+
+import atexit
+import functools
+import json
+import math
+import os
+import platform
+import signal
+import sys
+import time
+
+BUCKETS = 4                     # Buckets per octave
+PERCENTILES = (50, 90, 99)
+
+enabled = False
+histograms = {}
+started = None
+output = None
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time           # Python 2
+
+
+class Histogram(object):
+    """The distribution of the durations of an operation."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = {}
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        if seconds > 0:
+            mantissa, exponent = math.frexp(seconds)
+            index = exponent * BUCKETS + int((mantissa - 0.5) * 2 * BUCKETS)
+        else:
+            index = None
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    @staticmethod
+    def lower_bound(index):
+        """Return the smallest duration of a bucket, in seconds."""
+        if index is None:
+            return 0.0
+        exponent, step = divmod(index, BUCKETS)
+        return math.ldexp(0.5 + step / (2.0 * BUCKETS), exponent)
+
+    def percentile(self, percent):
+        """Return the upper bound of the bucket of the given percentile."""
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index in sorted(self.buckets, key=self.lower_bound):
+            seen += self.buckets[index]
+            if seen >= rank:
+                if index is None:
+                    return 0.0
+                return min(self.lower_bound(index + 1), self.max)
+        return self.max
+
+    def to_dict(self):
+        """Return the histogram in milliseconds."""
+        result = {
+            'count': self.count,
+            'mean': self.total / self.count * 1000 if self.count else None,
+            'min': self.min * 1000 if self.count else None,
+            'max': self.max * 1000 if self.count else None,
+            'buckets': [[self.lower_bound(index) * 1000,
+                         self.buckets[index]]
+                        for index in sorted(self.buckets,
+                                            key=self.lower_bound)],
+        }
+        for percent in PERCENTILES:
+            result['p%d' % percent] = (self.percentile(percent) * 1000
+                                       if self.count else None)
+        return result
+
+
+def record(name, seconds):
+    """Add a duration, in seconds, to the histogram of name."""
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram()
+    histogram.add(seconds)
+
+
+def start():
+    """Return a token to measure an interval with stop(), or None when
+    profiling is off.
+
+    """
+    return clock() if enabled else None
+
+
+def stop(name, token):
+    """Record the time since start() returned token."""
+    if token is not None:
+        record(name, clock() - token)
+
+
+def timed(name):
+    """Decorator that records the duration of every call as name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            begin = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, clock() - begin)
+        return wrapper
+    return decorator
+
+
+def report():
+    """Return the histograms and what the numbers depend on."""
+    versions = {'python': platform.python_version()}
+    try:
+        from gi.repository import Gst
+        versions['gstreamer'] = Gst.version_string()
+    except (ImportError, ValueError, AttributeError):
+        pass
+    try:
+        from gi.repository import Gtk
+        versions['gtk'] = '%d.%d.%d' % (Gtk.get_major_version(),
+                                        Gtk.get_minor_version(),
+                                        Gtk.get_micro_version())
+    except (ImportError, ValueError, AttributeError):
+        pass
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'uptime': clock() - started if started is not None else None,
+        'platform': platform.platform(),
+        'versions': versions,
+        'unit': 'ms',
+        'histograms': dict((name, histogram.to_dict())
+                           for name, histogram in histograms.items()),
+    }
+
+
+def dump(path=None):
+    """Write the report as JSON to path (default: the one given to
+    enable()).
+
+    """
+    path = path or output
+    data = json.dumps(report(), indent=2, sort_keys=True)
+    if path == '-':
+        print(data, file=sys.stderr)
+        return
+    with open(path, 'w') as f:
+        f.write(data)
+        f.write('\n')
+    print('Profile written to %s' % path, file=sys.stderr)
+
+
+def get_default_output():
+    from . import cache
+    return os.path.join(cache.cache_dir('profile'),
+                        'profile-%s-%d.json' %
+                        (time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+
+
+def on_signal(*args):
+    try:
+        dump()
+    except (IOError, OSError) as e:
+        print('Cannot write the profile: %s' % e, file=sys.stderr)
+    return True  # Keep the GLib source
+
+
+def enable(path=None):
+    """Start profiling.  The report is written to path ('-' for standard
+    error, default: a new file in the cache directory) on exit and every
+    time SIGUSR1 is received.
+
+    """
+    global enabled, started, output
+
+    enabled = True
+    started = clock()
+    output = path or get_default_output()
+    atexit.register(on_signal)
+
+    if hasattr(signal, 'SIGUSR1'):
+        # Through the main loop, where it is safe to read the histograms
+        from gi.repository import GLib
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1,
+                             on_signal)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Several recordings transcribed one after the other.
+
+A project is an ordered list of audio files, each one with its own
+transcription next to it.  To switch between them quickly, the players
+of the current, next and previous files are kept in a small pool,
+prerolled; the least recently used one is torn down when another is
+needed.  Only the current player outputs to the audio device, as some
+devices cannot be opened twice: the others are prerolled into a
+fakesink, and get the device when they become current, so switching
+files does not wait for the file to be opened and decoded.
+
+"""
+
+import collections
+
+from gi.repository import GLib
+
+from . import pipeline
+from .batch import find_files
+
+
+class Project(object):
+    """An ordered list of recordings.
+
+    Keyword arguments:
+    paths -- audio files and directories with audio files
+
+    """
+    def __init__(self, paths):
+        self.files = find_files(paths)
+        self.index = 0
+
+    def __len__(self):
+        return len(self.files)
+
+    def get_current(self):
+        return self.files[self.index] if self.files else None
+
+    def get_neighbours(self):
+        """Return the files after and before the current one."""
+        return [self.files[i] for i in (self.index + 1, self.index - 1)
+                if 0 <= i < len(self.files)]
+
+    def move(self, step):
+        """Make current the file step places away.  Return it, or None
+        if there is no such file.
+
+        """
+        index = self.index + step
+        if not 0 <= index < len(self.files):
+            return None
+        self.index = index
+        return self.files[index]
+
+
+class PipelinePool(object):
+    """Players of the recently used files, ready to play.
+
+    Keyword arguments:
+    size -- maximum number of players kept
+    setup -- function called with every new pipeline.Audio
+
+    """
+    SIZE = 3  # Current, next and previous
+
+    def __init__(self, size=SIZE, setup=None):
+        self.size = size
+        self.setup = setup
+        self.players = collections.OrderedDict()
+        self.prepare_id = None
+
+    def __contains__(self, filename):
+        return filename in self.players
+
+    def add(self, filename, audio):
+        """Put a player created elsewhere into the pool."""
+        self.players[filename] = audio
+        self.players.move_to_end(filename)
+        self.evict()
+
+    def get(self, filename):
+        """Return the player of filename, creating it if needed."""
+        audio = self.players.get(filename)
+        if audio is None:
+            audio = pipeline.Audio(filename)
+            if self.setup is not None:
+                self.setup(audio)
+            self.players[filename] = audio
+        self.players.move_to_end(filename)
+        self.evict()
+        return audio
+
+    def prepare(self, filenames):
+        """Create and preroll the players of filenames from the main
+        loop, after what is pending there, so the current file is not
+        slowed down.  The players other than the current one let go of
+        the audio device.
+
+        """
+        if self.prepare_id is not None:
+            GLib.source_remove(self.prepare_id)
+        self.prepare_id = GLib.idle_add(self.on_prepare, list(filenames),
+                                        priority=GLib.PRIORITY_LOW)
+
+    def on_prepare(self, filenames):
+        self.prepare_id = None
+        current = next(reversed(self.players), None)
+
+        for filename in filenames:
+            self.get(filename)
+        for filename, audio in self.players.items():
+            if filename != current:
+                audio.preroll(silent=True)
+
+        # Preparing must not make the current player the least recent
+        if current is not None:
+            self.players.move_to_end(current)
+        return False
+
+    def evict(self):
+        while len(self.players) > self.size:
+            filename, audio = self.players.popitem(last=False)
+            audio.close()
+
+    def clear(self):
+        if self.prepare_id is not None:
+            GLib.source_remove(self.prepare_id)
+            self.prepare_id = None
+        while self.players:
+            filename, audio = self.players.popitem()
+            audio.close()
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Audio files played from an HTTP(S) server as they download.
+
+The file is read in blocks of BLOCK_SIZE bytes with Range requests, and
+every block is kept in the user cache directory, so what was played
+once is not downloaded again; the blocks of all the files are kept
+under CACHE_SIZE bytes by removing the least recently used ones.  The
+blocks are fed to the playbin through an appsrc in random access mode,
+so the demuxer seeks in the file as it would in a local one.
+
+A background thread reads PREFETCH blocks ahead of the position, after
+every seek and as the playback goes on, and the connections to the
+server are kept alive between requests.  Missing blocks next to each
+other are fetched with a single request.
+
+A recording is identified by its URI: the files on the server are
+expected not to change.
+
+"""
+
+from __future__ import print_function
+
+import collections
+import functools
+import hashlib
+import http.client
+import os
+import re
+import socket
+import sys
+import threading
+import urllib.parse
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstApp', '1.0')
+from gi.repository import Gst, GstApp
+
+from . import cache
+
+BLOCK_SIZE = 256 * 1024
+PREFETCH = 8                        # Blocks read ahead of the position
+CACHE_SIZE = 1024 ** 3              # Bytes of blocks kept on disk
+TIMEOUT = 30                        # Seconds to wait for the server
+SCHEMES = ('http', 'https')
+
+URI = 'appsrc://'
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+def is_remote(filename):
+    """Return True if filename is the URI of a file on a server."""
+    return filename.split('://', 1)[0].lower() in SCHEMES
+
+
+class ConnectionPool(object):
+    """Connections to the servers, kept alive between requests.
+
+    Every request takes an idle connection to its server, or opens a new
+    one, and gives it back when the response has been read, so there is
+    one connection per thread requesting at the same time.
+
+    """
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.idle = collections.defaultdict(list)
+        self.lock = threading.Lock()
+        self.opened = 0     # Connections opened so far
+
+    def get(self, scheme, netloc):
+        with self.lock:
+            if self.idle[scheme, netloc]:
+                return self.idle[scheme, netloc].pop()
+            self.opened += 1
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def put(self, scheme, netloc, connection):
+        with self.lock:
+            self.idle[scheme, netloc].append(connection)
+
+    def clear(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
+
+    def request(self, uri, headers, method='GET', receive=None):
+        """Request uri.  Return the status, the response headers and the
+        body, or what receive returns.
+
+        Raise IOError if the server cannot be reached.
+
+        Keyword arguments:
+        receive -- function called with the status, the response headers
+                   and the response to read the body from, instead of
+                   reading all of it into memory
+
+        """
+        parts = urllib.parse.urlsplit(uri)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        for attempt in range(2):
+            connection = self.get(parts.scheme, parts.netloc)
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+            except (socket.error, http.client.HTTPException) as e:
+                connection.close()
+                if attempt:
+                    raise IOError('%s: %s' % (uri, e))
+                continue  # The server closed a kept alive connection
+
+            try:
+                if receive is None:
+                    data = response.read()
+                else:
+                    data = receive(response.status, response.msg, response)
+            except http.client.HTTPException as e:
+                connection.close()
+                raise IOError('%s: %s' % (uri, e))
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close or not response.isclosed():
+                connection.close()  # Or the body left would come next
+            else:
+                self.put(parts.scheme, parts.netloc, connection)
+            return response.status, response.msg, data
+
+
+# Shared by all the files, so a server gets the same connections
+POOL = ConnectionPool()
+
+
+def read_block(response):
+    """Return the next BLOCK_SIZE bytes of the body of response, fewer
+    at the end of it.
+
+    """
+    parts = []
+    missing = BLOCK_SIZE
+    while missing:
+        part = response.read(missing)
+        if not part:
+            break
+        parts.append(part)
+        missing -= len(part)
+    return b''.join(parts)
+
+
+class RemoteFile(object):
+    """A file on a server, read through the block cache.
+
+    Keyword arguments:
+    uri -- http(s) URI of the file
+    limit -- bytes of blocks to keep on disk
+    pool -- the ConnectionPool to use
+
+    """
+    def __init__(self, uri, limit=CACHE_SIZE, pool=POOL):
+        self.uri = uri
+        self.limit = limit
+        self.pool = pool
+        self.key = hashlib.sha1(uri.encode('utf-8')).hexdigest()
+        self.directory = cache.cache_dir('http')
+        self.size = None
+        self.requests = 0   # Made so far, for the benchmarks
+
+        # The block to prefetch from, and the thread doing it
+        self.condition = threading.Condition()
+        self.prefetch_from = None
+        self.closed = False
+        self.thread = None
+
+    def get_block_path(self, index):
+        return os.path.join(self.directory, '%s-%08d' % (self.key, index))
+
+    def get_size_path(self):
+        return os.path.join(self.directory, '%s.size' % self.key)
+
+    def get_cached_size(self):
+        """Return the size of the file if it is known without asking the
+        server, or None.
+
+        """
+        if self.size is None:
+            try:
+                with open(self.get_size_path()) as f:
+                    self.size = int(f.read())
+            except (IOError, OSError, ValueError):
+                pass
+        return self.size
+
+    def get_size(self):
+        """Return the size of the file, asking the server if it is not
+        known yet.  This blocks.
+
+        """
+        if self.get_cached_size() is None:
+            self.fetch(0, 1)
+            if self.size is None:
+                self.set_size(self.request_size())
+        return self.size
+
+    def set_size(self, size):
+        self.size = size
+        cache.replace(self.get_size_path(),
+                      lambda f: f.write(str(size).encode('ascii')))
+
+    def request_size(self):
+        """Ask the server the size of the file, for when a range did not
+        tell it.  Raise IOError if it does not say.
+
+        """
+        self.requests += 1
+        status, headers, data = self.pool.request(self.uri, {}, 'HEAD')
+        length = headers.get('Content-Length', '')
+        if status != 200 or not length.isdigit():
+            raise IOError('%s: unknown size' % self.uri)
+        return int(length)
+
+    def has_block(self, index):
+        return os.path.exists(self.get_block_path(index))
+
+    def fetch(self, first, last):
+        """Download the blocks [first, last) into the cache, or all of
+        them if the server sends the whole file.
+
+        """
+        start = first * BLOCK_SIZE
+        end = last * BLOCK_SIZE - 1
+        if self.size is not None:
+            end = min(end, self.size - 1)
+        self.requests += 1
+        self.pool.request(self.uri, {'Range': 'bytes=%d-%d' % (start, end)},
+                          receive=functools.partial(self.receive, first))
+
+        wanted = [self.get_block_path(index) for index in range(first, last)]
+        cache.evict('http', self.limit, keep=wanted)
+
+    def receive(self, first, status, headers, response):
+        """Write the body of the response to a fetch from block first
+        into the cache, block by block as it comes.
+
+        """
+        size = None
+        if status == 206:
+            match = CONTENT_RANGE.match(headers.get('Content-Range', ''))
+            if match is None or int(match.group(1)) != first * BLOCK_SIZE:
+                raise IOError('%s: unexpected range %s' %
+                              (self.uri, headers.get('Content-Range')))
+            if match.group(3) != '*':
+                size = int(match.group(3))
+        elif status == 200:
+            # The server does not do ranges: it sends the whole file, keep
+            # all of it rather than download it again for the next blocks
+            length = headers.get('Content-Length', '')
+            if length.isdigit():
+                size = int(length)
+            first = 0
+        else:
+            raise IOError('%s: HTTP status %d' % (self.uri, status))
+
+        if self.size is None and size is not None:
+            self.set_size(size)
+
+        index = first
+        received = 0
+        while True:
+            block = read_block(response)
+            if not block:
+                break
+            if len(block) < BLOCK_SIZE and self.size is not None and \
+                    index * BLOCK_SIZE + len(block) != self.size:
+                break  # Cut short, it is not the end of the file
+            cache.replace(self.get_block_path(index),
+                          lambda f: f.write(block))
+            index += 1
+            received += len(block)
+
+        if self.size is None and status == 200:
+            self.set_size(received)
+
+    def read(self, offset, length):
+        """Return up to length bytes from offset on, downloading the
+        blocks that are not in the cache.  This blocks.
+
+        """
+        size = self.get_size()
+        end = min(offset + length, size)
+        if offset >= end:
+            return b''
+
+        first = offset // BLOCK_SIZE
+        last = (end - 1) // BLOCK_SIZE + 1
+        blocks = []
+        index = first
+        while index < last:
+            path = self.get_block_path(index)
+            try:
+                with open(path, 'rb') as f:
+                    blocks.append(f.read())
+                cache.touch(path)
+                index += 1
+                continue
+            except (IOError, OSError):
+                pass
+            # A run of missing blocks, in one request
+            missing = index + 1
+            while missing < last and not self.has_block(missing):
+                missing += 1
+            self.fetch(index, missing)
+            if not self.has_block(index):
+                raise IOError('%s: block %d not received' % (self.uri, index))
+
+        data = b''.join(blocks)
+        skip = offset - first * BLOCK_SIZE
+        return data[skip:skip + end - offset]
+
+    def prefetch(self, offset):
+        """Download in background the blocks after offset."""
+        with self.condition:
+            self.prefetch_from = offset // BLOCK_SIZE
+            self.condition.notify()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run_prefetch)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run_prefetch(self):
+        while True:
+            with self.condition:
+                while self.prefetch_from is None and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                first = self.prefetch_from
+                self.prefetch_from = None
+
+            try:
+                size = self.get_size()
+                last = min(first + PREFETCH,
+                           (size + BLOCK_SIZE - 1) // BLOCK_SIZE)
+                index = first
+                while index < last and self.prefetch_from is None:
+                    if self.has_block(index):
+                        index += 1
+                        continue
+                    missing = index + 1
+                    while missing < last and not self.has_block(missing):
+                        missing += 1
+                    self.fetch(index, missing)
+                    index = missing
+            except (IOError, OSError) as e:
+                print('Cannot prefetch %s: %s' % (self.uri, e),
+                      file=sys.stderr)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+class RemoteSource(object):
+    """Feed a RemoteFile to an appsrc, in random access mode.
+
+    Keyword arguments:
+    remote -- the RemoteFile to play
+    appsrc -- the source element created by the playbin for URI
+
+    """
+    def __init__(self, remote, appsrc):
+        self.remote = remote
+        self.offset = 0
+
+        appsrc.set_property('format', Gst.Format.BYTES)
+        appsrc.set_stream_type(GstApp.AppStreamType.RANDOM_ACCESS)
+
+        # This can run in the main thread: the server is not asked here,
+        # but on the first need-data
+        self.has_size = remote.get_cached_size() is not None
+        if self.has_size:
+            appsrc.set_size(remote.size)
+        appsrc.connect('need-data', self.on_need_data)
+        appsrc.connect('seek-data', self.on_seek_data)
+
+    def on_need_data(self, appsrc, length):
+        """Push the next bytes (streaming thread)."""
+        if not self.has_size:
+            try:
+                appsrc.set_size(self.remote.get_size())
+            except (IOError, OSError) as e:
+                print('Cannot open %s: %s' % (self.remote.uri, e),
+                      file=sys.stderr)
+                appsrc.end_of_stream()
+                return
+            self.has_size = True
+
+        if self.offset >= self.remote.size:
+            appsrc.end_of_stream()
+            return
+
+        block = self.offset // BLOCK_SIZE
+        try:
+            data = self.remote.read(self.offset,
+                                    length if length > 0 else BLOCK_SIZE)
+        except (IOError, OSError) as e:
+            print('Cannot read %s: %s' % (self.remote.uri, e),
+                  file=sys.stderr)
+            appsrc.end_of_stream()
+            return
+
+        buf = Gst.Buffer.new_wrapped(data)
+        buf.offset = self.offset
+        self.offset += len(data)
+        if self.offset // BLOCK_SIZE != block:
+            # Keep PREFETCH blocks ahead of the playback
+            self.remote.prefetch(self.offset)
+        appsrc.push_buffer(buf)
+
+    def on_seek_data(self, appsrc, offset):
+        if offset // BLOCK_SIZE != self.offset // BLOCK_SIZE:
+            self.remote.prefetch(offset)
+        self.offset = offset
+        return True
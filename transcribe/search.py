@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Full-text search over many transcriptions.
+
+The words of the transcriptions are kept in an inverted index, a SQLite
+database in the user cache directory.  Every occurrence of a word is a
+posting: the transcription, the offset of the word and the time of the
+audio mark before it, so a hit can be opened with the audio already at
+the right place.  The postings are clustered by word, so a query reads
+only the postings of its words.  The lines of the transcriptions are kept
+too, so the snippets of the hits do not need to read the files, which
+may have changed since they were indexed.
+
+A transcription is indexed again only when its size or modification
+time change.  The transcriptions indexed are those next to the audio
+files given, like in the batch mode.
+
+A query is a list of words that must all be in the same segment (the
+text after an audio mark, up to the next one); a word ending in '*'
+matches every word starting with it.
+
+"""
+
+from __future__ import print_function
+
+import collections
+import os
+import re
+import sqlite3
+import sys
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GObject
+
+from . import cache
+from . import jobs
+from . import timecode
+from .batch import find_files
+from .loader import transcription_for, decode
+
+QUERY_RE = re.compile(r'(\w+)(\*?)', re.UNICODE)
+MIN_LENGTH = 2      # Shorter words are not indexed
+NO_MARK = -1.0      # Time of the words before the first audio mark
+BATCH = 500         # Parameters per SQL statement
+SCHEMA_VERSION = 1  # Older indexes are built again
+
+# An audio mark, which is not indexed, or a word; in a single pass
+TOKEN_RE = re.compile(r'%s|(\w{%d,})' % (timecode.SCANNER.pattern,
+                                          MIN_LENGTH), re.UNICODE)
+WORD_GROUP = timecode.SCANNER.groups + 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    audio TEXT,
+    size INTEGER,
+    mtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    term TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term INTEGER NOT NULL,
+    file INTEGER NOT NULL,
+    time REAL NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (term, file, time, offset)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_file ON postings (file);
+CREATE TABLE IF NOT EXISTS lines (
+    file INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (file, start)
+) WITHOUT ROWID;
+'''
+
+Hit = collections.namedtuple('Hit',
+                             'transcription audio offset position snippet')
+
+
+def get_index_path():
+    return os.path.join(cache.cache_dir('search'), 'index.sqlite')
+
+
+def tokenize(text):
+    """Yield (offset, word, time) for the words of a transcription, where
+    time is the one of the audio mark before the word.
+
+    """
+    position = NO_MARK
+    for match in TOKEN_RE.finditer(text):
+        word = match.group(WORD_GROUP)
+        if word is None:
+            seconds = timecode.to_seconds(match)
+            if seconds is not None:
+                position = seconds
+        else:
+            yield match.start(), word.lower(), position
+
+
+def split_lines(text):
+    """Yield (offset, line) for the lines of text that are not blank."""
+    start = 0
+    for line in text.split('\n'):
+        if line.strip():
+            yield start, line
+        start += len(line) + 1
+
+
+def snippet(text, offset, width=60):
+    """Return the line of text around offset, shortened to about width
+    characters.
+
+    """
+    start = text.rfind('\n', 0, offset) + 1
+    end = text.find('\n', offset)
+    if end < 0:
+        end = len(text)
+    start = max(start, offset - width // 2)
+    end = min(end, start + width)
+    return text[start:end].strip()
+
+
+class SearchIndex(object):
+    """The inverted index of the transcriptions.
+
+    A SearchIndex must be used from the thread that created it.
+
+    Keyword arguments:
+    path -- database file (default: in the user cache directory)
+
+    """
+    def __init__(self, path=None):
+        self.path = path or get_index_path()
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        self.terms = {}
+
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            with self.db:
+                self.db.execute('DELETE FROM postings')
+                self.db.execute('DELETE FROM lines')
+                self.db.execute('DELETE FROM files')
+                self.db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, paths):
+        """Index the transcriptions of the audio files in paths that
+        changed since they were indexed.  Return how many were indexed.
+
+        """
+        count = 0
+        for filename in find_files(paths):
+            fname = transcription_for(filename)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+
+            row = self.db.execute('SELECT id, size, mtime FROM files '
+                                  'WHERE path = ?', (fname,)).fetchone()
+            mtime = int(st.st_mtime * 1e9)
+            if row is not None and row[1:] == (st.st_size, mtime):
+                continue
+
+            with open(fname, 'rb') as f:
+                text = decode(f.read())
+            with self.db:
+                self.index(fname, filename, text, st.st_size, mtime)
+            count += 1
+
+        with self.db:
+            self.forget_missing()
+        return count
+
+    def index(self, fname, audio, text, size, mtime):
+        """(Re)index the text of a transcription.  Call in a transaction."""
+        row = self.db.execute('SELECT id FROM files WHERE path = ?',
+                              (fname,)).fetchone()
+        if row is not None:
+            file_id = row[0]
+            self.db.execute('DELETE FROM postings WHERE file = ?', (file_id,))
+            self.db.execute('DELETE FROM lines WHERE file = ?', (file_id,))
+            self.db.execute('UPDATE files SET audio = ?, size = ?, mtime = ? '
+                            'WHERE id = ?', (audio, size, mtime, file_id))
+        else:
+            file_id = self.db.execute(
+                'INSERT INTO files (path, audio, size, mtime) '
+                'VALUES (?, ?, ?, ?)', (fname, audio, size, mtime)).lastrowid
+
+        postings = list(tokenize(text))
+        ids = self.get_term_ids(set(word for offset, word, time in postings))
+        # In the order of the primary key, the inserts append to a few
+        # pages of the postings instead of touching one per word
+        rows = sorted((ids[word], file_id, time, offset)
+                      for offset, word, time in postings)
+        self.db.executemany(
+            'INSERT OR IGNORE INTO postings (term, file, time, offset) '
+            'VALUES (?, ?, ?, ?)', rows)
+        self.db.executemany(
+            'INSERT INTO lines (file, start, text) VALUES (?, ?, ?)',
+            ((file_id, start, line) for start, line in split_lines(text)))
+
+    def get_term_ids(self, words):
+        """Return a dictionary with the id of every word, adding the new
+        words to the index.
+
+        """
+        missing = [word for word in words if word not in self.terms]
+        for i in range(0, len(missing), BATCH):
+            chunk = missing[i:i + BATCH]
+            self.db.executemany('INSERT OR IGNORE INTO terms (term) '
+                                'VALUES (?)', ((word,) for word in chunk))
+            rows = self.db.execute('SELECT term, id FROM terms WHERE term IN '
+                                   '(%s)' % ','.join('?' * len(chunk)), chunk)
+            self.terms.update(rows)
+        return dict((word, self.terms[word]) for word in words)
+
+    def forget_missing(self):
+        """Remove the transcriptions that do not exist any more."""
+        rows = self.db.execute('SELECT id, path FROM files').fetchall()
+        for file_id, path in rows:
+            if not os.path.exists(path):
+                self.db.execute('DELETE FROM postings WHERE file = ?',
+                                (file_id,))
+                self.db.execute('DELETE FROM lines WHERE file = ?',
+                                (file_id,))
+                self.db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+    def lookup(self, word, prefix):
+        """Return the ids of the terms matching a word of a query."""
+        if prefix:
+            rows = self.db.execute('SELECT id FROM terms WHERE term >= ? AND '
+                                   'term < ?', (word, word + u'\U0010ffff'))
+        else:
+            rows = self.db.execute('SELECT id FROM terms WHERE term = ?',
+                                   (word,))
+        return [row[0] for row in rows]
+
+    def get_snippet(self, file_id, offset):
+        """Return the snippet of the line of a transcription at offset, as
+        it was indexed.
+
+        """
+        row = self.db.execute('SELECT start, text FROM lines WHERE file = ? '
+                              'AND start <= ? ORDER BY start DESC LIMIT 1',
+                              (file_id, offset)).fetchone()
+        if row is None:
+            return ''
+        start, text = row
+        return snippet(text, offset - start)
+
+    def search(self, query, limit=100):
+        """Return the hits of query, at most limit of them, as a list of
+        Hit(transcription, audio, offset, position, snippet) where
+        position is None when there is no audio mark before the hit.
+
+        """
+        words = [(word.lower(), bool(star))
+                 for word, star in QUERY_RE.findall(query)]
+        if not words:
+            return []
+
+        # Drive the query with the word most likely to be rare: the
+        # longest one that is not a prefix
+        words.sort(key=lambda word: (word[1], -len(word[0])))
+        terms = [self.lookup(word, prefix) for word, prefix in words]
+        if not all(terms):
+            return []
+
+        sql = ['SELECT f.path, f.audio, p.file, p.offset, p.time '
+               'FROM postings p JOIN files f ON f.id = p.file '
+               'WHERE p.term IN (%s)' % ','.join('?' * len(terms[0]))]
+        params = list(terms[0])
+        for ids in terms[1:]:
+            sql.append('AND EXISTS (SELECT 1 FROM postings q '
+                       'WHERE q.term IN (%s) AND q.file = p.file AND '
+                       'q.time = p.time)' % ','.join('?' * len(ids)))
+            params.extend(ids)
+        sql.append('LIMIT ?')
+        params.append(limit)
+
+        return [Hit(path, audio, offset, None if time == NO_MARK else time,
+                    self.get_snippet(file_id, offset))
+                for path, audio, file_id, offset, time in
+                self.db.execute(' '.join(sql), params).fetchall()]
+
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='transcribe --search',
+        description='Search the transcriptions of audio files.')
+    parser.add_argument('query', nargs='+', help='words to look for')
+    parser.add_argument('-u', '--update', action='append', default=[],
+                        metavar='PATH',
+                        help='index the transcriptions of the audio files '
+                             'in PATH first, if they changed')
+    parser.add_argument('-n', '--limit', type=int, default=20,
+                        help='maximum number of hits (default: %(default)s)')
+    parser.add_argument('--open', type=int, metavar='N',
+                        help='open the N-th hit, with the audio at its mark')
+    args = parser.parse_args(argv)
+
+    index = SearchIndex()
+    if args.update:
+        count = index.update(args.update)
+        print('%d transcriptions indexed' % count, file=sys.stderr)
+
+    hits = index.search(' '.join(args.query), args.limit)
+    index.close()
+
+    for number, hit in enumerate(hits, 1):
+        time = (timecode.format(hit.position) if hit.position is not None
+                else '-')
+        print('%d. %s %s %s' % (number, hit.transcription, time,
+                                hit.snippet))
+
+    if args.open is None:
+        return 0 if hits else 1
+    if not 0 < args.open <= len(hits) or hits[args.open - 1].audio is None:
+        print('No audio for hit %d' % args.open, file=sys.stderr)
+        return 1
+
+    from . import transcribe
+    hit = hits[args.open - 1]
+    ui = transcribe.Transcribe(hit.audio)
+    ui.jump_to(hit.transcription, hit.offset, hit.position)
+    ui.main()
+    return 0
+
+
+class SearchWindow(Gtk.Window):
+    """Search the transcriptions of a set of audio files.
+
+    The index is updated in background when the window is shown; the
+    queries run as they are typed.  'hit-activated' is emitted with the
+    Hit chosen.
+
+    Keyword arguments:
+    paths -- audio files and directories whose transcriptions to search
+    parent -- window the search window belongs to
+
+    """
+    __gsignals__ = {
+        'hit-activated': (GObject.SIGNAL_RUN_FIRST, None, (object,))
+    }
+
+    LIMIT = 200
+
+    def __init__(self, paths, parent=None):
+        Gtk.Window.__init__(self, title='Search transcriptions')
+        self.set_transient_for(parent)
+        self.set_default_size(600, 400)
+        self.set_destroy_with_parent(True)
+        self.connect('delete-event', self.on_delete_event)
+
+        self.paths = paths
+        self.index = SearchIndex()
+        self.job = None
+
+        self.entry = Gtk.SearchEntry()
+        self.entry.connect('search-changed', self.on_search_changed)
+
+        self.store = Gtk.ListStore(str, str, str, object)
+        view = Gtk.TreeView(model=self.store)
+        for column, title in enumerate(('File', 'Time', 'Text')):
+            renderer = Gtk.CellRendererText()
+            view.append_column(Gtk.TreeViewColumn(title, renderer,
+                                                  text=column))
+        view.connect('row-activated', self.on_row_activated)
+
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_shadow_type(Gtk.ShadowType.IN)
+        scrolled.add(view)
+
+        self.status = Gtk.Label(xalign=0)
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        box.set_border_width(6)
+        box.pack_start(self.entry, False, True, 0)
+        box.pack_start(scrolled, True, True, 0)
+        box.pack_start(self.status, False, True, 0)
+        self.add(box)
+
+    def present(self):
+        self.show_all()
+        Gtk.Window.present(self)
+        self.entry.grab_focus()
+        self.update_index()
+
+    def update_index(self):
+        """Index what changed, in background with its own connection."""
+        if self.job is not None:
+            return
+        self.status.set_text('Indexing...')
+        self.job = jobs.SCHEDULER.submit(jobs.THREAD, self.run_update,
+                                         key=('index', self.index.path))
+        self.job.connect('finished', self.on_update_finished)
+
+    def run_update(self, job):
+        index = SearchIndex(self.index.path)
+        try:
+            return index.update(self.paths)
+        except (IOError, OSError, sqlite3.Error) as e:
+            print('Cannot index the transcriptions: %s' % e, file=sys.stderr)
+            return 0
+        finally:
+            index.close()
+
+    def on_update_finished(self, job, count):
+        self.job = None
+        self.status.set_text('%d transcriptions indexed' % count)
+        self.on_search_changed(self.entry)
+
+    def on_search_changed(self, entry):
+        self.store.clear()
+        query = entry.get_text()
+        if not query.strip():
+            return
+
+        hits = self.index.search(query, self.LIMIT)
+        for hit in hits:
+            time = (timecode.format(hit.position)
+                    if hit.position is not None else '')
+            self.store.append([os.path.basename(hit.transcription), time,
+                               hit.snippet, hit])
+
+        if len(hits) == self.LIMIT:
+            self.status.set_text('First %d hits' % len(hits))
+        else:
+            self.status.set_text('%d hits' % len(hits))
+
+    def on_row_activated(self, view, path, column):
+        self.emit('hit-activated', self.store[path][3])
+
+    def on_delete_event(self, *args):
+        self.hide()
+        return True
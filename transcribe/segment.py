@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Find where utterances start, from the silences in the audio.
+
+The audio is decoded as a stream of blocks and cut in short frames.  A
+frame is speech when it is loud enough, or when it is a bit quieter but
+has a high zero-crossing rate (fricatives like 's' or 'f' are weak but
+noisy).  An utterance starts with enough speech after a long enough
+silence.  Only the state of the current run of frames is kept between
+blocks, so files of any length are processed in constant memory.
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+from gi.repository import GObject
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import jobs
+from . import pipeline
+from . import timecode
+
+RATE = 8000             # Sample rate used for the analysis
+FRAME = 160             # Samples per frame (20 ms)
+THRESHOLD = -35.0       # dBFS above which a frame is speech
+ZCR_MARGIN = 10.0       # dB below THRESHOLD for noisy frames to be speech
+ZCR_SPEECH = 0.25       # Zero-crossing rate of noisy (fricative) frames
+MIN_SILENCE = 0.5       # Seconds of silence between utterances
+MIN_SPEECH = 0.25       # Seconds of speech to be an utterance
+PADDING = 0.1           # Seconds to place the mark before the utterance
+
+
+class Segmenter(object):
+    """Find the start of utterances in a stream of mono float32 blocks.
+
+    Keyword arguments:
+    threshold -- level in dBFS above which a frame is speech
+    min_silence -- seconds of silence that separate two utterances
+    min_speech -- seconds of speech needed to start an utterance
+    rate -- sample rate of the blocks
+
+    """
+    def __init__(self, threshold=THRESHOLD, min_silence=MIN_SILENCE,
+                 min_speech=MIN_SPEECH, rate=RATE):
+        self.threshold = threshold
+        self.frame_duration = float(FRAME) / rate
+        self.min_silence = int(round(min_silence / self.frame_duration))
+        self.min_speech = int(round(min_speech / self.frame_duration))
+
+        self.rest = numpy.zeros(0, dtype=numpy.float32)
+        self.frames = 0             # Frames processed so far
+        self.quiet = True           # Enough silence since last utterance
+        self.silence = 0            # Frames in the current silence
+        self.speech_start = None    # First frame of the current speech
+        self.speech = 0             # Frames of speech since speech_start
+
+    def classify(self, frames):
+        """Return a boolean array telling which frames are speech."""
+        energy = (frames * frames).mean(axis=1)
+        level = 10 * numpy.log10(energy + 1e-10)
+        crossings = numpy.count_nonzero(numpy.diff(numpy.signbit(frames),
+                                                   axis=1), axis=1)
+        zcr = crossings / float(FRAME)
+        return ((level > self.threshold) |
+                ((level > self.threshold - ZCR_MARGIN) & (zcr > ZCR_SPEECH)))
+
+    def feed(self, data):
+        """Process a block of samples.  Return the start times, in
+        seconds, of the utterances found in it.
+
+        """
+        samples = numpy.frombuffer(data, dtype=numpy.float32)
+        if len(self.rest):
+            samples = numpy.concatenate((self.rest, samples))
+        full = len(samples) // FRAME * FRAME
+        self.rest = samples[full:]
+        if not full:
+            return []
+
+        speech = self.classify(samples[:full].reshape(-1, FRAME))
+
+        # Walk the runs of speech/silence instead of every frame
+        changes = numpy.flatnonzero(numpy.diff(speech)) + 1
+        bounds = [0] + changes.tolist() + [len(speech)]
+        starts = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            start_time = self.advance(bool(speech[start]),
+                                      self.frames + start, end - start)
+            if start_time is not None:
+                starts.append(start_time)
+
+        self.frames += len(speech)
+        return starts
+
+    def advance(self, is_speech, frame, count):
+        """Process count frames of speech or silence starting at frame.
+        Return the start time of the utterance that begins there, if any.
+
+        """
+        if not is_speech:
+            self.silence += count
+            if self.silence >= self.min_silence:
+                self.quiet = True
+                self.speech_start = None
+                self.speech = 0
+            return None
+
+        self.silence = 0
+        if self.speech_start is None:
+            self.speech_start = frame
+        self.speech += count
+
+        if self.quiet and self.speech >= self.min_speech:
+            self.quiet = False
+            return max(0.0, self.speech_start * self.frame_duration - PADDING)
+        return None
+
+
+def find_utterances(filename, threshold=THRESHOLD, min_silence=MIN_SILENCE,
+                    min_speech=MIN_SPEECH):
+    """Yield the start time, in seconds, of each utterance in filename."""
+    segmenter = Segmenter(threshold, min_silence, min_speech)
+    decoder = pipeline.Decoder(filename, RATE)
+    for data in decoder.blocks():
+        for start in segmenter.feed(data):
+            yield start
+
+
+def find_utterances_job(job, filename, threshold):
+    return list(find_utterances(filename, threshold))
+
+
+class SegmentAnalyzer(GObject.GObject):
+    """Find the utterances of an audio file in a worker process.
+
+    'finished' is emitted in the main loop with the list of start times.
+
+    """
+    __gsignals__ = {
+        'finished': (GObject.SIGNAL_RUN_FIRST, None, (object,))
+    }
+
+    def __init__(self, filename, threshold=THRESHOLD):
+        GObject.GObject.__init__(self)
+        self.filename = filename
+        self.threshold = threshold
+        self.job = None
+
+    def start(self):
+        self.job = jobs.SCHEDULER.submit(
+            jobs.PROCESS, find_utterances_job,
+            (self.filename, self.threshold),
+            key=('utterances', self.filename, self.threshold),
+            priority=jobs.PRIORITY_HIGH)
+        self.job.connect('finished', self.on_job_finished)
+        self.job.connect('failed', self.on_job_failed)
+
+    def is_running(self):
+        return self.job is not None and not self.job.is_done()
+
+    def on_job_finished(self, job, starts):
+        self.emit('finished', starts)
+
+    def on_job_failed(self, job, error):
+        print('Cannot analyze %s: %s' % (self.filename, error),
+              file=sys.stderr)
+        self.emit('finished', [])
+
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Print the start time of the utterances of an audio file')
+    parser.add_argument('filename')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='level in dBFS above which audio is speech '
+                             '(default: %(default)s)')
+    parser.add_argument('--min-silence', type=float, default=MIN_SILENCE,
+                        help='seconds of silence between utterances '
+                             '(default: %(default)s)')
+    parser.add_argument('--min-speech', type=float, default=MIN_SPEECH,
+                        help='seconds of speech to be an utterance '
+                             '(default: %(default)s)')
+    parser.add_argument('--marks', action='store_true',
+                        help='print audio marks, #h:mm:ss.mmm#, instead '
+                             'of seconds')
+    args = parser.parse_args(argv)
+
+    for start in find_utterances(args.filename, args.threshold,
+                                 args.min_silence, args.min_speech):
+        if args.marks:
+            print(timecode.format_mark(start, timecode.MILLISECONDS))
+        else:
+            print('%.3f' % start)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,598 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Transcriptions of a project kept in a SQLite database.
+
+Instead of a text file next to every recording, the transcriptions can
+be kept in a single database with a table of recordings, one of
+paragraphs (the lines of a transcription) and one of the audio marks in
+them, indexed by time.  Finding the marks between two times across the
+whole project is an index range scan, and opening a transcription reads
+the paragraphs of its recording only.
+
+Paragraphs are ordered by a sequence number with gaps between them, so
+a paragraph inserted between two others gets a number in the gap and
+the rest are left alone.  The edits made in the window are written as
+a transaction with the paragraphs they touched, in WAL mode, a short
+while after they happen: saving costs as much as the edit, whatever the
+size of the project.
+
+Transcriptions are imported from and exported to the usual text files.
+
+"""
+
+from __future__ import print_function
+
+import bisect
+import collections
+import io
+import itertools
+import os
+import sqlite3
+import sys
+
+from gi.repository import GLib
+
+from . import timecode
+from .batch import find_files
+from .loader import TranscriptionLoader, transcription_for, decode
+
+GAP = 1 << 16       # Between the sequence numbers of paragraphs
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS paragraphs (
+    id INTEGER PRIMARY KEY,
+    recording INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS paragraphs_recording
+    ON paragraphs (recording, seq);
+CREATE TABLE IF NOT EXISTS marks (
+    paragraph INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    time REAL NOT NULL,
+    recording INTEGER NOT NULL,
+    PRIMARY KEY (paragraph, offset)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS marks_time ON marks (time);
+CREATE INDEX IF NOT EXISTS marks_recording ON marks (recording, time);
+'''
+
+StoredMark = collections.namedtuple('StoredMark', 'audio position text')
+
+
+def scan_marks(text):
+    """Return the (offset, position) of the audio marks of a paragraph."""
+    return [(offset, position)
+            for offset, position, length in timecode.scan(text)[0]]
+
+
+class ProjectStore(object):
+    """A project database.
+
+    A ProjectStore must be used from the thread that created it.
+
+    Keyword arguments:
+    path -- database file, created if it does not exist
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def get_recording(self, audio):
+        """Return the id of the recording of an audio file, adding it."""
+        audio = os.path.realpath(audio)
+        row = self.db.execute('SELECT id FROM recordings WHERE path = ?',
+                              (audio,)).fetchone()
+        if row is not None:
+            return row[0]
+        with self.db:
+            return self.db.execute('INSERT INTO recordings (path) '
+                                   'VALUES (?)', (audio,)).lastrowid
+
+    def get_recordings(self):
+        """Return the audio files of the project."""
+        return [row[0] for row in
+                self.db.execute('SELECT path FROM recordings ORDER BY path')]
+
+    def get_paragraphs(self, recording):
+        """Return the (id, seq, text) of the paragraphs of a recording, in
+        order.
+
+        """
+        return self.db.execute('SELECT id, seq, text FROM paragraphs '
+                               'WHERE recording = ? ORDER BY seq',
+                               (recording,)).fetchall()
+
+    def get_text(self, recording):
+        """Return the transcription of a recording, or None if it has
+        none.
+
+        """
+        paragraphs = self.get_paragraphs(recording)
+        if not paragraphs:
+            return None
+        return '\n'.join(text for id, seq, text in paragraphs)
+
+    def set_text(self, recording, text):
+        """Replace the transcription of a recording.  Call in a
+        transaction.
+
+        """
+        self.db.execute('DELETE FROM marks WHERE recording = ?', (recording,))
+        self.db.execute('DELETE FROM paragraphs WHERE recording = ?',
+                        (recording,))
+        lines = text.split('\n')
+        self.db.executemany(
+            'INSERT INTO paragraphs (recording, seq, text) VALUES (?, ?, ?)',
+            [(recording, number * GAP, line)
+             for number, line in enumerate(lines, 1)])
+        ids = [row[0] for row in self.get_paragraphs(recording)]
+
+        # The marks of the whole text in one pass
+        starts = [0]
+        for line in lines:
+            starts.append(starts[-1] + len(line) + 1)
+        rows = []
+        for offset, position, length in timecode.scan(text)[0]:
+            index = bisect.bisect_right(starts, offset) - 1
+            rows.append((ids[index], offset - starts[index], position,
+                         recording))
+        self.db.executemany(
+            'INSERT OR IGNORE INTO marks (paragraph, offset, time, recording) '
+            'VALUES (?, ?, ?, ?)', rows)
+
+    def insert_paragraph(self, recording, seq, text):
+        """Add a paragraph and its marks.  Return its id."""
+        paragraph = self.db.execute(
+            'INSERT INTO paragraphs (recording, seq, text) VALUES (?, ?, ?)',
+            (recording, seq, text)).lastrowid
+        self.insert_marks(recording, paragraph, text)
+        return paragraph
+
+    def update_paragraph(self, recording, paragraph, text):
+        self.db.execute('UPDATE paragraphs SET text = ? WHERE id = ?',
+                        (text, paragraph))
+        self.db.execute('DELETE FROM marks WHERE paragraph = ?',
+                        (paragraph,))
+        self.insert_marks(recording, paragraph, text)
+
+    def insert_marks(self, recording, paragraph, text):
+        self.db.executemany(
+            'INSERT OR IGNORE INTO marks (paragraph, offset, time, recording) '
+            'VALUES (?, ?, ?, ?)',
+            [(paragraph, offset, position, recording)
+             for offset, position in scan_marks(text)])
+
+    def delete_paragraphs(self, paragraphs):
+        rows = [(paragraph,) for paragraph in paragraphs]
+        self.db.executemany('DELETE FROM marks WHERE paragraph = ?', rows)
+        self.db.executemany('DELETE FROM paragraphs WHERE id = ?', rows)
+
+    def renumber(self, entries):
+        """Give the paragraphs of entries, in order, evenly spaced
+        sequence numbers.
+
+        """
+        for number, entry in enumerate(entries, 1):
+            entry.seq = number * GAP
+        self.db.executemany('UPDATE paragraphs SET seq = ? WHERE id = ?',
+                            [(entry.seq, entry.id) for entry in entries
+                             if entry.id is not None])
+
+    def marks_between(self, start, end, limit=None):
+        """Return the audio marks of the project with start <= position
+        <= end, sorted by time, as a list of StoredMark(audio, position,
+        text) where text is the paragraph of the mark.
+
+        """
+        sql = ('SELECT r.path, m.time, p.text FROM marks m '
+               'JOIN paragraphs p ON p.id = m.paragraph '
+               'JOIN recordings r ON r.id = m.recording '
+               'WHERE m.time BETWEEN ? AND ? ORDER BY m.time')
+        params = [start, end]
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [StoredMark(*row) for row in self.db.execute(sql, params)]
+
+    def import_file(self, audio, fname=None):
+        """Replace the transcription of audio with the text file fname
+        (default: the one next to audio).
+
+        """
+        fname = fname or transcription_for(audio)
+        with open(fname, 'rb') as f:
+            text = decode(f.read())
+        recording = self.get_recording(audio)
+        with self.db:
+            self.set_text(recording, text)
+
+    def export_file(self, audio, fname=None):
+        """Write the transcription of audio into the text file fname
+        (default: the one next to audio).  Return False if it has none.
+
+        """
+        text = self.get_text(self.get_recording(audio))
+        if text is None:
+            return False
+        GLib.file_set_contents(fname or transcription_for(audio),
+                               text.encode('utf-8'))
+        return True
+
+
+class StoreLoader(TranscriptionLoader):
+    """Load the transcription of a recording from a ProjectStore.
+
+    Keyword arguments:
+    buffer -- text buffer to load into
+    marks -- MarkIndex of buffer
+    store -- the ProjectStore
+    audio -- the audio file of the recording
+
+    """
+    def __init__(self, buffer, marks, store, audio):
+        TranscriptionLoader.__init__(self, buffer, marks,
+                                     transcription_for(audio))
+        self.store = store
+        self.audio = audio
+
+    def open(self):
+        recording = self.store.get_recording(self.audio)
+        text = self.store.get_text(recording)
+        if text is None and os.path.exists(self.fname):
+            # First time in the project, take the text file along
+            self.store.import_file(self.audio, self.fname)
+            text = self.store.get_text(recording)
+        if text is None:
+            raise IOError('no transcription of %s' % self.audio)
+        data = text.encode('utf-8')
+        return io.BytesIO(data), len(data)
+
+
+class Paragraph(object):
+    """A line of the buffer, and the row it is stored in (None if new)."""
+    __slots__ = ('id', 'seq')
+
+    def __init__(self, id=None, seq=None):
+        self.id = id
+        self.seq = seq
+
+
+class ParagraphList(object):
+    """The Paragraph of every line of a buffer, in blocks, so inserting
+    and deleting lines moves the entries of a block instead of all of
+    them.
+
+    """
+    BLOCK = 2048    # Entries per block when they are split
+
+    def __init__(self, entries=()):
+        self.blocks = self.split(list(entries)) or [[]]
+        self.length = sum(len(block) for block in self.blocks)
+
+    def split(self, entries):
+        return [entries[i:i + self.BLOCK]
+                for i in range(0, len(entries), self.BLOCK)]
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.blocks)
+
+    def __getitem__(self, line):
+        number, index = self.locate(line)
+        block = self.blocks[number]
+        if not 0 <= index < len(block):
+            raise IndexError(line)
+        return block[index]
+
+    def locate(self, line):
+        """Return the number of the block with line, and its index in
+        the block.  The end of the list is the end of the last block.
+
+        """
+        for number, block in enumerate(self.blocks):
+            if line < len(block):
+                return number, line
+            line -= len(block)
+        return len(self.blocks) - 1, len(self.blocks[-1]) + line
+
+    def select(self, lines):
+        """Return the entries of lines, a sorted list of line numbers."""
+        entries = []
+        start = 0
+        lines = iter(lines)
+        line = next(lines, None)
+        for block in self.blocks:
+            end = start + len(block)
+            while line is not None and line < end:
+                entries.append(block[line - start])
+                line = next(lines, None)
+            if line is None:
+                break
+            start = end
+        return entries
+
+    def insert(self, line, entries):
+        """Insert the list entries before line."""
+        number, index = self.locate(line)
+        block = self.blocks[number]
+        block[index:index] = entries
+        self.length += len(entries)
+        if len(block) > 2 * self.BLOCK:
+            self.blocks[number:number + 1] = self.split(block)
+
+    def delete(self, start, end):
+        """Remove the entries of the lines from start to end, and return
+        them.
+
+        """
+        removed = []
+        number, index = self.locate(start)
+        count = end - start
+        while count > 0 and number < len(self.blocks):
+            block = self.blocks[number]
+            part = block[index:index + count]
+            del block[index:index + count]
+            removed.extend(part)
+            count -= len(part)
+            if not block and len(self.blocks) > 1:
+                del self.blocks[number]
+            else:
+                number += 1
+            index = 0
+        self.length -= len(removed)
+        return removed
+
+
+class StoreJournal(object):
+    """Write the edits made to a transcription buffer into a ProjectStore.
+
+    It follows the buffer line by line: the lines an edit touches are
+    marked dirty, and only those are written, in a single transaction on
+    a short timer or when saving.  It can be used where a
+    journal.Journal is.
+
+    Keyword arguments:
+    store -- the ProjectStore
+    audio -- the audio file of the recording
+    fname -- name the transcription is saved as
+
+    """
+    FLUSH_INTERVAL = 500        # ms between writes of pending edits
+
+    def __init__(self, store, audio, fname=None):
+        self.store = store
+        self.audio = audio
+        self.fname = fname or transcription_for(audio)
+        self.recording = store.get_recording(audio)
+        self.buffer = None
+        self.handlers = []
+        self.lines = ParagraphList()
+        self.dirty = set()      # Line numbers
+        self.deleted = []
+        self.flush_id = None
+        self.job = None         # As journal.Journal, nothing in background
+
+    def attach(self, buffer):
+        """Start writing the edits made to buffer, which has the
+        transcription in the store.
+
+        """
+        self.buffer = buffer
+        self.lines = ParagraphList(
+            Paragraph(id, seq) for id, seq, text in
+            self.store.get_paragraphs(self.recording))
+        count = buffer.get_line_count()
+        if len(self.lines) != count:
+            # Not what is stored (there was nothing): store it all
+            with self.store.db:
+                self.store.delete_paragraphs(entry.id for entry in self.lines)
+            self.lines = ParagraphList(Paragraph() for i in range(count))
+            self.dirty.update(range(count))
+            self.schedule_flush()
+
+        self.handlers = [
+            buffer.connect('insert-text', self.on_insert_text),
+            buffer.connect('delete-range', self.on_delete_range),
+        ]
+
+    def on_insert_text(self, buffer, iter, text, length):
+        line = iter.get_line()
+        count = text.count('\n')
+        if count:
+            # The dirty lines after it move down
+            self.dirty = set(dirty + count if dirty > line else dirty
+                             for dirty in self.dirty)
+            self.lines.insert(line + 1, [Paragraph() for i in range(count)])
+            self.dirty.update(range(line + 1, line + 1 + count))
+        self.dirty.add(line)
+        self.schedule_flush()
+
+    def on_delete_range(self, buffer, start, end):
+        first, last = sorted((start.get_line(), end.get_line()))
+        if last > first:
+            for entry in self.lines.delete(first + 1, last + 1):
+                if entry.id is not None:
+                    self.deleted.append(entry.id)
+            # The dirty lines after it move up
+            count = last - first
+            self.dirty = set(dirty - count if dirty > last else dirty
+                             for dirty in self.dirty
+                             if not first < dirty <= last)
+        self.dirty.add(first)
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.flush_id is None:
+            self.flush_id = GLib.timeout_add(self.FLUSH_INTERVAL, self.flush)
+
+    def flush(self):
+        self.write_pending()
+        return False
+
+    def number(self, run):
+        """Give sequence numbers to the new paragraphs of run, a list of
+        (line, entry) of consecutive lines, between those of their
+        neighbours.
+
+        """
+        count = len(run)
+        first = run[0][0]
+        last = first + count
+        low = self.lines[first - 1].seq if first > 0 else None
+        high = self.lines[last].seq if last < len(self.lines) else None
+        if low is None:
+            low = (high if high is not None else 0) - GAP * (count + 1)
+        if high is None:
+            high = low + GAP * (count + 1)
+
+        step = (high - low) // (count + 1)
+        if step < 1:
+            # No room left in the gap
+            self.store.renumber(self.lines)
+            return
+        for line, entry in run:
+            low += step
+            entry.seq = low
+
+    def get_line(self, line):
+        start = self.buffer.get_iter_at_line(line)
+        end = start.copy()
+        if not end.ends_line():
+            end.forward_to_line_end()
+        return self.buffer.get_text(start, end, True)
+
+    def write_pending(self):
+        """Write the paragraphs edited since the last time."""
+        if self.flush_id is not None:
+            GLib.source_remove(self.flush_id)
+            self.flush_id = None
+
+        if not self.dirty and not self.deleted:
+            return
+
+        store = self.store
+        with store.db:
+            store.delete_paragraphs(self.deleted)
+            self.deleted = []
+
+            lines = sorted(self.dirty)
+            edited = list(zip(lines, self.lines.select(lines)))
+            self.dirty = set()
+
+            # The new paragraphs come in runs of consecutive lines
+            run = []
+            for line, entry in edited:
+                if entry.seq is not None:
+                    continue
+                if run and line != run[-1][0] + 1:
+                    self.number(run)
+                    run = []
+                run.append((line, entry))
+            if run:
+                self.number(run)
+
+            for line, entry in edited:
+                text = self.get_line(line)
+                if entry.id is None:
+                    entry.id = store.insert_paragraph(self.recording,
+                                                      entry.seq, text)
+                else:
+                    store.update_paragraph(self.recording, entry.id, text)
+
+    def compact(self):
+        """Saving writes what is pending at once."""
+        self.write_pending()
+
+    def close(self):
+        for handler in self.handlers:
+            self.buffer.handler_disconnect(handler)
+        self.handlers = []
+        self.write_pending()
+
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='transcribe --store',
+        description='Keep the transcriptions of a project in a database.')
+    parser.add_argument('database', help='project database')
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser(
+        'import', help='copy the transcriptions next to the audio files '
+                       'into the database')
+    command.add_argument('paths', nargs='+', metavar='PATH',
+                         help='audio files and directories')
+    command = commands.add_parser(
+        'export', help='write the transcriptions in the database next to '
+                       'the audio files')
+    command.add_argument('paths', nargs='*', metavar='PATH',
+                         help='audio files and directories (default: all)')
+    command = commands.add_parser(
+        'marks', help='list the audio marks between two times')
+    command.add_argument('start', type=timecode.parse, help='h:mm:ss.f')
+    command.add_argument('end', type=timecode.parse, help='h:mm:ss.f')
+    command.add_argument('-n', '--limit', type=int,
+                         help='maximum number of marks')
+    args = parser.parse_args(argv)
+
+    store = ProjectStore(args.database)
+    status = 0
+    try:
+        if args.command == 'import':
+            for filename in find_files(args.paths):
+                try:
+                    store.import_file(filename)
+                except IOError as e:
+                    print('%s: %s' % (filename, e), file=sys.stderr)
+                    status = 1
+        elif args.command == 'export':
+            filenames = (find_files(args.paths) if args.paths
+                         else store.get_recordings())
+            for filename in filenames:
+                if not store.export_file(filename):
+                    print('%s: no transcription' % filename, file=sys.stderr)
+        elif args.command == 'marks':
+            for mark in store.marks_between(args.start, args.end,
+                                            args.limit):
+                print('%s %s %s' % (timecode.format(mark.position),
+                                    mark.audio, mark.text))
+        else:
+            parser.print_usage(sys.stderr)
+            status = 1
+    finally:
+        store.close()
+    return status
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Times as written in transcriptions, and audio marks.
+
+A time is written h:mm:ss.f, where f is either tenths of second (one
+digit) or milliseconds (three digits), and an audio mark is a time
+between '#', like #0:01:23.4# or #0:01:23.456#.
+
+Documents are scanned in a single pass with SCANNER, which also finds
+what looks like a mark but is not one (#1:2:3#, #0:01:02,5#, ...); those
+are reported as malformed, with their offset, instead of ignored.
+
+"""
+
+import re
+
+TENTHS = 1          # Digits of the fraction of second
+MILLISECONDS = 3
+
+# A mark, or something between '#' made of digits, colons, spaces, dots
+# and commas that was meant to be one
+SCANNER = re.compile(r'#(?:(\d+):(\d\d):(\d\d)\.(\d{3}|\d)|'
+                     r'([ \t]*\d+[ \t]*:[\d \t:.,]*))#')
+
+LOOSE = re.compile(r'\s*(\d+)\s*:\s*(\d{1,2})\s*:\s*(\d{1,2})'
+                   r'(?:\s*[.,]\s*(\d+))?\s*$')
+
+SCALE = {TENTHS: 10, MILLISECONDS: 1000}
+FORMATS = {TENTHS: '%d:%02d:%02d.%01d', MILLISECONDS: '%d:%02d:%02d.%03d'}
+
+
+def format(seconds, digits=TENTHS):
+    """Return seconds written as h:mm:ss.f, rounded to digits decimals."""
+    scale = SCALE[digits]
+    units = int(seconds * scale + 0.5) if seconds and seconds > 0 else 0
+    seconds = units // scale
+    return FORMATS[digits] % (seconds // 3600, seconds // 60 % 60,
+                              seconds % 60, units % scale)
+
+
+def format_mark(seconds, digits=TENTHS):
+    """Return the audio mark of a time, #h:mm:ss.f#."""
+    return '#%s#' % format(seconds, digits)
+
+
+def format_many(times, digits=TENTHS):
+    """Return a list with the times written as h:mm:ss.f."""
+    scale = SCALE[digits]
+    template = FORMATS[digits]
+    result = []
+    append = result.append
+    for seconds in times:
+        units = int(seconds * scale + 0.5) if seconds > 0 else 0
+        seconds = units // scale
+        append(template % (seconds // 3600, seconds // 60 % 60, seconds % 60,
+                           units % scale))
+    return result
+
+
+def to_seconds(match):
+    """Return the time of a SCANNER match, or None if it is malformed."""
+    h, m, s, fraction = match.group(1, 2, 3, 4)
+    if h is None or m >= '60' or s >= '60':
+        return None
+    return (int(h) * 3600 + int(m) * 60 + int(s) +
+            int(fraction) / float(10 ** len(fraction)))
+
+
+def parse(string):
+    """Return the seconds of a time, written h:mm:ss.f with or without
+    the '#' around.
+
+    Raise ValueError if string is not a valid time.
+
+    """
+    mark = string if string.startswith('#') else '#%s#' % string
+    match = SCANNER.match(mark)
+    seconds = None
+    if match is not None and match.end() == len(mark):
+        seconds = to_seconds(match)
+    if seconds is None:
+        raise ValueError('malformed time: %r' % string)
+    return seconds
+
+
+def parse_many(strings):
+    """Return a list with the seconds of every time in strings.
+
+    Raise ValueError with the index of the first malformed one.
+
+    """
+    result = []
+    append = result.append
+    match = SCANNER.match
+    for string in strings:
+        mark = string if string[:1] == '#' else '#%s#' % string
+        m = match(mark)
+        if m is None or m.end() != len(mark):
+            seconds = None
+        else:
+            seconds = to_seconds(m)
+        if seconds is None:
+            raise ValueError('malformed time: %r at index %d' %
+                             (string, len(result)))
+        append(seconds)
+    return result
+
+
+def finditer(text):
+    """Yield (offset, length, seconds) for every mark in text, where
+    seconds is None if the mark is malformed.
+
+    """
+    for match in SCANNER.finditer(text):
+        start = match.start()
+        yield start, match.end() - start, to_seconds(match)
+
+
+def scan(text):
+    """Return the audio marks of text and the malformed ones.
+
+    The marks are a list of (offset, position, length) tuples, where
+    offset is the character offset of the mark in text and position the
+    time it refers to, in seconds.  The malformed marks are a list of
+    (offset, mark) tuples.
+
+    """
+    marks, malformed = [], []
+    for match in SCANNER.finditer(text):
+        seconds = to_seconds(match)
+        if seconds is None:
+            malformed.append((match.start(), match.group(0)))
+        else:
+            marks.append((match.start(), seconds, match.end() - match.start()))
+    return marks, malformed
+
+
+def normalize_mark(mark):
+    """Return the canonical form of a loosely written mark, keeping
+    milliseconds if it has more than one decimal.  Return None if it
+    cannot be understood.
+
+    """
+    match = LOOSE.match(mark.strip('#'))
+    if match is None:
+        return None
+
+    h, m, s, fraction = match.groups()
+    if int(m) >= 60 or int(s) >= 60:
+        return None
+    fraction = fraction or '0'
+    seconds = (int(h) * 3600 + int(m) * 60 + int(s) +
+               float('0.%s' % fraction))
+    digits = TENTHS if len(fraction) == 1 else MILLISECONDS
+    return format_mark(seconds, digits)
+
+
+def normalize(text):
+    """Return text with the malformed marks that can be understood
+    rewritten in the canonical form.
+
+    """
+    def replace(match):
+        if to_seconds(match) is not None:
+            return match.group(0)
+        return normalize_mark(match.group(0)) or match.group(0)
+
+    return SCANNER.sub(replace, text)
@@ -20,27 +20,42 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import os.path
-import codecs
-import re
 
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('GtkSource', '4')
-from gi.repository import Gtk, GObject, Gdk, GLib, GtkSource
+from gi.repository import Gtk, Gdk, GLib, GtkSource
 
+from . import export
+from . import highlight
+from . import jobs
+from . import journal
 from . import pipeline
+from . import profile
+from . import remote
+from . import search
+from . import segment
+from . import store
+from . import timecode
+from . import waveform
+from .loader import transcription_for
+from .marks import MarkIndex
+from .project import PipelinePool
 
 
 class Transcribe:
     APP_NAME = 'Transcribe'
-    PLAY_IMAGE = Gtk.Image(stock=Gtk.STOCK_MEDIA_PLAY)
-    PAUSE_IMAGE = Gtk.Image(stock=Gtk.STOCK_MEDIA_PAUSE)
     leading_time = 3  # After a pause, start 3 seconds before it was stopped
     AUDIO_STEP = 1.0
     AUDIO_PAGE = 4.0
     SPEED_STEP = 0.01
     SPEED_PAGE = 0.05
     SPACE_BELOW_LINES = 10  # Pixels between paragraphs
+    FRAME_INTERVAL = 1 / 60.0  # Shortest interval between slider updates
+    UNFOCUSED_INTERVAL = 0.5  # Idem, when the window is not focused
+    MARK_DIGITS = timecode.TENTHS  # Or timecode.MILLISECONDS
+    MALFORMED_MARK = 'malformed-mark'  # Category of the line marks
+    LARGE_DOCUMENT = 20000  # Lines, past which only the shown are styled
 
     def __init__(self, filename, ui='transcribe.ui', *args):
         builder = Gtk.Builder()
@@ -52,20 +67,33 @@ class Transcribe:
 
         sw = builder.get_object('scrolledwindow')
 
+        # The syntax highlighting is set once the window is shown
         self.textbuffer = GtkSource.Buffer()
-        self.lm = GtkSource.LanguageManager()
-        path = self.lm.get_search_path()
-        path.insert(0, os.path.join(os.path.dirname(__file__)))
-        self.lm.set_search_path(path)
-        self.textbuffer.set_language(self.lm.get_language('transcribe'))
+        self.lm = None
+        self.highlighter = None
+        self.marks = MarkIndex(self.textbuffer)
 
         self.sourceview = GtkSource.View.new_with_buffer(self.textbuffer)
         self.sourceview.set_wrap_mode(Gtk.WrapMode.WORD_CHAR)
         self.sourceview.set_show_line_marks(True)
         self.sourceview.set_pixels_below_lines(self.SPACE_BELOW_LINES)
+
+        # Flag the lines with what looks like an audio mark but is not one
+        attributes = GtkSource.MarkAttributes()
+        attributes.set_icon_name('dialog-warning')
+        attributes.connect('query-tooltip-text', self.on_malformed_tooltip)
+        self.sourceview.set_mark_attributes(self.MALFORMED_MARK, attributes, 0)
         sw.add(self.sourceview)
 
+        self.load_progress = builder.get_object('load_progress')
+        self.loader = None
+        self.load_started = None
+        self.journal = None
+        self.store = None   # Transcriptions in a database, see set_store()
+
         self.play_button = builder.get_object('play_button')
+        self.play_image = Gtk.Image(stock=Gtk.STOCK_MEDIA_PLAY)
+        self.pause_image = Gtk.Image(stock=Gtk.STOCK_MEDIA_PAUSE)
         self.label_time = builder.get_object('label_time')
         self.label_duration = builder.get_object('label_duration')
 
@@ -73,6 +101,17 @@ class Transcribe:
         #self.audio_slider.set_range(0, 100)
         self.audio_slider.set_increments(self.AUDIO_STEP, self.AUDIO_PAGE)
 
+        # Draw the waveform behind the audio slider, when NumPy is there
+        self.waveform = None
+        if waveform.numpy is not None:
+            self.waveform = waveform.WaveformView()
+            box_audio = builder.get_object('box_audio')
+            box_audio.remove(self.audio_slider)
+            overlay = Gtk.Overlay()
+            overlay.add(self.waveform)
+            overlay.add_overlay(self.audio_slider)
+            box_audio.pack_start(overlay, True, True, 0)
+
         box_speed = builder.get_object('box_speed')
         self.speed_slider = Gtk.Scale(orientation=Gtk.Orientation.HORIZONTAL)
         # self.speed_slider = builder.get_object('speed_slider')
@@ -91,6 +130,8 @@ class Transcribe:
         self.window.add_events(Gdk.EventType.KEY_PRESS |
                                Gdk.EventType.KEY_RELEASE)
         self.window.connect('key-press-event', self.on_window_key_press)
+        self.window.connect('window-state-event', self.on_window_state_event)
+        self.window.connect('notify::is-active', self.on_window_state_event)
         self.add_accelerator(self.play_button, '<ctrl>p', 'clicked')
         self.add_accelerator(self.play_button, '<ctrl>space', 'clicked')
         self.add_accelerator(self.play_button, 'F5', 'clicked')
@@ -103,9 +144,178 @@ class Transcribe:
         title = '%s - %s' % (self.APP_NAME, os.path.basename(filename))
         self.window.set_title(title)
 
-        self.audio = pipeline.Audio(filename)
-        self.audio.connect('update-duration', self.on_audio_duration)
-        self.audio.connect('finished', self.on_audio_finished)
+        self.filename = filename
+        self.transcription_file = 'transcription.txt'
+        self.segment_analyzer = None
+        self.utterance_threshold = segment.THRESHOLD
+        self.loop_start = None
+        self.loop_end = None
+        self.speed_update = None
+
+        # In project mode, the players of the files around the current one
+        self.project = None
+        self.pool = None
+        self.audio_setup = None
+
+        # Where to go once the transcription is loaded, after a search
+        self.pending_jump = None
+        self.search_window = None
+
+        # The player is created once the window is shown, see main()
+        self.audio = None
+        self.audio_handlers = []
+        self.start_position = None
+        self.play_button.set_sensitive(False)
+
+        self.peak_analyzer = None
+
+    def start_audio(self):
+        """Create the player of the current file.
+
+        It is not done until the window and the transcription are shown,
+        as initializing GStreamer loads the registry of its plug-ins.
+
+        """
+        audio = pipeline.Audio(self.filename)
+        if self.audio_setup is not None:
+            self.audio_setup(audio)
+        self.set_audio(audio)
+        if self.start_position is not None:
+            audio.seek(self.start_position)  # Jumped to meanwhile
+            self.start_position = None
+        if self.project is not None:
+            self.start_pool()
+        self.update_loop()
+        self.play_button.set_sensitive(True)
+        self.start_peaks()
+        profile.stop('audio-ready', profile.started)
+
+    def set_audio_setup(self, setup):
+        """Call setup with the player of every file, to configure it."""
+        self.audio_setup = setup
+        if self.audio is not None:
+            setup(self.audio)
+
+    def set_audio(self, audio):
+        """Make audio the player of the window."""
+        for handler in self.audio_handlers:
+            self.audio.disconnect(handler)
+        if self.audio is not None:
+            self.audio.set_position_updates(None)
+
+        self.audio = audio
+        self.audio_handlers = [
+            audio.connect('update-duration', self.on_audio_duration),
+            audio.connect('finished', self.on_audio_finished),
+            audio.connect('update-position', self.update_audio_slider),
+            audio.connect('update-loop', self.on_audio_loop),
+        ]
+
+    def start_peaks(self):
+        """Get the waveform of the current file."""
+        if self.waveform is None:
+            return
+
+        if self.peak_analyzer is not None:
+            # Still analyzing the previous file
+            self.peak_analyzer.disconnect_by_func(self.on_peaks_finished)
+            self.peak_analyzer.cancel()
+            self.peak_analyzer = None
+        self.waveform.set_peaks(None)
+        if remote.is_remote(self.filename):
+            return  # It would download the whole file first
+
+        self.peak_analyzer = waveform.PeakAnalyzer(self.filename)
+        self.peak_analyzer.connect('finished', self.on_peaks_finished)
+        self.peak_analyzer.start()
+
+    def set_project(self, project, setup=None):
+        """Transcribe the files of a project, starting with the current one.
+
+        Keyword arguments:
+        project -- the project.Project; its current file is the one the
+                   window was created with
+        setup -- function called with the player of every file
+
+        """
+        self.project = project
+        if setup is not None:
+            self.audio_setup = setup
+        if self.audio is not None:
+            self.start_pool()
+
+    def set_store(self, project_store):
+        """Keep the transcriptions in a store.ProjectStore instead of in
+        text files.  Call before main().
+
+        """
+        self.store = project_store
+
+    def start_pool(self):
+        """Keep the players of the files around the current one ready."""
+        self.pool = PipelinePool(setup=self.audio_setup)
+        self.pool.add(self.filename, self.audio)
+        self.pool.prepare(self.project.get_neighbours())
+
+    def switch_file(self, step):
+        """Go to the file step places away in the project."""
+        if self.project is None:
+            return
+
+        filename = self.project.move(step)
+        if filename is not None:
+            self.open_file(filename)
+
+    def open_file(self, filename, fname=None):
+        """Transcribe another audio file.
+
+        Keyword arguments:
+        filename -- audio file
+        fname -- its transcription (default: the audio file with a .txt
+                 extension)
+
+        """
+        if self.audio is not None and self.audio.is_playing():
+            self.on_play_activate()
+        self.clear_loop()
+
+        self.filename = filename
+        title = '%s - %s' % (self.APP_NAME, os.path.basename(filename))
+        self.window.set_title(title)
+
+        if self.project is not None and filename in self.project.files:
+            self.project.index = self.project.files.index(filename)
+
+        if self.audio is not None:
+            self.open_audio(filename)
+        else:
+            self.start_position = None  # start_audio() will open it
+
+        self.load_transcription(fname or transcription_for(filename))
+        if self.pool is not None:
+            self.pool.prepare(self.project.get_neighbours())
+
+    def open_audio(self, filename):
+        if self.pool is not None:
+            # Before the next one opens the audio device
+            self.audio.preroll(silent=True)
+            self.set_audio(self.pool.get(filename))
+        else:
+            previous = self.audio
+            audio = pipeline.Audio(filename)
+            if self.audio_setup is not None:
+                self.audio_setup(audio)
+            self.set_audio(audio)
+            previous.close()
+
+        self.audio.preroll()
+        duration = self.audio.get_duration()
+        if duration > 0:
+            self.on_audio_duration(self.audio, duration)
+        self.update_audio_slider(self.audio, max(self.audio.get_position(), 0))
+        self.label_time.set_text(
+            timecode.format(self.audio_slider.get_value()))
+        self.start_peaks()
 
     def on_audio_duration(self, playbin, duration):
         """Get audio duration and update the widgets that depends on that.
@@ -116,7 +326,14 @@ class Transcribe:
 
         """
         self.audio_slider.set_range(0, duration)
-        self.label_duration.set_text(self.time_to_string(duration))
+        self.label_duration.set_text(timecode.format(duration))
+        if self.audio is not None and self.audio.is_playing():
+            self.start_position_updates()  # A pixel is another step
+        if self.waveform is not None:
+            self.waveform.set_duration(duration)
+
+    def on_peaks_finished(self, analyzer, peaks):
+        self.waveform.set_peaks(peaks)
 
     def on_window_delete_event(self, *args):
         """Release resources and quit the application."""
@@ -135,7 +352,13 @@ class Transcribe:
             # Don't close the window, go back to the application
             return True
 
-        self.audio.stop()
+        if self.journal is not None:
+            self.journal.close()
+        if self.pool is not None:
+            self.pool.clear()
+        elif self.audio is not None:
+            self.audio.stop()
+        jobs.SCHEDULER.close()
         Gtk.main_quit(*args)
 
     def on_window_key_press(self, window, event, *args):
@@ -164,9 +387,33 @@ class Transcribe:
             if event.keyval == Gdk.KEY_t:
                 self.add_audio_mark()
             if event.keyval == Gdk.KEY_s:
-                self.save_transcription(self.textbuffer)
+                self.save_transcription(self.textbuffer,
+                                        self.transcription_file)
             if event.keyval == Gdk.KEY_o:
-                self.load_transcription(self.textbuffer)
+                self.load_transcription(self.transcription_file)
+            elif event.keyval == Gdk.KEY_u:
+                self.find_utterances()
+            elif event.keyval == Gdk.KEY_e:
+                self.export_transcription()
+            elif event.keyval == Gdk.KEY_f:
+                self.show_search()
+            elif event.keyval == Gdk.KEY_Page_Down:
+                self.switch_file(1)
+            elif event.keyval == Gdk.KEY_Page_Up:
+                self.switch_file(-1)
+            else:
+                return False
+            return True
+
+        # A-B loop: from the position, or with Shift from the audio marks
+        if event.keyval in (Gdk.KEY_F9, Gdk.KEY_F10, Gdk.KEY_Escape):
+            shift = bool(event.state & Gdk.ModifierType.SHIFT_MASK)
+            if event.keyval == Gdk.KEY_F9:
+                self.set_loop_start(shift)
+            elif event.keyval == Gdk.KEY_F10:
+                self.set_loop_end(shift)
+            elif self.loop_start is not None or self.loop_end is not None:
+                self.clear_loop()
             else:
                 return False
             return True
@@ -216,31 +463,29 @@ class Transcribe:
         return False
 
     def follow_if_link(self, textview, iter):
-        """Looks at all tags covering the position of iter in the
-           text view, and if one of them is an audio position, update
-           the audio slider.
+        """Looks for an audio mark covering the position of iter in the
+           text view, and if there is one, update the audio slider.
 
         Keyword arguments:
         textview -- GtkTextView with the text
         iter -- Position in the buffer to look at
 
         """
-        tags = iter.get_tags()
-        for tag in tags:
-            position = tag.get_data('position')
-            if position is not None:
-                self.audio_slider.set_value(position)
-                break
+        mark = self.marks.mark_at_iter(iter)
+        if mark is not None:
+            self.audio_slider.set_value(mark.position)
 
     def add_audio_mark(self):
         """Add a text with the current audio position"""
+        if self.audio is None:
+            return
         position = self.audio.get_position()
 
         # pipeline is not ready and does not know position
         if position < 0:
             return
 
-        time_string = '#%s#' % self.time_to_string(position)
+        time_string = timecode.format_mark(position, self.MARK_DIGITS)
         self.add_audio_mark_to_buffer(position, time_string)
 
     def add_audio_mark_to_buffer(self, position, time_string):
@@ -254,29 +499,194 @@ class Transcribe:
         """
         mark = self.textbuffer.get_insert()
         iter = self.textbuffer.get_iter_at_mark(mark)
+        offset = iter.get_offset()
+
+        self.textbuffer.insert(iter, time_string)
+        self.marks.add(offset, position, len(time_string))
+
+    def find_utterances(self):
+        """Look for the utterances in the audio in background, to offer
+        placing an audio mark at the start of each one.
+
+        """
+        if segment.numpy is None:
+            return
+        if (self.segment_analyzer is not None and
+                self.segment_analyzer.is_running()):
+            return
+
+        threshold = self.ask_utterance_threshold()
+        if threshold is None:
+            return
+        self.utterance_threshold = threshold
 
-        tag = self.textbuffer.create_tag(None)
-        tag.position = position
+        self.segment_analyzer = segment.SegmentAnalyzer(self.filename,
+                                                        threshold)
+        self.segment_analyzer.connect('finished', self.on_utterances_found)
+        self.segment_analyzer.start()
 
-        self.textbuffer.insert_with_tags(iter, time_string, tag)
+    def ask_utterance_threshold(self):
+        """Ask for the level above which the audio is speech, starting
+        from the last one used. Returns None if the user cancels.
+
+        """
+        dialog = Gtk.MessageDialog(self.window, Gtk.DialogFlags.MODAL,
+                                   Gtk.MessageType.QUESTION,
+                                   Gtk.ButtonsType.OK_CANCEL,
+                                   'Find utterances')
+        dialog.format_secondary_text('Frames louder than this level '
+                                     '(dBFS) are speech. Lower it for '
+                                     'quiet recordings, raise it for '
+                                     'noisy ones.')
+        spin = Gtk.SpinButton.new_with_range(-90.0, 0.0, 1.0)
+        spin.set_digits(1)
+        spin.set_value(self.utterance_threshold)
+        spin.set_activates_default(True)
+        dialog.set_default_response(Gtk.ResponseType.OK)
+        dialog.get_message_area().pack_start(spin, False, False, 0)
+        spin.show()
+
+        response = dialog.run()
+        spin.update()
+        threshold = spin.get_value()
+        dialog.destroy()
+
+        if response != Gtk.ResponseType.OK:
+            return None
+        return threshold
+
+    def on_utterances_found(self, analyzer, starts):
+        if not starts or analyzer.filename != self.filename:
+            return
+
+        msg = 'Insert an audio mark at the start of each one?'
+        dialog = Gtk.MessageDialog(self.window, Gtk.DialogFlags.MODAL,
+                                   Gtk.MessageType.QUESTION,
+                                   Gtk.ButtonsType.YES_NO,
+                                   '%d utterances found.' % len(starts))
+        dialog.format_secondary_text(msg)
+        response = dialog.run()
+        dialog.destroy()
+
+        if response != Gtk.ResponseType.YES:
+            return
+
+        # A single undo removes all of them
+        self.textbuffer.begin_user_action()
+        for position in starts:
+            time_string = timecode.format_mark(position, self.MARK_DIGITS)
+            self.add_audio_mark_to_buffer(position, time_string)
+            self.textbuffer.insert_at_cursor('\n')
+        self.textbuffer.end_user_action()
+
+    def get_loop_position(self):
+        position = self.audio.get_position() if self.audio else -1
+        if position < 0:
+            position = self.audio_slider.get_value()
+        return position
+
+    def set_loop_start(self, from_mark=False):
+        """Set the start of the A-B loop at the current position, or at
+        the audio mark before it.
+
+        """
+        position = self.get_loop_position()
+        if from_mark:
+            mark = self.marks.before(position)
+            if mark is None:
+                return
+            position = mark.position
+
+        self.loop_start = position
+        if self.loop_end is not None and self.loop_end <= position:
+            self.loop_end = None
+        self.update_loop()
+
+    def set_loop_end(self, from_mark=False):
+        """Set the end of the A-B loop at the current position, or at
+        the audio mark after it.
+
+        """
+        position = self.get_loop_position()
+        if from_mark:
+            if self.loop_start is not None:
+                position = max(position, self.loop_start)
+            # Skip the mark the position was rounded to
+            resolution = 1.0 / timecode.SCALE[self.MARK_DIGITS]
+            mark = self.marks.after(position + resolution / 2)
+            if mark is None:
+                return
+            position = mark.position
+
+        self.loop_end = position
+        if self.loop_start is not None and self.loop_start >= position:
+            self.loop_start = None
+        self.update_loop()
+
+    def clear_loop(self):
+        self.loop_start = None
+        self.loop_end = None
+        self.update_loop()
+
+    def update_loop(self):
+        if self.audio is None:
+            self.show_loop()  # Applied by start_audio()
+        elif self.loop_start is not None and self.loop_end is not None:
+            self.audio.set_loop(self.loop_start, self.loop_end)
+        else:
+            self.audio.clear_loop()
+            self.show_loop()
+
+    def show_loop(self):
+        """Show the ends of the A-B loop in the audio slider."""
+        self.audio_slider.clear_marks()
+        if self.loop_start is not None:
+            self.audio_slider.add_mark(self.loop_start,
+                                       Gtk.PositionType.BOTTOM, 'A')
+        if self.loop_end is not None:
+            self.audio_slider.add_mark(self.loop_end,
+                                       Gtk.PositionType.BOTTOM, 'B')
+
+    def on_audio_loop(self, audio, loop):
+        if loop is None:
+            if self.loop_start is not None and self.loop_end is not None:
+                # We went out of the loop
+                self.loop_start = None
+                self.loop_end = None
+        else:
+            self.loop_start, self.loop_end = loop
+        self.show_loop()
 
     def on_audio_slider_change(self, slider, *args):
         seek_time_secs = slider.get_value()
-        self.audio.seek(seek_time_secs)
-        self.label_time.set_text(self.time_to_string(seek_time_secs))
+        if self.audio is not None:
+            self.audio.seek(seek_time_secs)
+        self.label_time.set_text(timecode.format(seek_time_secs))
 
     def on_audio_finished(self, playbin):
-        self.play_button.set_image(self.PLAY_IMAGE)
+        self.stop_position_updates()
+        self.play_button.set_image(self.play_image)
 
     def on_speed_slider_change(self, slider, *args):
-        self.audio.set_speed(slider.get_value())
+        # Dragging the slider changes it many times per frame; apply only
+        # the last value once the events are handled
+        if self.speed_update is None:
+            self.speed_update = GLib.idle_add(self.on_speed_update)
+
+    def on_speed_update(self):
+        self.speed_update = None
+        if self.audio is not None:
+            self.audio.set_speed(self.speed_slider.get_value())
+        return False
 
     def on_speed_slider_grab_focus(self, *args):
         pass
 
     def on_play_activate(self, *args):
+        if self.audio is None:
+            return  # Not ready yet
         if not self.audio.is_playing():
-            self.play_button.set_image(self.PAUSE_IMAGE)
+            self.play_button.set_image(self.pause_image)
 
             seek_time_secs = self.audio_slider.get_value() - self.leading_time
             seek_time_secs = seek_time_secs if seek_time_secs > 0 else 0
@@ -284,10 +694,10 @@ class Transcribe:
             speed = self.speed_slider.get_value()
 
             self.audio.play(speed, seek_time_secs)
-
-            GObject.timeout_add(100, self.update_audio_slider)
+            self.start_position_updates()
         else:
-            self.play_button.set_image(self.PLAY_IMAGE)
+            self.play_button.set_image(self.play_image)
+            self.stop_position_updates()
             self.audio.pause()
 
     def add_accelerator(self, widget, accelerator, signal='activate'):
@@ -298,92 +708,328 @@ class Transcribe:
             widget.add_accelerator(signal, self.accelerators, key, mod,
                                    Gtk.AccelFlags.VISIBLE)
 
-    def update_audio_slider(self):
-        if not self.audio.is_playing():
-            # Remove this timer event
-            return False
+    def start_position_updates(self):
+        """Have the player tell the position while playing.
 
-        position = self.audio.get_position()
+        The slider is updated when the position moves it by a pixel, but
+        not more than once a frame.  When the window is not focused,
+        updates are throttled, and when it is minimized they stop until
+        it is shown again.
 
-        # pipeline is not ready and does not know position
-        if position < 0:
-            return True
+        """
+        gdk_window = self.window.get_window()
+        if (gdk_window is not None and
+                gdk_window.get_state() & Gdk.WindowState.ICONIFIED):
+            self.stop_position_updates()
+            return
+
+        adjustment = self.audio_slider.get_adjustment()
+        width = max(self.audio_slider.get_allocated_width(), 1)
+        step = (adjustment.get_upper() - adjustment.get_lower()) / width
+
+        interval = self.FRAME_INTERVAL
+        if not self.window.is_active():
+            interval = self.UNFOCUSED_INTERVAL
+        self.audio.set_position_updates(step, interval)
 
+    def stop_position_updates(self):
+        if self.audio is not None:
+            self.audio.set_position_updates(None)
+
+    def on_window_state_event(self, *args):
+        """Minimizing, restoring or (un)focusing changes how often the
+        audio slider is updated.
+
+        """
+        if self.audio is not None and self.audio.is_playing():
+            self.start_position_updates()
+        return False
+
+    @profile.timed('update-audio-slider')
+    def update_audio_slider(self, audio, position):
         # block seek handler so we don't seek when we set_value()
         self.audio_slider.handler_block_by_func(self.on_audio_slider_change)
         self.audio_slider.set_value(position)
         self.audio_slider.handler_unblock_by_func(self.on_audio_slider_change)
 
-        return True
+    @profile.timed('save-transcription')
+    def save_transcription(self, buffer, fname='transcription.txt'):
+        """Save the transcription.
 
-    def time_to_string(self, tm=0):
-        """Return a human readable string of time.
+        Edits are journaled as they happen, so when the journal is active
+        saving just compacts it into the file in background.
 
-        Keyword arguments:
-        tm -- time in seconds (with decimals [miliseconds])
+        """
+        if self.journal is not None and self.journal.fname == fname:
+            self.journal.compact()
+            return True
+
+        start, end = buffer.get_start_iter(), buffer.get_end_iter()
+
+        content = buffer.get_text(start, end, include_hidden_chars=True)
+        result = GLib.file_set_contents(fname, content.encode('utf-8'))
+
+        return result
+
+    def export_transcription(self):
+        """Ask for a file and export the transcription as timed segments,
+        in the format of its extension.
 
         """
-        if tm is None:
-            tm = 0
+        dialog = Gtk.FileChooserDialog('Export transcription', self.window,
+                                       Gtk.FileChooserAction.SAVE,
+                                       (Gtk.STOCK_CANCEL,
+                                        Gtk.ResponseType.CANCEL,
+                                        Gtk.STOCK_SAVE,
+                                        Gtk.ResponseType.ACCEPT))
+        dialog.set_do_overwrite_confirmation(True)
+        for name, pattern in (('SubRip subtitles', '*.srt'),
+                              ('WebVTT subtitles', '*.vtt'),
+                              ('JSON Lines', '*.jsonl')):
+            file_filter = Gtk.FileFilter()
+            file_filter.set_name(name)
+            file_filter.add_pattern(pattern)
+            dialog.add_filter(file_filter)
+
+        base = os.path.splitext(os.path.abspath(self.transcription_file))[0]
+        dialog.set_current_folder(os.path.dirname(base))
+        dialog.set_current_name(os.path.basename(base) + '.srt')
+
+        response = dialog.run()
+        output = dialog.get_filename()
+        dialog.destroy()
+        if response != Gtk.ResponseType.ACCEPT or not output:
+            return
 
-        hours, rm = divmod(tm, 3600)
-        minutes, rm = divmod(rm, 60)
-        seconds, ms = divmod(rm, 1)
-        ms = ms * 10  # Get only one digit for miliseconds
+        format = export.format_for(output)
+        if format is None:
+            format = 'srt'
+            output += '.srt'
 
-        time_string = '%0d:%02d:%02d.%01d' % (hours, minutes, seconds, ms)
-        return time_string
+        # What is typed meanwhile is not exported
+        start, end = self.textbuffer.get_bounds()
+        text = self.textbuffer.get_text(start, end, True)
+        duration = self.audio.get_duration() if self.audio else -1
 
-    def string_to_time(self, time_string):
-        """Convert a human readable string of time to time in seconds.
+        job = jobs.SCHEDULER.submit(jobs.THREAD, export.export_text_job,
+                                    (text, output, format,
+                                     duration if duration > 0 else None),
+                                    priority=jobs.PRIORITY_HIGH)
+        job.connect('failed', self.on_export_failed)
+
+    def on_export_failed(self, job, error):
+        dialog = Gtk.MessageDialog(self.window, Gtk.DialogFlags.MODAL,
+                                   Gtk.MessageType.ERROR,
+                                   Gtk.ButtonsType.CLOSE,
+                                   'Cannot export the transcription.')
+        dialog.format_secondary_text(error)
+        dialog.run()
+        dialog.destroy()
+
+    def show_search(self):
+        """Search the transcriptions of the project, or of the files
+        next to the current one.
+
+        """
+        if self.search_window is None:
+            if self.project is not None:
+                paths = self.project.files
+            else:
+                paths = [os.path.dirname(self.filename)]
+            self.search_window = search.SearchWindow(paths, self.window)
+            self.search_window.connect('hit-activated', self.on_search_hit)
+        self.search_window.present()
+
+    def on_search_hit(self, window, hit):
+        if hit.audio is None:
+            dialog = Gtk.MessageDialog(self.window, Gtk.DialogFlags.MODAL,
+                                       Gtk.MessageType.INFO,
+                                       Gtk.ButtonsType.CLOSE,
+                                       'There is no audio for this '
+                                       'transcription.')
+            dialog.format_secondary_text(hit.transcription)
+            dialog.run()
+            dialog.destroy()
+            return
+        self.jump_to(hit.transcription, hit.offset, hit.position, hit.audio)
+
+    def jump_to(self, fname, offset, position=None, filename=None):
+        """Show the text at offset in the transcription fname, with the
+        audio at position.
 
         Keyword arguments:
-        time_string -- time in format '%0d:%02d:%02d.%01d'
+        fname -- transcription file
+        offset -- character offset in the transcription
+        position -- time of the audio, in seconds, if known
+        filename -- audio file of the transcription (default: the
+                    current one)
 
         """
-        try:
-            (h, m, s, ms) = re.split(r'#(\d{1,2}):(\d{2}):(\d{2}).(\d)#',
-                                     time_string)[1:-1]
-        except:
-            return 0.0
+        self.pending_jump = (offset, position)
+        if filename is not None and filename != self.filename:
+            self.open_file(filename, fname)
+        elif fname != self.transcription_file:
+            self.load_transcription(fname)
+        elif self.loader is None:
+            self.apply_jump()
+        # Otherwise it is still loading; on_load_finished() will jump
+
+    def apply_jump(self):
+        offset, position = self.pending_jump
+        self.pending_jump = None
+
+        iter = self.textbuffer.get_iter_at_offset(offset)
+        self.textbuffer.place_cursor(iter)
+        self.sourceview.scroll_to_mark(self.textbuffer.get_insert(),
+                                       0.1, False, 0, 0)
+        if position is not None:
+            # Seeks before the preroll are applied once it is done
+            if self.audio is not None:
+                self.audio.seek(position)
+            else:
+                self.start_position = position
+            self.update_audio_slider(self.audio, position)
+            self.label_time.set_text(timecode.format(position))
+        self.window.present()
 
-        tm = int(h)*3600 + int(m)*60 + int(s) + float(ms)/10
+    def load_transcription(self, fname='transcription.txt'):
+        """Load a transcription in background.
 
-        return tm
+        The buffer is filled from idle callbacks; meanwhile the text view
+        is read-only and a progress bar shows how much has been loaded.
 
-    def save_transcription(self, buffer, fname='transcription.txt'):
-        start, end = buffer.get_start_iter(), buffer.get_end_iter()
+        """
+        if self.loader is not None:
+            self.loader.cancel()
+        self.transcription_file = fname
+
+        # Highlighted once loaded, as it depends on its size
+        self.textbuffer.set_highlight_syntax(False)
+        if self.highlighter is not None:
+            self.highlighter.close()
+            self.highlighter = None
+
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+        start, end = self.textbuffer.get_bounds()
+        self.textbuffer.remove_source_marks(start, end, self.MALFORMED_MARK)
+
+        self.load_started = profile.start()
+        if self.store is not None:
+            self.loader = store.StoreLoader(self.textbuffer, self.marks,
+                                            self.store, self.filename)
+        else:
+            # Recovers the edits of the last session first, if it did
+            # not exit cleanly
+            self.loader = journal.RecoveringLoader(self.textbuffer,
+                                                   self.marks, fname)
+        self.loader.connect('progress', self.on_load_progress)
+        self.loader.connect('finished', self.on_load_finished)
+
+        if not self.loader.start():
+            # Nothing to load yet, but keep what is typed from now on
+            self.loader = None
+            self.load_started = None
+            # Left by a load cancelled part way
+            self.load_progress.hide()
+            self.sourceview.set_editable(True)
+            self.textbuffer.begin_not_undoable_action()
+            self.textbuffer.set_text('')
+            self.textbuffer.end_not_undoable_action()
+            self.start_journal(fname)
+            self.update_highlighting()
+            return
 
-        content = buffer.get_text(start, end, include_hidden_chars=True)
-        result = GLib.file_set_contents(fname, bytes(content))
+        self.sourceview.set_editable(False)
+        self.load_progress.set_fraction(0)
+        self.load_progress.show()
 
-        return result
+    def on_load_progress(self, loader, fraction):
+        self.load_progress.set_fraction(fraction)
 
-    def load_transcription(self, fname='transcription.txt'):
-        regex = re.compile(r'#\d{1,2}:\d{2}:\d{2}.\d#')
+    def on_load_finished(self, loader):
+        profile.stop('load-transcription', self.load_started)
+        self.load_started = None
+        self.loader = None
+        self.load_progress.hide()
+        self.sourceview.set_editable(True)
+        self.textbuffer.place_cursor(self.textbuffer.get_start_iter())
+        self.start_journal(loader.fname)
+        self.update_highlighting()
 
-        try:
-            with codecs.open(fname, 'rU', 'utf-8') as f:
-                start, end = self.textbuffer.get_bounds()
-                self.textbuffer.delete(start, end)
-                for line in f.readlines():
-                    audio_marks = regex.findall(line)
-                    audio_marks.reverse()
-                    for text in regex.split(line):
-                        end = self.textbuffer.get_end_iter()
-                        self.textbuffer.insert(end, text)
-
-                        # insert audio mark if any
-                        if len(audio_marks) > 0:
-                            mark = audio_marks.pop()
-                            position = self.string_to_time(mark)
-                            self.add_audio_mark_to_buffer(position, mark)
-        except IOError:
-            content = ''
+        # Otherwise the highlighter flags them, as it gets to their lines
+        if not self.is_large_document():
+            for offset, mark in loader.malformed:
+                iter = self.textbuffer.get_iter_at_offset(offset)
+                self.textbuffer.create_source_mark(None, self.MALFORMED_MARK,
+                                                   iter)
+
+        if self.pending_jump is not None:
+            self.apply_jump()
+
+    def is_large_document(self):
+        return self.textbuffer.get_line_count() > self.LARGE_DOCUMENT
+
+    def update_highlighting(self):
+        """Highlight the whole transcription with its GtkSource language
+        or, when it is large, only the lines around the ones shown.
+
+        """
+        if self.lm is None or self.loader is not None:
+            return  # Once the window is shown and the transcription loaded
+
+        large = self.is_large_document()
+        self.textbuffer.set_highlight_syntax(not large)
+        if large and self.highlighter is None:
+            self.highlighter = highlight.ViewportHighlighter(
+                self.sourceview, self.textbuffer.get_style_scheme(),
+                self.MALFORMED_MARK)
+        elif not large and self.highlighter is not None:
+            self.highlighter.close()
+            self.highlighter = None
+
+    def on_malformed_tooltip(self, attributes, mark):
+        return 'Malformed audio mark, expected #h:mm:ss.f#'
+
+    def start_journal(self, fname):
+        if self.store is not None:
+            self.journal = store.StoreJournal(self.store, self.filename, fname)
+        else:
+            self.journal = journal.Journal(fname)
+        self.journal.attach(self.textbuffer)
+
+    def on_first_draw(self, window, cr):
+        # From the start of the profile to the first frame of the window
+        window.disconnect_by_func(self.on_first_draw)
+        profile.stop('first-frame', profile.started)
+        GLib.idle_add(self.finish_startup)
+
+    def finish_startup(self):
+        """Do what is not needed to show the window: the syntax
+        highlighting and the player, which initializes GStreamer.
+
+        """
+        self.lm = GtkSource.LanguageManager()
+        path = self.lm.get_search_path()
+        path.insert(0, os.path.join(os.path.dirname(__file__)))
+        self.lm.set_search_path(path)
+        self.textbuffer.set_language(self.lm.get_language('transcribe'))
+        self.update_highlighting()
+
+        self.start_audio()
+        return False
 
     def main(self):
-        self.load_transcription()
+        self.window.connect_after('draw', self.on_first_draw)
         self.window.show_all()
+        if self.loader is not None or self.journal is not None:
+            pass  # Already loading, from jump_to()
+        elif self.project is not None or self.store is not None:
+            self.load_transcription(transcription_for(self.filename))
+        else:
+            self.load_transcription()
         Gtk.main()
 
 
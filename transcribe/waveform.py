@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+#
+# Transcribe, an Audio Transcription Tool
+#
+# Copyright (C) 2012 Germán Poo-Caamaño <gpoo@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Waveform peaks of an audio file, cached on disk.
+
+The audio is decoded once and summarized in min/max/RMS peaks at
+several zoom levels.  The peaks are stored in a sidecar file that is
+memory-mapped when the same file is opened again.
+
+The sidecar is a little-endian header (magic, version, sample rate,
+samples per peak in the finest level, zoom factor between levels and
+number of levels), the number of peaks of each level, and then every
+level as an array of (min, max, rms) float32 triplets.
+
+"""
+
+from __future__ import print_function
+
+import struct
+import sys
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GObject
+
+# NumPy is optional: without it there is no waveform
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import cache
+from . import jobs
+from . import pipeline
+
+RATE = 8000     # Sample rate used for the analysis
+BIN = 80        # Samples per peak in the finest level (10 ms)
+FACTOR = 4      # Every level is FACTOR times coarser than the previous one
+LEVELS = 6      # 10 ms to 10.24 s per peak
+
+MAGIC = b'TRPK'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIII')
+
+
+class Peaks(object):
+    """Min/max/RMS peaks of an audio file at several zoom levels.
+
+    Keyword arguments:
+    rate -- sample rate the peaks were computed at
+    bin -- samples per peak in the finest level
+    factor -- zoom factor between levels
+    levels -- list of (n, 3) arrays with the (min, max, rms) peaks
+
+    """
+    def __init__(self, rate, bin, factor, levels):
+        self.rate = rate
+        self.bin = bin
+        self.factor = factor
+        self.levels = levels
+
+    def get_bin_duration(self, level):
+        """Return the seconds covered by a peak of a given level."""
+        return float(self.bin * self.factor ** level) / self.rate
+
+    def get_duration(self):
+        return len(self.levels[0]) * self.get_bin_duration(0)
+
+    def get_level(self, seconds_per_pixel):
+        """Return the coarsest level that has at least a peak per pixel."""
+        level = 0
+        while (level + 1 < len(self.levels) and
+               self.get_bin_duration(level + 1) <= seconds_per_pixel):
+            level += 1
+        return level
+
+    def get_columns(self, start, end, width):
+        """Return the peaks of the time range [start, end) resampled to
+        width columns, as three arrays: mins, maxs and rms.
+
+        """
+        level = self.get_level(float(end - start) / width)
+        data = self.levels[level]
+        if not len(data) or width <= 0:
+            return numpy.zeros((3, max(width, 0)), dtype=numpy.float32)
+
+        edges = numpy.linspace(start, end, width + 1)[:-1]
+        index = (edges / self.get_bin_duration(level)).astype(numpy.intp)
+        index = numpy.clip(index, 0, len(data) - 1)
+
+        mins = numpy.minimum.reduceat(data[:, 0], index)
+        maxs = numpy.maximum.reduceat(data[:, 1], index)
+        rms = numpy.maximum.reduceat(data[:, 2], index)
+        return mins, maxs, rms
+
+
+def reduce_level(level, factor=FACTOR):
+    """Return the next, factor times coarser, level of peaks."""
+    full = len(level) // factor * factor
+    groups = level[:full].reshape(-1, factor, 3)
+    result = numpy.column_stack((groups[:, :, 0].min(axis=1),
+                                 groups[:, :, 1].max(axis=1),
+                                 numpy.sqrt((groups[:, :, 2] ** 2).mean(axis=1))))
+    if full < len(level):
+        tail = level[full:]
+        result = numpy.vstack((result, [[tail[:, 0].min(), tail[:, 1].max(),
+                                         numpy.sqrt((tail[:, 2] ** 2).mean())]]))
+    return result.astype(numpy.float32)
+
+
+def compute(blocks, rate=RATE, bin=BIN, factor=FACTOR, levels=LEVELS):
+    """Compute the peaks of a stream of mono float32 sample blocks."""
+    chunks = []
+    rest = numpy.zeros(0, dtype=numpy.float32)
+
+    for data in blocks:
+        samples = numpy.frombuffer(data, dtype=numpy.float32)
+        if len(rest):
+            samples = numpy.concatenate((rest, samples))
+        full = len(samples) // bin * bin
+        rest = samples[full:]
+        if full:
+            frames = samples[:full].reshape(-1, bin)
+            chunks.append(numpy.column_stack((
+                frames.min(axis=1), frames.max(axis=1),
+                numpy.sqrt((frames * frames).mean(axis=1)))))
+
+    if len(rest):
+        chunks.append([[rest.min(), rest.max(),
+                        numpy.sqrt((rest * rest).mean())]])
+
+    if chunks:
+        level = numpy.vstack(chunks).astype(numpy.float32)
+    else:
+        level = numpy.zeros((0, 3), dtype=numpy.float32)
+
+    result = [level]
+    for i in range(1, levels):
+        result.append(reduce_level(result[-1], factor))
+
+    return Peaks(rate, bin, factor, result)
+
+
+def save(path, peaks):
+    def write(f):
+        header = HEADER.pack(MAGIC, VERSION, peaks.rate, peaks.bin,
+                             peaks.factor, len(peaks.levels))
+        counts = struct.pack('<%dI' % len(peaks.levels),
+                             *[len(level) for level in peaks.levels])
+        f.write(header + counts)
+        f.write(b'\0' * (-(len(header) + len(counts)) % 16))
+        for level in peaks.levels:
+            f.write(level.astype('<f4').tobytes())
+
+    cache.replace(path, write)
+
+
+def load(path):
+    """Memory-map the peaks stored in path.  Return None if the file is
+    missing or it is not a peaks file we understand.
+
+    """
+    try:
+        data = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+    except (IOError, OSError, ValueError):
+        return None
+
+    if len(data) < HEADER.size:
+        return None
+
+    magic, version, rate, bin, factor, count = \
+        HEADER.unpack(data[:HEADER.size].tobytes())
+    if magic != MAGIC or version != VERSION:
+        return None
+
+    offset = HEADER.size + 4 * count
+    counts = struct.unpack('<%dI' % count,
+                           data[HEADER.size:offset].tobytes())
+    offset += -offset % 16
+
+    levels = []
+    for n in counts:
+        size = n * 3 * 4
+        if offset + size > len(data):
+            return None
+        levels.append(data[offset:offset + size].view('<f4').reshape(n, 3))
+        offset += size
+
+    return Peaks(rate, bin, factor, levels)
+
+
+def get_peaks(filename):
+    """Return the peaks of filename, computing and caching them if needed.
+
+    This decodes the whole file when there is no cached copy, so it
+    should not be called from the main loop.
+
+    """
+    path = cache.cache_path('peaks', filename, '.peaks')
+    peaks = load(path)
+    if peaks is None:
+        decoder = pipeline.Decoder(filename, RATE)
+        peaks = compute(decoder.blocks())
+        save(path, peaks)
+    return peaks
+
+
+def cache_peaks(job, filename):
+    """Compute the peaks of filename into the cache (worker process)."""
+    get_peaks(filename)
+
+
+class PeakAnalyzer(GObject.GObject):
+    """Get the peaks of an audio file in background.
+
+    They are computed in a worker process, and memory-mapped from the
+    cache once they are there.  'finished' is emitted in the main loop
+    with the peaks; straight from start() when they are in the cache
+    already.
+
+    """
+    __gsignals__ = {
+        'finished': (GObject.SIGNAL_RUN_FIRST, None, (object,))
+    }
+
+    def __init__(self, filename):
+        GObject.GObject.__init__(self)
+        self.filename = filename
+        self.path = cache.cache_path('peaks', filename, '.peaks')
+        self.job = None
+
+    def start(self):
+        peaks = load(self.path)
+        if peaks is not None:
+            self.emit('finished', peaks)
+            return
+
+        self.job = jobs.SCHEDULER.submit(
+            jobs.PROCESS, cache_peaks, (self.filename,),
+            key=('peaks', self.filename), priority=jobs.PRIORITY_LOW)
+        self.job.connect('finished', self.on_job_finished)
+        self.job.connect('failed', self.on_job_failed)
+
+    def cancel(self):
+        """Do not emit 'finished'.  The peaks are still computed if they
+        are being computed already, so they are cached for next time.
+
+        """
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+
+    def on_job_finished(self, job, result):
+        self.job = None
+        peaks = load(self.path)
+        if peaks is not None:
+            self.emit('finished', peaks)
+
+    def on_job_failed(self, job, error):
+        self.job = None
+        print('Cannot analyze %s: %s' % (self.filename, error),
+              file=sys.stderr)
+
+
+class WaveformView(Gtk.DrawingArea):
+    """Draw the waveform of the audio, meant to be behind the slider."""
+    HEIGHT = 40
+
+    def __init__(self):
+        Gtk.DrawingArea.__init__(self)
+        self.peaks = None
+        self.duration = 0
+        self.set_size_request(-1, self.HEIGHT)
+        self.connect('draw', self.on_draw)
+
+    def set_peaks(self, peaks):
+        self.peaks = peaks
+        self.queue_draw()
+
+    def set_duration(self, duration):
+        self.duration = duration
+        self.queue_draw()
+
+    def on_draw(self, widget, cr):
+        if self.peaks is None:
+            return False
+
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        duration = self.duration or self.peaks.get_duration()
+        if width <= 0 or duration <= 0:
+            return False
+
+        mins, maxs, rms = self.peaks.get_columns(0, duration, width)
+        middle = height / 2.0
+        color = self.get_style_context().get_color(Gtk.StateFlags.NORMAL)
+
+        cr.set_line_width(1)
+        cr.set_source_rgba(color.red, color.green, color.blue, 0.2)
+        for x in range(width):
+            cr.move_to(x + 0.5, middle - maxs[x] * middle)
+            cr.line_to(x + 0.5, middle - mins[x] * middle + 1)
+        cr.stroke()
+
+        cr.set_source_rgba(color.red, color.green, color.blue, 0.35)
+        for x in range(width):
+            cr.move_to(x + 0.5, middle - rms[x] * middle)
+            cr.line_to(x + 0.5, middle + rms[x] * middle + 1)
+        cr.stroke()
+
+        return False